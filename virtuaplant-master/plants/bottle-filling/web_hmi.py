@@ -0,0 +1,53 @@
+#!/usr/bin/env python
+
+import argparse
+import logging
+import os
+import sys
+
+# Shared VirtuaPlant modules
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'common'))
+from web_hmi_server import Control, Point, WebHMI, run
+from bottle_tags import *
+
+logging.basicConfig()
+log = logging.getLogger()
+log.setLevel(logging.INFO)
+
+PLANT_IP = "127.0.0.1"
+PLANT_PORT = 502
+HTTP_PORT = 8080
+
+YES_NO = {1: ('YES', 'green'), 0: ('NO', 'red')}
+
+points = [
+    Point('bottle', "Bottle in position", PLC_TAG_LIMIT_SWITCH, YES_NO),
+    Point('nozzle', "Nozzle Status", PLC_TAG_NOZZLE, {1: ('OPEN', 'green'), 0: ('CLOSED', 'red')}),
+    Point('motor', "Motor Status", PLC_TAG_MOTOR, {1: ('ON', 'green'), 0: ('OFF', 'red')}),
+    Point('level', "Level Hit", PLC_TAG_LEVEL_SENSOR, YES_NO),
+    Point('process', "Process Status", PLC_TAG_RUN, {1: ('RUNNING', 'green'), 0: ('STOPPED', 'red')}),
+]
+
+controls = [
+    Control("Process", PLC_TAG_RUN, [("Run", 1), ("Stop", 0)]),
+]
+
+parser = argparse.ArgumentParser(description='Bottle-filling factory - Web HMI - VirtuaPlant')
+parser.add_argument("-t", action="store", dest="server_addr", default=PLANT_IP,
+                    help="Modbus server IP address of the plant")
+parser.add_argument("-m", action="store", dest="server_port", type=int, default=PLANT_PORT,
+                    help="Modbus server port of the plant")
+parser.add_argument("-p", action="store", dest="http_port", type=int, default=HTTP_PORT,
+                    help="HTTP port to serve the HMI on")
+parser.add_argument("-l", action="store", dest="listen_addr", default="127.0.0.1",
+                    help="Address to serve the HMI on")
+
+
+def main():
+    args = parser.parse_args()
+    hmi = WebHMI("Bottle-filling process status", args.server_addr, args.server_port,
+                 points, controls)
+    run(hmi, args.http_port, args.listen_addr)
+
+if __name__ == '__main__':
+    sys.exit(main())
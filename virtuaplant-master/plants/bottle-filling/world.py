@@ -10,19 +10,60 @@ import logging
 from twisted.internet import reactor
 
 # - Modbus
-from pymodbus.server.async import StartTcpServer
 from pymodbus.device import ModbusDeviceIdentification
-from pymodbus.datastore import ModbusSequentialDataBlock
-from pymodbus.datastore import ModbusSlaveContext, ModbusServerContext
 from pymodbus.transaction import ModbusRtuFramer, ModbusAsciiFramer
 
+# - Argument parsing
+import argparse
+
 # - World Simulator
-import sys, random
+import os, sys, random
 import pygame
 from pygame.locals import *
 from pygame.color import *
 import pymunk
 
+# Shared VirtuaPlant modules
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'common'))
+from events import EventLog
+from frame_timer import FrameTimer
+from metrics import StartMetricsServer, WorldMetrics
+from profiler import SamplingProfiler, StartProfiler, name_thread
+from plant_server import StartPlantServer, create_context
+
+#########################################
+# Arguments
+#########################################
+# Override Argument parser to throw error and generate help message
+# if undefined args are passed
+class MyParser(argparse.ArgumentParser):
+    def error(self, message):
+        sys.stderr.write('error: %s\n' % message)
+        self.print_help()
+        sys.exit(2)
+
+parser = MyParser(
+    description = 'This Python script starts the bottle-filling World Server',
+    epilog = '',
+    add_help = True)
+parser.add_argument("--capture", action = "store", dest="capture",
+                    help = "Record the Modbus traffic into this capture log")
+parser.add_argument("--events", action = "store", dest="events",
+                    help = "Log process events (bottle filled, water spilled, ...) into this file for impact.py")
+parser.add_argument("--frame-overlay", action = "store_true", dest="frame_overlay",
+                    help = "Show where each frame's time goes over the world view")
+parser.add_argument("--frame-stats", action = "store", dest="frame_stats",
+                    help = "Write frame phase timings as JSON lines into this file ('-' for stdout)")
+parser.add_argument("--metrics", action = "store", dest="metrics", type=int,
+                    help = "Serve Prometheus metrics on this local port")
+parser.add_argument("--profile", action = "store", dest="profile",
+                    help = "Profile the world on SIGUSR1, writing the results into this directory")
+parser.add_argument("--profile-seconds", action = "store", dest="profile_seconds", type=float, default=10,
+                    help = "Seconds a SIGUSR1 profile runs for (default 10)")
+parser.add_argument("--profile-register", action = "store_true", dest="profile_register",
+                    help = "Also profile for as many seconds as are written into holding register 98")
+args = parser.parse_args()
+
 #########################################
 # Logging
 #########################################
@@ -30,6 +71,13 @@ logging.basicConfig()
 log = logging.getLogger()
 log.setLevel(logging.INFO)
 
+# Process events for impact.py, if asked for
+events = EventLog(args.events) if args.events else None
+
+def world_event(name, value=''):
+    if events is not None:
+        events.record(name, value)
+
 #########################################
 # Util Functions
 #########################################
@@ -48,13 +96,17 @@ SCREEN_WIDTH = 800 # 600
 SCREEN_HEIGHT = 350
 FPS=75.0 #50.0
 
+# Time spent in each phase of a frame; tag I/O is its own phase
+frame_timer = FrameTimer(1/FPS, stream=args.frame_stats)
+PLCSetTag = frame_timer.timed('tag_io', PLCSetTag)
+PLCGetTag = frame_timer.timed('tag_io', PLCGetTag)
+
+# Frame times, particles, collisions and Modbus traffic for --metrics
+metrics = WorldMetrics(frame_timer)
+
 MODBUS_SERVER_PORT=502
 
-PLC_TAG_LEVEL_SENSOR = 0x1
-PLC_TAG_LIMIT_SWITCH = 0x2
-PLC_TAG_MOTOR = 0x3
-PLC_TAG_NOZZLE = 0x4
-PLC_TAG_RUN = 0x10
+from bottle_tags import *
 
 # Global Variables
 global bottles
@@ -184,25 +236,31 @@ def draw_lines(screen, lines, color=THECOLORS['dodgerblue4']):
         pygame.draw.lines(screen, color, False, [p1,p2])
 
 # Collision handlers
+@metrics.counted
 def no_collision(space, arbiter, *args, **kwargs):
     return False
 
+@metrics.counted
 def level_ok(space, arbiter, *args, **kwargs):
 
     log.debug("Level reached")
     PLCSetTag(PLC_TAG_LIMIT_SWITCH, 0) # Limit Switch Release, Fill Bottle
     PLCSetTag(PLC_TAG_LEVEL_SENSOR, 1) # Level Sensor Hit, Bottle Filled
     PLCSetTag(PLC_TAG_NOZZLE, 0) # Close nozzle
+    world_event('level_ok')
     return False
 
+@metrics.counted
 def bottle_in_place(space, arbiter, *args, **kwargs):
 
     log.debug("Bottle in place")
     PLCSetTag(PLC_TAG_LIMIT_SWITCH, 1)
     PLCSetTag(PLC_TAG_LEVEL_SENSOR, 0)
     PLCSetTag(PLC_TAG_NOZZLE, 1) # Open nozzle
+    world_event('bottle_in_place')
     return False
 
+@metrics.counted
 def add_new_bottle(space, arbiter, *args, **kwargs):
     global bottles
     bottles.append(add_bottle(space))
@@ -210,6 +268,7 @@ def add_new_bottle(space, arbiter, *args, **kwargs):
     return False
 
 def runWorld():
+    name_thread('world')
     pygame.init()
     screen = pygame.display.set_mode((SCREEN_WIDTH, SCREEN_HEIGHT))
     pygame.display.set_caption("Bottle-Filling Factory - World View - VirtuaPlant")
@@ -247,21 +306,27 @@ def runWorld():
     balls = []
 
     ticks_to_next_ball = 1
+    metrics.particles['water'] = balls
+    metrics.particles['bottle'] = bottles
 
     fontBig = pygame.font.SysFont(None, 40)
     fontMedium = pygame.font.SysFont(None, 26)
     fontSmall = pygame.font.SysFont(None, 18)
 
     while running:
+        frame_timer.frame()
         clock.tick(FPS)
+        frame_timer.mark('wait')
 
         for event in pygame.event.get():
             if event.type == QUIT:
                 running = False
             elif event.type == KEYDOWN and event.key == K_ESCAPE:
                 running = False
+        frame_timer.mark('input')
 
         screen.fill(THECOLORS["white"])
+        frame_timer.mark('draw')
 
         if PLCGetTag(PLC_TAG_RUN):
 
@@ -277,10 +342,12 @@ def runWorld():
                 if not PLCGetTag(PLC_TAG_LIMIT_SWITCH):
                     PLCSetTag(PLC_TAG_MOTOR, 1)
 
+                frame_timer.mark('logic')
                 if ticks_to_next_ball <= 0 and PLCGetTag(PLC_TAG_NOZZLE):
                     ticks_to_next_ball = 1
                     ball_shape = add_ball(space)
                     balls.append(ball_shape)
+                frame_timer.mark('spawn')
 
                 # Move the bottles
                 if PLCGetTag(PLC_TAG_MOTOR) == 1:
@@ -288,25 +355,33 @@ def runWorld():
                         bottle[0].body.position.x += 0.25
         else:
             PLCSetTag(PLC_TAG_MOTOR, 0)
+        frame_timer.mark('logic')
 
         # Draw water balls
+        for ball in balls:
+            draw_ball(screen, ball)
+        frame_timer.mark('draw')
+
         # Remove off-screen balls
         balls_to_remove = []
         for ball in balls:
             if ball.body.position.y < 150 or ball.body.position.x > SCREEN_WIDTH+150:
                 balls_to_remove.append(ball)
 
-            draw_ball(screen, ball)
-
         for ball in balls_to_remove:
+            if ball.body.position.y < 150 and ball.body.position.x <= SCREEN_WIDTH:
+                # Fell past the bottles to the floor
+                world_event('water_spilled')
             space.remove(ball, ball.body)
             balls.remove(ball)
+        frame_timer.mark('cull')
 
         # Draw bottles
         for bottle in bottles:
             if bottle[0].body.position.x > SCREEN_WIDTH+150 or bottle[0].body.position.y < 150:
                 space.remove(bottle, bottle[0].body)
                 bottles.remove(bottle)
+                world_event('bottle_exit')
                 continue
             draw_lines(screen, bottle)
 
@@ -324,9 +399,14 @@ def runWorld():
         screen.blit(title, (10, 40))
         screen.blit(name, (10, 10))
         screen.blit(instructions, (SCREEN_WIDTH-115, 10))
+        if args.frame_overlay:
+            frame_timer.draw(screen, (SCREEN_WIDTH - 260, 30))
+        frame_timer.mark('draw')
 
         space.step(1/FPS)
+        frame_timer.mark('physics')
         pygame.display.flip()
+        frame_timer.mark('flip')
 
     # Stop reactor if running
     if reactor.running:
@@ -336,13 +416,7 @@ def runWorld():
 # Modbus Server Code
 #########################################
 
-store = ModbusSlaveContext(
-    di = ModbusSequentialDataBlock(0, [0]*100),
-    co = ModbusSequentialDataBlock(0, [0]*100),
-    hr = ModbusSequentialDataBlock(0, [0]*100),
-    ir = ModbusSequentialDataBlock(0, [0]*100))
-
-context = ModbusServerContext(slaves=store, single=True)
+context = create_context()
 
 identity = ModbusDeviceIdentification()
 identity.VendorName  = 'MockPLCs'
@@ -354,9 +428,19 @@ identity.MajorMinorRevision = '1.0'
 
 def startModbusServer():
 
-    StartTcpServer(context, identity=identity, address=(get_ip(), MODBUS_SERVER_PORT))
+    if args.metrics:
+        StartMetricsServer(metrics, args.metrics)
+    if args.profile:
+        StartProfiler(SamplingProfiler(args.profile), args.profile_seconds,
+                      context if args.profile_register else None)
+    StartPlantServer(context, identity=identity, address=(get_ip(), MODBUS_SERVER_PORT),
+                     capture=args.capture, metrics=metrics)
 
 def main():
+    if events is not None:
+        events.start()
+        reactor.addSystemEventTrigger('after', 'shutdown', events.close)
+    reactor.addSystemEventTrigger('after', 'shutdown', frame_timer.close)
     reactor.callInThread(runWorld)
     startModbusServer()
 
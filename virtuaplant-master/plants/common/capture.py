@@ -0,0 +1,218 @@
+#!/usr/bin/env python
+# Modbus traffic capture.
+#
+# A plant server with a Capture records the Modbus TCP bytes it receives
+# and sends, as they come off and go onto the wire, into an append-only
+# binary log:
+#
+#   file     MAGIC, then records back to back
+#   record   '>dBHHBH'  timestamp, direction (0 to the server, 1 from it),
+#                       server port, client port, client host length,
+#                       data length
+#            then the client host (ASCII) and the data
+#
+# The server thread only stamps the bytes and appends them to a bounded
+# queue; a writer thread wakes every FLUSH_INTERVAL and writes what piled
+# up in one go.  Nothing is encoded or decoded on the way in, and the queue
+# is a deque rather than a Queue so the server takes no lock and wakes no
+# thread per message.  When the writer falls behind and the queue fills,
+# records are dropped rather than holding up the server, counted, and the
+# count is logged.
+#
+# read_capture() splits the data back into Modbus messages, one record per
+# request or response with the message decoded, and the command line
+# prints them:
+#
+#   ./capture.py modbus.cap
+#   ./capture.py modbus.cap --function 16 --limit 100
+
+from __future__ import division, print_function
+
+import argparse
+import collections
+import logging
+import struct
+import sys
+import threading
+import time
+
+from plant_messages import PlantClientDecoder, PlantDecoder
+
+log = logging.getLogger(__name__)
+
+MAGIC = b'VPCAP1\r\n'
+RECORD = struct.Struct('>dBHHBH')
+
+# Modbus TCP header: transaction id, protocol id, length, unit id
+MBAP = struct.Struct('>HHHB')
+
+REQUEST = 0
+RESPONSE = 1
+
+# Records waiting for the writer
+QUEUE_SIZE = 100000
+
+# Seconds between writes
+FLUSH_INTERVAL = 0.1
+
+# Seconds between drop warnings
+DROP_REPORT_INTERVAL = 10
+
+CaptureRecord = collections.namedtuple('CaptureRecord', [
+    'time', 'direction', 'client', 'server_port', 'transaction', 'unit',
+    'function_code', 'address', 'values', 'message'])
+
+
+class Capture(object):
+    """Writes the data handed to record() to path from a thread."""
+
+    def __init__(self, path, queue_size=QUEUE_SIZE, flush_interval=FLUSH_INTERVAL):
+        self.path = path
+        self.queue = collections.deque()
+        self.queue_size = queue_size
+        self.flush_interval = flush_interval
+        self.stopping = threading.Event()
+        self.captured = 0
+        self.dropped = 0
+        self.reported_dropped = 0
+        self.last_report = 0
+        self.file = open(path, 'ab')
+        if self.file.tell() == 0:
+            self.file.write(MAGIC)
+        self.thread = threading.Thread(target=self._write_loop, name='capture')
+        self.thread.daemon = True
+        self.thread.start()
+
+    def record(self, direction, client, server_port, data):
+        """Queue bytes sent or received; client is (host, port).  Never
+        blocks."""
+        if len(self.queue) < self.queue_size:
+            self.queue.append((time.time(), direction, client, server_port, data))
+        else:
+            self.dropped += 1
+
+    def close(self):
+        """Write what is queued and close the log."""
+        self.stopping.set()
+        self.thread.join()
+        self.file.close()
+        log.info("Captured %d records to %s, dropped %d"
+                 % (self.captured, self.path, self.dropped))
+
+    def _write_loop(self):
+        while True:
+            stop = self.stopping.wait(self.flush_interval)
+            records = []
+            # popleft is atomic, so the server can keep appending meanwhile
+            for i in range(len(self.queue)):
+                records.append(self._pack(*self.queue.popleft()))
+            if records:
+                self.file.write(b''.join(records))
+                self.file.flush()
+                self.captured += len(records)
+            self._report_drops()
+            if stop:
+                return
+
+    def _pack(self, timestamp, direction, client, server_port, data):
+        host = client[0].encode('ascii')
+        return RECORD.pack(timestamp, direction, server_port, client[1],
+                           len(host), len(data)) + host + data
+
+    def _report_drops(self):
+        now = time.time()
+        if self.dropped > self.reported_dropped and now - self.last_report >= DROP_REPORT_INTERVAL:
+            log.warning("Capture queue full: dropped %d records (%d in all)"
+                        % (self.dropped - self.reported_dropped, self.dropped))
+            self.reported_dropped = self.dropped
+            self.last_report = now
+
+
+def _fields(message):
+    # Address and values of whatever kind of message this is
+    address = getattr(message, 'address', None)
+    for name in ('registers', 'bits', 'values'):
+        values = getattr(message, name, None)
+        if values is not None:
+            return address, list(values)
+    if hasattr(message, 'value'):
+        return address, [message.value]
+    return address, None
+
+
+def _chunks(path):
+    # (timestamp, direction, client, server port, data) as written
+    with open(path, 'rb') as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError("%s is not a capture log" % path)
+        while True:
+            header = f.read(RECORD.size)
+            if len(header) < RECORD.size:
+                # A writer killed mid-record leaves a short tail
+                return
+            (timestamp, direction, server_port, client_port,
+             host_length, data_length) = RECORD.unpack(header)
+            host = f.read(host_length).decode('ascii')
+            data = f.read(data_length)
+            if len(data) < data_length:
+                return
+            yield timestamp, direction, (host, client_port), server_port, data
+
+
+def read_capture(path):
+    """Yield a CaptureRecord for every message in a log, in the order they
+    were sent; a message split over several reads is stamped with the time
+    its last part arrived."""
+    decoders = {REQUEST: PlantDecoder(), RESPONSE: PlantClientDecoder()}
+    streams = {}
+    for timestamp, direction, client, server_port, data in _chunks(path):
+        key = (client, server_port, direction)
+        buf = streams.get(key, b'') + data
+        while len(buf) >= MBAP.size:
+            transaction, protocol, length, unit = MBAP.unpack(buf[:MBAP.size])
+            if protocol != 0 or not 2 <= length <= 254:
+                # Not Modbus; the server dropped the connection on it too
+                buf = b''
+                break
+            end = MBAP.size - 1 + length
+            if len(buf) < end:
+                break
+            pdu = buf[MBAP.size:end]
+            buf = buf[end:]
+            message = decoders[direction].decode(pdu)
+            address, values = _fields(message) if message is not None else (None, None)
+            yield CaptureRecord(timestamp, direction, client, server_port, transaction,
+                                unit, bytearray(pdu[:1])[0], address, values, message)
+        streams[key] = buf
+
+
+def main():
+    logging.basicConfig()
+    log.setLevel(logging.INFO)
+
+    parser = argparse.ArgumentParser(description='VirtuaPlant Modbus capture reader')
+    parser.add_argument("path", help="Capture log written by a plant server")
+    parser.add_argument("--function", type=int, help="Only this function code")
+    parser.add_argument("--client", help="Only this client host")
+    parser.add_argument("--limit", type=int, help="Stop after this many records")
+    args = parser.parse_args()
+
+    shown = 0
+    try:
+        for r in read_capture(args.path):
+            if args.function is not None and r.function_code & 0x7F != args.function:
+                continue
+            if args.client is not None and r.client[0] != args.client:
+                continue
+            print("%.6f %s %s:%d %s :%d tid=%d unit=%d fc=%d address=%s values=%s"
+                  % (r.time, 'req' if r.direction == REQUEST else 'rsp', r.client[0],
+                     r.client[1], '->' if r.direction == REQUEST else '<-', r.server_port,
+                     r.transaction, r.unit, r.function_code, r.address, r.values))
+            shown += 1
+            if args.limit and shown >= args.limit:
+                break
+    except (IOError, ValueError) as ex:
+        parser.error(str(ex))
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,257 @@
+#!/usr/bin/env python
+# Labeled Modbus transaction datasets from headless plant runs.
+#
+# An episode runs a plant's process model against an in-memory datastore
+# on a virtual clock.  An HMI polls it every poll_interval and now and then
+# an operator changes a set point from it; with attack_probability an
+# attacker also runs one of the attacks from the plant's attacks/
+# directory, starting at a random time.  Every transaction is executed as
+# the pymodbus request the real client would send and becomes one record:
+#
+#   episode, time, client, function_code, address, count, values,
+#   exception, label, attack, then the plant's ground truth
+#
+# values are the registers written, or read back for a read.  label is 1
+# for the attacker's own transactions; attack names the attack running at
+# the time, so HMI traffic during an attack can be told apart too.  The
+# ground truth (oil spilled, pressure trips, ...) is the process state as
+# of the last process step, including what the registers do not show.
+#
+# Attacks are the JSON scenarios of scenario.py and the attack scripts,
+# read as a scenario that writes the script's values every attack_period.
+# generate() runs the episodes over all cores (sweep.results) and streams
+# the records into a CSV or Parquet table.
+
+from __future__ import division
+
+import ast
+import glob
+import heapq
+import logging
+import os
+import random
+
+from pymodbus.register_read_message import ReadHoldingRegistersRequest
+from pymodbus.register_write_message import WriteMultipleRegistersRequest
+from pymodbus.register_write_message import WriteSingleRegisterRequest
+
+import sweep
+from plant_server import create_context
+from scenario import Scenario
+
+log = logging.getLogger(__name__)
+
+FIELDS = ['episode', 'time', 'client', 'function_code', 'address', 'count', 'values',
+          'exception', 'label', 'attack']
+
+ATTACKS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '%s', 'attacks')
+
+# Seconds between an attack script's writes, and how long one lasts
+ATTACK_PERIOD = (0.1, 2.0)
+ATTACK_DURATION = (60, 900)
+
+# Mean seconds between operator set point changes
+OPERATOR_INTERVAL = 300
+
+
+class Plant(object):
+    """A plant's process model on a fresh datastore; subclasses fill in
+    the process and what the HMI does with it."""
+
+    # Plant directory, for its attacks
+    name = None
+    tags = None
+    # Seconds between process steps
+    tick = 1.0
+    # HMI clients and the tags they read every poll_interval, [(client,
+    # [tag] or None for all)], read with tags.plan_reads as the HMIs do
+    polls = []
+    poll_interval = 1.0
+    # Set points an operator may write, [{tag: value}]
+    operations = []
+    truth_fields = []
+
+    def __init__(self):
+        self.slave = create_context()[0x00]
+
+    def step(self, now):
+        """Advance the process to now."""
+        raise NotImplementedError
+
+    def truth(self):
+        """Ground truth values in truth_fields order."""
+        return []
+
+
+def script_values(path):
+    """{tag name: value} an attack script hands to AttackEngine, read from
+    its source without running it."""
+    with open(path) as f:
+        tree = ast.parse(f.read(), path)
+    for node in ast.walk(tree):
+        if (isinstance(node, ast.Call) and getattr(node.func, 'id', None) == 'AttackEngine'
+                and len(node.args) > 3 and isinstance(node.args[3], ast.Dict)):
+            values = node.args[3]
+            return dict((key.id, ast.literal_eval(value))
+                        for key, value in zip(values.keys, values.values))
+    raise ValueError("%s does not call AttackEngine with a dict of values" % path)
+
+
+def load_attacks(plant, rng=None):
+    """Scenarios of the attacks in plant/attacks, sorted by name.
+
+    A script becomes a scenario writing its values every attack_period,
+    picked from ATTACK_PERIOD with rng when given.
+    """
+    attacks = []
+    directory = ATTACKS_DIR % plant
+    for path in sorted(glob.glob(os.path.join(directory, '*.json'))):
+        scenario = Scenario.load(path)
+        if scenario.plant == plant:
+            attacks.append(scenario)
+    for path in sorted(glob.glob(os.path.join(directory, '*.py'))):
+        try:
+            values = script_values(path)
+        except (SyntaxError, ValueError) as ex:
+            log.warning("Skipping attack %s: %s" % (path, ex))
+            continue
+        period = rng.uniform(*ATTACK_PERIOD) if rng else ATTACK_PERIOD[0]
+        name = os.path.splitext(os.path.basename(path))[0]
+        attacks.append(Scenario(name, plant, [{'at': 0, 'every': period, 'write': values}]))
+    return sorted(attacks, key=lambda scenario: scenario.name)
+
+
+class Episode(object):
+    """One plant run with its HMI, operator and maybe an attacker."""
+
+    def __init__(self, plant, number, duration, attack=None, attack_start=0.0,
+                 attack_duration=None, rng=None):
+        self.plant = plant
+        self.number = number
+        self.duration = duration
+        self.attack = attack
+        self.attack_start = attack_start
+        self.attack_end = None
+        if attack is not None:
+            end = attack.end()
+            if end is None:
+                end = attack_duration
+            self.attack_end = min(duration, attack_start + end)
+        self.rng = rng or random.Random(number)
+        self.events = []
+        self.order = 0
+        self.records = []
+        self.truth = plant.truth()
+
+    def at(self, time, callback, *args):
+        if time <= self.duration:
+            self.order += 1
+            heapq.heappush(self.events, (time, self.order, callback, args))
+
+    def run(self):
+        """Run the episode; returns its records."""
+        plant = self.plant
+        self.at(0.0, self._step)
+        for client, keys in plant.polls:
+            reads = [(r.address, r.count) for r in plant.tags.plan_reads(keys)]
+            self.at(self.rng.uniform(0, plant.poll_interval), self._poll, client, reads)
+        if plant.operations:
+            self.at(self.rng.expovariate(1.0 / OPERATOR_INTERVAL), self._operate)
+        if self.attack is not None:
+            for step in self.attack.steps:
+                self._schedule(step, 0)
+        while self.events:
+            time, order, callback, args = heapq.heappop(self.events)
+            self.now = time
+            callback(*args)
+        return self.records
+
+    def _step(self):
+        self.plant.step(self.now)
+        self.truth = self.plant.truth()
+        self.at(self.now + self.plant.tick, self._step)
+
+    def _poll(self, client, reads):
+        for address, count in reads:
+            self._execute(client, ReadHoldingRegistersRequest(address, count), 0)
+        # A little jitter, as a real HMI timer has
+        interval = self.plant.poll_interval
+        self.at(self.now + self.rng.uniform(0.95 * interval, 1.05 * interval),
+                self._poll, client, reads)
+
+    def _operate(self):
+        # The HMIs write one register per button press
+        values = self.rng.choice(self.plant.operations)
+        for address, register in sorted(self.plant.tags.encode(values).items()):
+            self._execute('hmi', WriteSingleRegisterRequest(address, register), 0)
+        self.at(self.now + self.rng.expovariate(1.0 / OPERATOR_INTERVAL), self._operate)
+
+    def _schedule(self, step, n):
+        offset = step.offset(n)
+        if offset is None:
+            return
+        time = self.attack_start + offset
+        if time <= self.attack_end:
+            self.at(time, self._attack, step, n)
+
+    def _attack(self, step, n):
+        self._schedule(step, n + 1)
+        if step.reads:
+            response = self._execute('attacker', ReadHoldingRegistersRequest(step.first, step.count), 1)
+            if not hasattr(response, 'registers'):
+                return
+            if not step.holds(step.decode(self.attack.tags, response.registers)):
+                return
+        for address, registers in step.runs:
+            self._execute('attacker', WriteMultipleRegistersRequest(address, registers), 1)
+
+    def _execute(self, client, request, label):
+        response = request.execute(self.plant.slave)
+        if hasattr(request, 'values'):
+            values, count = request.values, request.count
+        elif hasattr(request, 'value'):
+            values, count = [request.value], 1
+        else:
+            values, count = getattr(response, 'registers', []), request.count
+        attack = ''
+        if self.attack is not None and self.attack_start <= self.now <= self.attack_end:
+            attack = self.attack.name
+        self.records.append([self.number, round(self.now, 3), client, request.function_code,
+                             request.address, count, ' '.join(str(v) for v in values),
+                             int(response.function_code > 0x80), label, attack] + self.truth)
+        return response
+
+
+def episode(plant, number, duration=3600, attack_probability=0.5, seed=0, **settings):
+    """Records of episode number of plant (a Plant subclass); settings go
+    to the plant.  Module level, so the sweep workers can run it."""
+    rng = random.Random(seed * 1000003 + number)
+    attack = None
+    start = 0.0
+    length = None
+    if rng.random() < attack_probability:
+        attacks = load_attacks(plant.name, rng)
+        if attacks:
+            attack = rng.choice(attacks)
+            start = rng.uniform(0, 0.8 * duration)
+            length = rng.uniform(*ATTACK_DURATION)
+    return Episode(plant(**settings), number, duration, attack, start, length, rng).run()
+
+
+def generate(path, plant, episodes, processes=None, progress=None, **kwargs):
+    """Write the records of episodes runs of plant to path (.csv or
+    .parquet); returns the number of records.  kwargs go to episode().
+
+    progress(episodes done, records) is called as episodes come in.
+    """
+    points = [dict(kwargs, plant=plant, number=number) for number in range(episodes)]
+    writer = sweep.TableWriter(path, FIELDS + plant.truth_fields)
+    try:
+        # Episodes are big; one per chunk keeps them streaming
+        for done, records in enumerate(sweep.results(episode, points, processes, chunksize=1)):
+            writer.write(records)
+            if progress is not None:
+                progress(done + 1, writer.rows)
+    finally:
+        writer.close()
+    return writer.rows
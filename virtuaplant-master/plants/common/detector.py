@@ -0,0 +1,148 @@
+#!/usr/bin/env python
+# Write-rate anomaly detector for the plant servers.
+#
+# The attack scripts win by writing the same registers over and over, far
+# faster than an HMI button or a PLC ever does; a PLC only writes back the
+# registers it changed.  The detector keeps, for every client host and
+# register written, the writes and the writes repeating the client's last
+# value in the current second, and raises an alarm when either passes its
+# limit:
+#
+#   rate     more than max_rate writes a second
+#   repeat   more than max_repeats writes a second of the value this client
+#            last wrote there
+#
+# Each request costs a dict lookup and a few integer updates per register
+# written, whatever the history.  Registers are kept in the order of the
+# second they were last written in; past MAX_KEYS the one written longest
+# ago is forgotten, so a client writing all over the address space costs
+# no more per request either.  Alarms go to the log and to a block of
+# input registers (function code 4), which clients can read but not clear:
+#
+#   DIAG_ALARMS        alarms raised (wraps at 65536)
+#   DIAG_LAST_KIND     1 rate, 2 repeat
+#   DIAG_LAST_ADDRESS  register of the last alarm
+#   DIAG_LAST_RATE     its writes in the second the alarm was raised
+#   DIAG_LAST_TIME     when, epoch seconds (uint32, two registers)
+#
+# A register alarms at most once a second per client.
+
+import collections
+import logging
+import time
+
+from tagdb import encode_registers
+
+log = logging.getLogger(__name__)
+
+# Input register block the alarms are reported in
+DIAG_ALARMS = 0x00
+DIAG_LAST_KIND = 0x01
+DIAG_LAST_ADDRESS = 0x02
+DIAG_LAST_RATE = 0x03
+DIAG_LAST_TIME = 0x04
+
+RATE = 1
+REPEAT = 2
+KINDS = {RATE: 'rate', REPEAT: 'repeat'}
+
+# Writes a second to one register from one client
+MAX_RATE = 100
+MAX_REPEATS = 20
+
+# Registers tracked before the one written longest ago is forgotten
+MAX_KEYS = 10000
+
+# Write requests: function code -> table written
+WRITE_FUNCTIONS = {
+    0x05: 'coil',      # write single coil
+    0x06: 'register',  # write single register
+    0x0f: 'coil',      # write multiple coils
+    0x10: 'register',  # write multiple registers
+    0x16: 'register',  # mask write (plant_messages)
+    0x41: 'register',  # accumulate
+    0x42: 'register',  # compare and swap
+}
+
+
+def _written(request):
+    # (address, values) of a write request; None for a value the request
+    # computes in the server (mask write, accumulate)
+    values = getattr(request, 'values', None)
+    if values is None:
+        values = [getattr(request, 'value', None)]
+    return request.address, values
+
+
+class WriteRateDetector(object):
+    """Alarms on clients writing registers too often.
+
+    slave receives the diagnostic registers; tags, if given, names the
+    registers in the log.
+    """
+
+    def __init__(self, slave, tags=None, max_rate=MAX_RATE, max_repeats=MAX_REPEATS):
+        self.slave = slave
+        self.tags = tags
+        self.max_rate = max_rate
+        self.max_repeats = max_repeats
+        # (client, table, address) -> [second, writes, repeats, last value,
+        # alarmed], oldest second first
+        self.stats = collections.OrderedDict()
+        self.checked = 0
+        self.alarms = 0
+
+    def check(self, client, request):
+        """Account a request from client (host); returns nothing."""
+        table = WRITE_FUNCTIONS.get(request.function_code)
+        if table is None:
+            return
+        self.checked += 1
+        now = time.time()
+        second = int(now)
+        address, values = _written(request)
+        stats = self.stats
+        for offset, value in enumerate(values):
+            key = (client, table, address + offset)
+            s = stats.get(key)
+            if s is None:
+                if len(stats) >= MAX_KEYS:
+                    stats.popitem(last=False)
+                stats[key] = [second, 1, 0, value, False]
+                continue
+            if s[0] != second:
+                s[0] = second
+                s[1] = s[2] = 0
+                s[4] = False
+                # To the back, keeping the order by second
+                del stats[key]
+                stats[key] = s
+            s[1] += 1
+            if value is not None and value == s[3]:
+                s[2] += 1
+            s[3] = value
+            if not s[4]:
+                if s[1] > self.max_rate:
+                    self._alarm(now, key, RATE, s)
+                elif s[2] > self.max_repeats:
+                    self._alarm(now, key, REPEAT, s)
+
+    def _alarm(self, now, key, kind, s):
+        s[4] = True
+        self.alarms += 1
+        client, table, address = key
+        self.slave.setValues(4, DIAG_ALARMS, [self.alarms & 0xFFFF, kind, address,
+                                              min(s[1], 0xFFFF)]
+                             + encode_registers('uint32', [int(now)]))
+        name = '%s %d' % (table, address)
+        if self.tags is not None and table == 'register':
+            try:
+                name = self.tags.lookup(address).name
+            except KeyError:
+                pass
+        log.warning("Write %s alarm: %s wrote %s %d times (%d repeated) this second"
+                    % (KINDS[kind], client, name, s[1], s[2]))
+
+    def summary(self):
+        return ("detector: %d write requests checked, %d alarms, %d registers tracked"
+                % (self.checked, self.alarms, len(self.stats)))
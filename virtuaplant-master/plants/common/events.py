@@ -0,0 +1,89 @@
+#!/usr/bin/env python
+# World event log.
+#
+# The worlds note what happens to the process (oil spilled, a bottle
+# filled, a bottle leaving the line) with the time it happened, one CSV
+# line per event:
+#
+#   time,event,value
+#   1508241612.431870,level_reached,
+#   1508241655.002113,oil_spilled,3
+#
+# Times are epoch seconds from the clock the plant server stamps captured
+# traffic with (capture.py), so impact.py can line events up with the
+# writes that caused them.  Lines are buffered, so noting an event costs
+# the world next to nothing; once start() is called the reactor flushes
+# them every FLUSH_INTERVAL, so the last event of a burst is on disk within
+# that time too.
+
+import csv
+import threading
+import time
+
+FIELDS = ['time', 'event', 'value']
+
+# Seconds between flushes to disk
+FLUSH_INTERVAL = 1.0
+
+
+class EventLog(object):
+    """Appends events to path; safe to call from the world and server
+    threads alike."""
+
+    def __init__(self, path, flush_interval=FLUSH_INTERVAL):
+        self.path = path
+        self.flush_interval = flush_interval
+        self.lock = threading.Lock()
+        self.file = open(path, 'a')
+        if self.file.tell() == 0:
+            self.file.write(','.join(FIELDS) + '\n')
+        self.count = 0
+        self.pending = False
+        self._flusher = None
+
+    def record(self, event, value=''):
+        now = time.time()
+        with self.lock:
+            if self.file is None:
+                return
+            self.file.write('%.6f,%s,%s\n' % (now, event, value))
+            self.count += 1
+            self.pending = True
+
+    def flush(self):
+        with self.lock:
+            if self.file is not None and self.pending:
+                self.file.flush()
+                self.pending = False
+
+    def start(self):
+        """Flush every flush_interval from the reactor once it runs."""
+        from twisted.internet import task
+
+        self._flusher = task.LoopingCall(self.flush)
+        self._flusher.start(self.flush_interval, now=False)
+
+    def close(self):
+        if self._flusher is not None and self._flusher.running:
+            self._flusher.stop()
+        with self.lock:
+            if self.file is not None:
+                self.file.close()
+                self.file = None
+
+
+def read_events(path):
+    """[(time, event, value)] of an event log, in time order; value is
+    the text logged ('' for none)."""
+    events = []
+    with open(path) as f:
+        for row in csv.DictReader(f):
+            # A world killed mid-line leaves a short tail
+            if row.get('value') is None:
+                continue
+            try:
+                events.append((float(row['time']), row['event'], row['value']))
+            except ValueError:
+                continue
+    events.sort(key=lambda event: event[0])
+    return events
@@ -0,0 +1,241 @@
+#!/usr/bin/env python
+# Per-frame phase timing for the worlds.
+#
+# A world loop calls frame() at the top of every frame and mark(phase)
+# after each stretch of work; the time since the previous mark goes to
+# that phase:
+#
+#   while running:
+#       frame_timer.frame()
+#       clock.tick(FPS)
+#       frame_timer.mark('wait')
+#       ...
+#       space.step(1/FPS)
+#       frame_timer.mark('physics')
+#
+# Functions wrapped with timed(phase, func) are timed wherever they are
+# called, and their time is taken out of the stretch around them; the
+# worlds wrap PLCGetTag and PLCSetTag as 'tag_io', so tag I/O in the
+# collision handlers does not count as physics.
+#
+# Every phase's time per frame goes into a histogram (BOUNDS).  Every
+# report_interval the last interval's histograms are written as a JSON
+# line to the stream, if any, and summarised for draw(), which puts them
+# over the world view:
+#
+#   {"bounds_ms": [0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 25.0, 50.0, 100.0, 250.0],
+#    "budget_ms": 20.0, "frames": 63,
+#    "phases": {..., "physics": {"counts": [0, 0, 0, 0, 28, 32, 3, 0, 0, 0, 0, 0],
+#                                "max_ms": 5.868, "mean_ms": 2.765, "p50_ms": 5.0,
+#                                "p99_ms": 5.868}, ...},
+#    "time": 1792427419.601}
+#
+# Percentiles are bucket bounds, so p50 says the median frame spent 2.5-5
+# ms in physics; none is given above max_ms.
+#
+# The cumulative histograms are kept too, for metrics.py to export.
+
+from __future__ import division
+
+import bisect
+import json
+import sys
+import time
+import timeit
+
+clock = timeit.default_timer
+
+# Histogram bucket upper bounds, seconds; one more bucket takes the rest
+BOUNDS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25)
+
+# Seconds between stream lines and overlay updates
+REPORT_INTERVAL = 1.0
+
+
+class Histogram(object):
+
+    def __init__(self, bounds=BOUNDS):
+        self.bounds = bounds
+        self.reset()
+
+    def reset(self):
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, value):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+
+    def mean(self):
+        return self.total / self.count if self.count else 0.0
+
+    def percentile(self, p):
+        """Upper bound of the bucket holding the p-th percentile (the max
+        past the last bound)."""
+        if not self.count:
+            return 0.0
+        rank = p / 100.0 * self.count
+        seen = 0
+        for i, n in enumerate(self.counts):
+            seen += n
+            if seen >= rank and n:
+                return min(self.bounds[i], self.max) if i < len(self.bounds) else self.max
+        return self.max
+
+
+class FrameTimer(object):
+    """Times the phases of a world's frames.
+
+    budget is the seconds a frame may take (1/FPS); stream is a file
+    name, '-' for standard output, for the JSON lines.
+    """
+
+    def __init__(self, budget=None, stream=None, report_interval=REPORT_INTERVAL):
+        self.budget = budget
+        self.report_interval = report_interval
+        if stream == '-':
+            self.stream = sys.stdout
+        elif stream:
+            self.stream = open(stream, 'a')
+        else:
+            self.stream = None
+        # Phases in the order first seen
+        self.phases = []
+        self.histograms = {}
+        self.interval = {}
+        self.frames = 0
+        self.current = {}
+        self.nested = 0.0
+        self.started = None
+        self.last = None
+        self.last_report = clock()
+        # Frames a second over the last interval
+        self.fps = 0.0
+        self.summary = []
+        self._font = None
+        self._lines = None
+        self._phase('frame')
+
+    def _phase(self, phase):
+        if phase not in self.histograms:
+            self.phases.append(phase)
+            self.histograms[phase] = Histogram()
+            self.interval[phase] = Histogram()
+
+    def frame(self):
+        """Start a frame, closing the one before."""
+        now = clock()
+        if self.started is not None:
+            self._close(now)
+        self.started = self.last = now
+        self.nested = 0.0
+        if now - self.last_report >= self.report_interval:
+            self.report(now)
+
+    def mark(self, phase):
+        """Charge the time since the last mark to phase."""
+        now = clock()
+        if self.last is None:
+            return
+        self.current[phase] = self.current.get(phase, 0.0) + now - self.last - self.nested
+        self.last = now
+        self.nested = 0.0
+        self._phase(phase)
+
+    def timed(self, phase, func):
+        """func, with the time spent in it charged to phase."""
+        def timed_call(*args, **kwargs):
+            start = clock()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                elapsed = clock() - start
+                self.nested += elapsed
+                self.current[phase] = self.current.get(phase, 0.0) + elapsed
+        timed_call.__name__ = func.__name__
+        timed_call.__doc__ = func.__doc__
+        return timed_call
+
+    def _close(self, now):
+        current = self.current
+        current['frame'] = now - self.started
+        # tag_io may only have come from timed()
+        for phase in current:
+            self._phase(phase)
+        # Phases skipped this frame took no time in it
+        for phase in self.phases:
+            seconds = current.get(phase, 0.0)
+            self.histograms[phase].add(seconds)
+            self.interval[phase].add(seconds)
+        self.frames += 1
+        self.current = {}
+
+    def snapshot(self, histograms=None):
+        """{phase: {mean_ms, p50_ms, p99_ms, max_ms, counts}} of histograms
+        (the last interval's by default)."""
+        histograms = histograms or self.interval
+        return dict((phase, {
+            'mean_ms': round(h.mean() * 1000, 3),
+            'p50_ms': round(h.percentile(50) * 1000, 3),
+            'p99_ms': round(h.percentile(99) * 1000, 3),
+            'max_ms': round(h.max * 1000, 3),
+            'counts': list(h.counts),
+        }) for phase, h in histograms.items())
+
+    def report(self, now=None):
+        now = now or clock()
+        frame = self.interval.get('frame')
+        frames = frame.count if frame is not None else 0
+        if self.stream is not None and frames:
+            self.stream.write(json.dumps({
+                'time': round(time.time(), 3),
+                'frames': frames,
+                'budget_ms': round(self.budget * 1000, 3) if self.budget else None,
+                'bounds_ms': [b * 1000 for b in BOUNDS],
+                'phases': self.snapshot(),
+            }, sort_keys=True) + '\n')
+            self.stream.flush()
+        self.fps = frames / (now - self.last_report)
+        self.summary = self._summarise(frames)
+        self._lines = None
+        for h in self.interval.values():
+            h.reset()
+        self.last_report = now
+
+    def _summarise(self, frames):
+        if not frames:
+            return []
+        frame = self.interval['frame']
+        lines = ["%.1f fps, frame %.2f ms%s" % (self.fps, frame.mean() * 1000,
+                                                " of %.2f" % (self.budget * 1000) if self.budget else "")]
+        for phase in self.phases:
+            if phase == 'frame':
+                continue
+            h = self.interval[phase]
+            share = h.total / frame.total * 100 if frame.total else 0.0
+            lines.append("%-8s %6.2f ms p99 %6.2f %3.0f%%"
+                         % (phase, h.mean() * 1000, h.percentile(99) * 1000, share))
+        return lines
+
+    def draw(self, surface, position=(5, 5), color=(0, 0, 0)):
+        """Draw the last summary on surface (a pygame Surface)."""
+        import pygame
+
+        if self._font is None:
+            self._font = pygame.font.SysFont('monospace', 12)
+        if self._lines is None:
+            self._lines = [self._font.render(line, True, color) for line in self.summary]
+        x, y = position
+        for line in self._lines:
+            surface.blit(line, (x, y))
+            y += line.get_height()
+
+    def close(self):
+        if self.stream is not None and self.stream is not sys.stdout:
+            self.stream.close()
+        self.stream = None
@@ -0,0 +1,672 @@
+#!/usr/bin/env python
+# Modbus fuzzing harness for the plant servers.
+#
+# Sends malformed and boundary Modbus TCP frames at a plant as fast as it
+# answers, over -c connections at once:
+#
+#   ./fuzz.py -t 127.0.0.1 -p 5020 -d 600
+#   ./fuzz.py -p 6000 -d 3600 -o findings.txt --heartbeat 10 \
+#       --spawn "../powerplant/powerplant_plcs.py -n 1 -l 6000"
+#
+# The cases (CASES) are MBAP lengths too short and too long, truncated
+# PDUs, protocol ids other than 0, unknown function codes, reads and
+# writes beyond the BLOCK_SIZE register blocks, write requests whose byte
+# count does not match their count, and random bytes.  Each case is sent
+# on a connection of its own and ends with the plant's answer, a Modbus
+# exception, the plant dropping the connection or no answer within -w
+# seconds ("silent": a frame claiming more bytes than were sent leaves the
+# plant waiting for them).  Connections whose framing the case left in
+# doubt are replaced.
+#
+# Meanwhile a probe reads a register once a second on a connection of its
+# own.  A probe not answered within HANG_TIMEOUT is a hang, a plant no
+# longer accepting connections a crash; both are written to -o with the
+# frames sent just before.  An answering server does not mean the control
+# logic runs, so with --heartbeat the probe reads the scan counter the
+# soft-PLC keeps in an input register (softplc.SCAN_COUNTER) instead, and
+# a counter standing still for HANG_TIMEOUT is a crash too.
+#
+# With --spawn the harness starts the plant itself, restarts it after a
+# crash and reads its output (--log): a worker thread dying ("Exception in
+# thread") is a crash, and at the end the thread deaths, the soft-PLC
+# faults and the other tracebacks (mostly dropped connections) are counted
+# apart.  Every report_interval, and at the end, it logs the cases per
+# second and the outcomes per case.
+
+from __future__ import division
+
+import argparse
+import binascii
+import collections
+import logging
+import random
+import re
+import shlex
+import socket
+import struct
+import subprocess
+import sys
+import time
+
+from twisted.internet import protocol, reactor, task
+
+from plant_server import BLOCK_SIZE
+from softplc import SCAN_COUNTER
+
+log = logging.getLogger(__name__)
+
+# Transaction id, protocol id, length (of the rest, from the unit id on),
+# unit id
+MBAP = struct.Struct('>HHHB')
+
+# Connections sending cases at once
+CONNECTIONS = 64
+
+# Seconds to wait for the answer to a case
+TIMEOUT = 0.05
+
+# Seconds between probes, and to wait for the answer to one
+PROBE_INTERVAL = 1.0
+HANG_TIMEOUT = 2.0
+
+# Seconds between progress lines
+REPORT_INTERVAL = 10
+
+# Frames sent before a finding that are written with it
+SUSPECTS = 64
+
+# Seconds a spawned plant gets to start listening
+SPAWN_TIMEOUT = 30
+
+# Function codes the plants implement (plant_messages adds 0x16, 0x41, 0x42)
+KNOWN_FUNCTIONS = frozenset([0x01, 0x02, 0x03, 0x04, 0x05, 0x06, 0x07, 0x08, 0x0b, 0x0c,
+                             0x0f, 0x10, 0x11, 0x14, 0x15, 0x16, 0x17, 0x18, 0x2b,
+                             0x41, 0x42])
+
+OUTCOMES = ['response', 'exception', 'silent', 'dropped']
+
+# Plant output: an uncaught exception ending a thread, and the soft-PLC's
+# logged faults (softplc.ScanEngine, the powerplant_plcs Fleet)
+THREAD_DEATH = re.compile(br'^Exception in thread .*$', re.M)
+PLC_FAULT = re.compile(br'(?:program \S+|scan|model step) failed')
+
+
+def _bytes(values):
+    return bytes(bytearray(values))
+
+
+def _random_bytes(rng, low, high):
+    return _bytes(rng.randrange(256) for i in range(rng.randint(low, high)))
+
+
+def _frame(tid, pdu, length=None, protocol_id=0, unit=0):
+    if length is None:
+        length = len(pdu) + 1
+    return MBAP.pack(tid, protocol_id, length & 0xFFFF, unit) + pdu
+
+
+def _address(rng):
+    # Around and past the end of the blocks
+    return rng.choice([BLOCK_SIZE - 1, BLOCK_SIZE, BLOCK_SIZE + 1, 0xFFFF,
+                       rng.randrange(BLOCK_SIZE, 0x10000)])
+
+
+def _valid_pdu(rng):
+    # A well formed request inside the blocks
+    fc = rng.choice([0x01, 0x02, 0x03, 0x04, 0x06, 0x10])
+    address = rng.randrange(BLOCK_SIZE)
+    if fc == 0x06:
+        return struct.pack('>BHH', fc, address, rng.randrange(0x10000))
+    count = rng.randint(1, BLOCK_SIZE - address)
+    if fc == 0x10:
+        count = min(count, 123)
+        return (struct.pack('>BHHB', fc, address, count, count * 2)
+                + _random_bytes(rng, count * 2, count * 2))
+    return struct.pack('>BHH', fc, address, count)
+
+
+# Each case returns (frame, clean): clean if the plant frames it exactly,
+# so the connection can carry the next case
+
+def short_length(rng, tid):
+    pdu = _valid_pdu(rng)
+    return _frame(tid, pdu, length=rng.randint(0, len(pdu))), False
+
+
+def long_length(rng, tid):
+    pdu = _valid_pdu(rng)
+    return _frame(tid, pdu, length=rng.choice([len(pdu) + 2, 254, 0xFFFF])), False
+
+
+def truncated_pdu(rng, tid):
+    pdu = _valid_pdu(rng)
+    return _frame(tid, pdu[:rng.randint(1, len(pdu) - 1)]), True
+
+
+def bad_protocol(rng, tid):
+    return _frame(tid, _valid_pdu(rng), protocol_id=rng.randint(1, 0xFFFF)), True
+
+
+def unknown_function(rng, tid):
+    fc = rng.choice([fc for fc in range(256) if fc not in KNOWN_FUNCTIONS])
+    return _frame(tid, _bytes([fc]) + _random_bytes(rng, 0, 8)), True
+
+
+def out_of_range(rng, tid):
+    fc = rng.choice([0x01, 0x02, 0x03, 0x04, 0x05, 0x06, 0x0f, 0x10, 0x16, 0x41, 0x42])
+    if fc in (0x01, 0x02, 0x03, 0x04):
+        if rng.random() < 0.5:
+            address, count = _address(rng), rng.choice([1, 2, 125])
+        else:
+            # Starting inside a block and running past its end
+            address = rng.randrange(BLOCK_SIZE)
+            count = rng.randint(BLOCK_SIZE - address + 1, 125)
+        pdu = struct.pack('>BHH', fc, address, count)
+    elif fc == 0x05:
+        pdu = struct.pack('>BHH', fc, _address(rng), 0xFF00)
+    elif fc == 0x06:
+        pdu = struct.pack('>BHH', fc, _address(rng), rng.randrange(0x10000))
+    elif fc == 0x0f:
+        count = rng.randint(1, 16)
+        pdu = (struct.pack('>BHHB', fc, _address(rng), count, (count + 7) // 8)
+               + _random_bytes(rng, (count + 7) // 8, (count + 7) // 8))
+    elif fc == 0x10:
+        count = rng.randint(1, 8)
+        pdu = (struct.pack('>BHHB', fc, BLOCK_SIZE - rng.randint(0, count - 1), count, count * 2)
+               + _random_bytes(rng, count * 2, count * 2))
+    elif fc == 0x16:
+        pdu = struct.pack('>BHHH', fc, _address(rng), rng.randrange(0x10000), rng.randrange(0x10000))
+    elif fc == 0x41:
+        pdu = struct.pack('>BHhHH', fc, _address(rng), rng.randint(-0x8000, 0x7FFF), 0, 0xFFFF)
+    else:
+        pdu = struct.pack('>BHHH', fc, _address(rng), rng.randrange(0x10000), rng.randrange(0x10000))
+    return _frame(tid, pdu), True
+
+
+def bad_count(rng, tid):
+    fc = rng.choice([0x01, 0x03, 0x0f, 0x10])
+    address = rng.randrange(BLOCK_SIZE)
+    if fc in (0x01, 0x03):
+        pdu = struct.pack('>BHH', fc, address, rng.choice([0, 126, 2001, 0xFFFF]))
+    elif fc == 0x0f:
+        count = rng.choice([0, 1, 8, 1969, 0xFFFF])
+        size = rng.randint(0, 4)
+        pdu = struct.pack('>BHHB', fc, address, count, rng.choice([size, 0, 0xFF])) + _random_bytes(rng, size, size)
+    else:
+        count = rng.choice([0, 1, 4, 124, 0xFFFF])
+        size = rng.choice([0, 2, 8, 20])
+        pdu = (struct.pack('>BHHB', fc, address, count, rng.choice([size, count * 2 & 0xFF, 0xFF]))
+               + _random_bytes(rng, size, size))
+    return _frame(tid, pdu), True
+
+
+def garbage(rng, tid):
+    return _random_bytes(rng, 1, 300), False
+
+
+CASES = [
+    ('short_length', short_length),
+    ('long_length', long_length),
+    ('truncated_pdu', truncated_pdu),
+    ('bad_protocol', bad_protocol),
+    ('unknown_function', unknown_function),
+    ('out_of_range', out_of_range),
+    ('bad_count', bad_count),
+    ('garbage', garbage),
+]
+
+
+class _CaseProtocol(protocol.Protocol):
+    """Sends the fuzzer's cases one at a time."""
+
+    def __init__(self, fuzzer):
+        self.fuzzer = fuzzer
+        self.case = None
+        self.buffer = b''
+        self.timer = None
+
+    def connectionMade(self):
+        self.fuzzer.send_next(self)
+
+    def send(self, case, frame):
+        self.case = case
+        self.buffer = b''
+        self.transport.write(frame)
+        self.timer = reactor.callLater(self.fuzzer.timeout, self._timeout)
+
+    def dataReceived(self, data):
+        if self.case is None:
+            return
+        self.buffer += data
+        if len(self.buffer) < MBAP.size:
+            return
+        length = MBAP.unpack_from(self.buffer)[2]
+        if len(self.buffer) < MBAP.size - 1 + length:
+            return
+        fc = bytearray(self.buffer[MBAP.size:MBAP.size + 1])
+        self._done('exception' if fc and fc[0] > 0x80 else 'response')
+
+    def _timeout(self):
+        self.timer = None
+        self._done('silent')
+
+    def connectionLost(self, reason):
+        if self.case is not None:
+            self._done('dropped', lost=True)
+
+    def _done(self, outcome, lost=False):
+        if self.timer is not None and self.timer.active():
+            self.timer.cancel()
+        self.timer = None
+        case, self.case = self.case, None
+        clean = self.fuzzer.finished(case, outcome)
+        if lost:
+            self.fuzzer.connect()
+        elif clean and outcome in ('response', 'exception'):
+            self.fuzzer.send_next(self)
+        else:
+            # Whatever the plant still holds of the case would garble the next
+            self.transport.abortConnection()
+            self.fuzzer.connect()
+
+
+class _ProbeProtocol(protocol.Protocol):
+
+    def __init__(self, fuzzer):
+        self.fuzzer = fuzzer
+        self.buffer = b''
+
+    def dataReceived(self, data):
+        self.buffer += data
+        if len(self.buffer) >= MBAP.size and len(self.buffer) >= MBAP.size - 1 + MBAP.unpack_from(self.buffer)[2]:
+            pdu = bytearray(self.buffer[MBAP.size:])
+            self.buffer = b''
+            # The register read, or None for an exception response
+            value = None
+            if len(pdu) >= 4 and pdu[0] in (0x03, 0x04):
+                value = pdu[2] << 8 | pdu[3]
+            self.fuzzer.probe_answered(value)
+
+    def connectionLost(self, reason):
+        self.fuzzer.probe_lost()
+
+
+class Target(object):
+    """A plant process the harness runs itself; its output goes to log."""
+
+    def __init__(self, command, port, log_path):
+        self.command = command
+        self.port = port
+        self.log_path = log_path
+        self.process = None
+        self.starts = 0
+        self.output = open(log_path, 'ab')
+        # How far the output has been read, and what it held
+        self.read_to = self.output.tell()
+        self.thread_deaths = 0
+        self.plc_faults = 0
+        self.tracebacks = 0
+
+    def _listening(self):
+        try:
+            socket.create_connection(('127.0.0.1', self.port), 1).close()
+            return True
+        except socket.error:
+            return False
+
+    def start(self):
+        if self._listening():
+            raise RuntimeError("Something already listens on port %d" % self.port)
+        self.process = subprocess.Popen(shlex.split(self.command), stdout=self.output,
+                                        stderr=subprocess.STDOUT)
+        self.starts += 1
+        deadline = time.time() + SPAWN_TIMEOUT
+        while time.time() < deadline:
+            if self.process.poll() is not None:
+                raise RuntimeError("%s exited with %d on start up"
+                                   % (self.command, self.process.returncode))
+            if self._listening():
+                return
+            time.sleep(0.2)
+        raise RuntimeError("%s is not listening on port %d after %d s"
+                           % (self.command, self.port, SPAWN_TIMEOUT))
+
+    def exited(self):
+        """Exit status of the plant if it is gone, else None."""
+        return self.process.poll()
+
+    def kill(self):
+        if self.process is not None and self.process.poll() is None:
+            self.process.kill()
+            self.process.wait()
+
+    def stop(self):
+        if self.process is not None and self.process.poll() is None:
+            self.process.terminate()
+            self.process.wait()
+        self.output.close()
+
+    def read_output(self):
+        """Counts what the plant wrote since the last call; returns the
+        lines of the worker threads that died meanwhile."""
+        with open(self.log_path, 'rb') as f:
+            f.seek(self.read_to)
+            text = f.read()
+        # Up to the last whole line; the rest is read next time
+        text = text[:text.rfind(b'\n') + 1]
+        self.read_to += len(text)
+        deaths = THREAD_DEATH.findall(text)
+        self.thread_deaths += len(deaths)
+        self.plc_faults += len(PLC_FAULT.findall(text))
+        self.tracebacks += text.count(b'Traceback')
+        return [line.decode('utf-8', 'replace') for line in deaths]
+
+    def other_tracebacks(self):
+        # Thread deaths and soft-PLC faults come with a traceback each
+        return max(0, self.tracebacks - self.thread_deaths - self.plc_faults)
+
+
+class Fuzzer(object):
+    """Runs the cases against host:port for duration seconds or until
+    cases have been sent.
+
+    heartbeat is the input register of a scan counter to probe, None to
+    probe holding register 0.
+    """
+
+    def __init__(self, host, port, duration=None, cases=None, connections=CONNECTIONS,
+                 timeout=TIMEOUT, seed=0, kinds=None, findings=None, target=None,
+                 report_interval=REPORT_INTERVAL, heartbeat=None):
+        self.host = host
+        self.port = port
+        self.heartbeat = heartbeat
+        self.duration = duration
+        self.limit = cases
+        self.connections = connections
+        self.timeout = timeout
+        self.rng = random.Random(seed)
+        self.cases = [(name, case) for name, case in CASES if kinds is None or name in kinds]
+        self.findings = findings
+        self.target = target
+        self.report_interval = report_interval
+
+        self.stopping = False
+        self.tid = 0
+        self.sent = 0
+        self.done = 0
+        self.outcomes = dict((name, dict((o, 0) for o in OUTCOMES)) for name, case in self.cases)
+        self.recent = collections.deque(maxlen=SUSPECTS)
+        self.refused = 0
+        self.hangs = 0
+        self.crashes = 0
+        self.probe = None
+        self.probe_sent = None
+        # Last scan counter read, and when it last moved
+        self.beat = None
+        self.beat_moved = None
+        self.started = None
+        self.last_report = None
+        self.last_done = 0
+
+    def run(self):
+        """Run the cases; returns once done."""
+        self.started = self.last_report = time.time()
+        for i in range(self.connections):
+            self.connect()
+        self._connect_probe()
+        self._prober = task.LoopingCall(self._send_probe)
+        self._prober.start(PROBE_INTERVAL, now=False)
+        if self.report_interval:
+            self._reporter = task.LoopingCall(self.report)
+            self._reporter.start(self.report_interval, now=False)
+        if self.duration:
+            reactor.callLater(self.duration, self.stop)
+        reactor.run()
+
+    def connect(self):
+        if self.stopping:
+            return
+        d = protocol.ClientCreator(reactor, _CaseProtocol, self).connectTCP(
+            self.host, self.port, timeout=5)
+        d.addErrback(self._refused)
+
+    def _refused(self, failure):
+        self.refused += 1
+        # The probe tells a crash; try again a little later
+        reactor.callLater(0.1, self.connect)
+
+    def send_next(self, conn):
+        if self.stopping or (self.limit is not None and self.sent >= self.limit):
+            conn.transport.loseConnection()
+            if self.limit is not None and self.done >= self.limit:
+                self.stop()
+            return
+        name, case = self.rng.choice(self.cases)
+        self.tid = (self.tid + 1) & 0xFFFF
+        frame, clean = case(self.rng, self.tid)
+        self.sent += 1
+        self.recent.append((name, frame))
+        conn.send((name, clean), frame)
+
+    def finished(self, case, outcome):
+        """Count a case's outcome; returns whether the connection is still
+        framed cleanly."""
+        name, clean = case
+        self.outcomes[name][outcome] += 1
+        self.done += 1
+        if self.limit is not None and self.done >= self.limit:
+            self.stop()
+        return clean
+
+    # The probe
+
+    def _connect_probe(self):
+        self.probe = None
+        d = protocol.ClientCreator(reactor, _ProbeProtocol, self).connectTCP(
+            self.host, self.port, timeout=HANG_TIMEOUT)
+        d.addCallbacks(self._probe_connected, self._probe_refused)
+
+    def _probe_connected(self, conn):
+        self.probe = conn
+
+    def _probe_refused(self, failure):
+        if self.stopping:
+            return
+        why = "not accepting connections: %s" % failure.getErrorMessage()
+        if self.target is not None and self.target.exited() is None:
+            # Still running, so stuck rather than gone
+            self.hangs += 1
+            self._finding("hang", why)
+            self._restart()
+        else:
+            self._crash(why)
+
+    def _send_probe(self):
+        if self.target is not None:
+            if self.target.exited() is not None:
+                self._crash("exited")
+                return
+            deaths = self.target.read_output()
+            if deaths:
+                self._crash("worker thread died: %s" % '; '.join(deaths))
+                return
+        if self.probe_sent is not None:
+            if time.time() - self.probe_sent > HANG_TIMEOUT:
+                self._hang()
+            return
+        if self.probe is None:
+            return
+        self.probe_sent = time.time()
+        if self.heartbeat is None:
+            request = struct.pack('>BHH', 0x03, 0, 1)
+        else:
+            request = struct.pack('>BHH', 0x04, self.heartbeat, 1)
+        self.probe.transport.write(_frame(0, request))
+
+    def probe_answered(self, value):
+        self.probe_sent = None
+        if self.heartbeat is None:
+            return
+        now = time.time()
+        if self.beat_moved is None or value != self.beat:
+            self.beat = value
+            self.beat_moved = now
+        elif now - self.beat_moved > HANG_TIMEOUT:
+            if value is None:
+                self._crash("no scan counter in input register %d" % self.heartbeat)
+            else:
+                self._crash("control loop stopped: scan counter at %d for %.1f s"
+                            % (value, now - self.beat_moved))
+
+    def probe_lost(self):
+        self.probe = None
+        self.probe_sent = None
+        if not self.stopping:
+            reactor.callLater(0, self._connect_probe)
+
+    def _hang(self):
+        self.hangs += 1
+        waited = time.time() - self.probe_sent
+        self._finding("hang", "probe unanswered for %.1f s" % waited)
+        # Count it once; the next probe goes on a fresh connection
+        self.probe_sent = None
+        if self.probe is not None:
+            self.probe.transport.abortConnection()
+
+    def _crash(self, why):
+        if self.target is not None and self.target.exited() is not None:
+            why = "exited with %d" % self.target.exited()
+        self.crashes += 1
+        self._finding("crash", why)
+        self.beat_moved = None
+        if self.target is None:
+            log.error("Plant gone, stopping")
+            self.stop()
+            return
+        self._restart()
+
+    def _restart(self):
+        self.target.kill()
+        log.warning("Restarting %s" % self.target.command)
+        try:
+            self.target.start()
+        except RuntimeError as ex:
+            log.error(str(ex))
+            self.stop()
+            return
+        self._connect_probe()
+
+    def _finding(self, kind, why):
+        log.warning("Plant %s after %d cases: %s" % (kind, self.done, why))
+        if self.findings is None:
+            return
+        with open(self.findings, 'a') as f:
+            f.write("%s %s after %d cases: %s\n" % (time.strftime('%Y-%m-%d %H:%M:%S'), kind,
+                                                    self.done, why))
+            f.write("  last %d frames sent, oldest first:\n" % len(self.recent))
+            for name, frame in self.recent:
+                f.write("  %-16s %s\n" % (name, binascii.hexlify(frame).decode('ascii')))
+
+    def stop(self):
+        if self.stopping:
+            return
+        self.stopping = True
+        if reactor.running:
+            reactor.stop()
+
+    def report(self):
+        now = time.time()
+        elapsed = now - self.last_report
+        rate = (self.done - self.last_done) / elapsed if elapsed > 0 else 0.0
+        self.last_report = now
+        self.last_done = self.done
+        log.info("fuzz: %d cases, %.0f cases/s, %d hangs, %d crashes"
+                 % (self.done, rate, self.hangs, self.crashes))
+
+    def summary(self):
+        elapsed = time.time() - self.started
+        lines = ["fuzz: %d cases in %.1f s, %.0f cases/s, %d hangs, %d crashes, %d refused connects"
+                 % (self.done, elapsed, self.done / elapsed if elapsed > 0 else 0.0,
+                    self.hangs, self.crashes, self.refused)]
+        if self.target is not None:
+            self.target.read_output()
+            lines.append("fuzz: plant started %d times; in %s %d worker thread deaths, "
+                         "%d soft-PLC faults, %d other tracebacks"
+                         % (self.target.starts, self.target.log_path, self.target.thread_deaths,
+                            self.target.plc_faults, self.target.other_tracebacks()))
+        lines.append("  %-16s %s" % ('case', ' '.join('%9s' % o for o in OUTCOMES)))
+        for name, case in self.cases:
+            counts = self.outcomes[name]
+            lines.append("  %-16s %s" % (name, ' '.join('%9d' % counts[o] for o in OUTCOMES)))
+        return '\n'.join(lines)
+
+
+# Override Argument parser to throw error and generate help message
+# if undefined args are passed
+class MyParser(argparse.ArgumentParser):
+    def error(self, message):
+        sys.stderr.write('error: %s\n' % message)
+        self.print_help()
+        sys.exit(2)
+
+
+def main():
+    parser = MyParser(
+        description = 'This Python script fuzzes a plant Modbus server with malformed frames',
+        epilog = '',
+        add_help = True)
+    parser.add_argument("-t", action = "store", dest="server_addr", default="127.0.0.1",
+                        help = "Plant Modbus server IP address (default 127.0.0.1)")
+    parser.add_argument("-p", action = "store", dest="port", type=int, default=5020,
+                        help = "Plant Modbus port (default 5020)")
+    parser.add_argument("-d", action = "store", dest="duration", type=float,
+                        help = "Seconds to fuzz for (default until -n cases)")
+    parser.add_argument("-n", action = "store", dest="cases", type=int,
+                        help = "Cases to send (default until -d seconds)")
+    parser.add_argument("-c", action = "store", dest="connections", type=int, default=CONNECTIONS,
+                        help = "Connections sending cases at once (default %d)" % CONNECTIONS)
+    parser.add_argument("-w", action = "store", dest="timeout", type=float, default=TIMEOUT,
+                        help = "Seconds to wait for an answer to a case (default %g)" % TIMEOUT)
+    parser.add_argument("-k", action = "append", dest="kinds", choices=[name for name, case in CASES],
+                        help = "Send only this kind of case (repeatable; default all)")
+    parser.add_argument("-o", action = "store", dest="findings",
+                        help = "Append hangs and crashes, with the frames sent before, to this file")
+    parser.add_argument("--seed", action = "store", dest="seed", type=int, default=0,
+                        help = "Random seed; the same seed sends the same cases (default 0)")
+    parser.add_argument("--spawn", action = "store", dest="spawn",
+                        help = "Start the plant with this command, listening on -p, and restart it after crashes")
+    parser.add_argument("--log", action = "store", dest="log", default="fuzz_plant.log",
+                        help = "Where the output of a --spawn plant goes (default fuzz_plant.log)")
+    parser.add_argument("--heartbeat", action = "store", dest="heartbeat", type=int,
+                        help = "Probe the scan counter in this input register (%d for the soft-PLC); "
+                               "a counter standing still is a crash" % SCAN_COUNTER)
+    args = parser.parse_args()
+
+    if args.duration is None and args.cases is None:
+        parser.error("give -d or -n")
+    if args.spawn and args.server_addr not in ('127.0.0.1', 'localhost'):
+        parser.error("--spawn runs the plant here; leave -t alone")
+
+    logging.basicConfig()
+    log.setLevel(logging.INFO)
+
+    target = None
+    if args.spawn:
+        target = Target(args.spawn, args.port, args.log)
+        try:
+            target.start()
+        except (OSError, RuntimeError) as ex:
+            target.stop()
+            parser.error(str(ex))
+    fuzzer = Fuzzer(args.server_addr, args.port, args.duration, args.cases, args.connections,
+                    args.timeout, args.seed, args.kinds, args.findings, target,
+                    heartbeat=args.heartbeat)
+    try:
+        fuzzer.run()
+    finally:
+        if target is not None:
+            target.stop()
+    log.info(fuzzer.summary())
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,408 @@
+#!/usr/bin/env python
+# Register historian.
+#
+# Samples every holding register of a plant at a fixed rate and stores the
+# samples in chunk files, one per CHUNK_SECONDS, laid out column by column:
+#
+#   header   '<4sBIHHqq'  magic, version, samples, columns, first register,
+#                         first and last timestamp (ms)
+#   column   '<BI' codec and length, then a zlib compressed array
+#
+# The first column holds the timestamps as delta-of-delta milliseconds, so
+# a steady sample rate turns into zeros.  Register columns are stored as
+# deltas (good for counters and levels) or XOR with the previous sample
+# (good for bit fields), whichever compresses smaller; both turn unchanged
+# registers into runs of zeros that zlib squeezes to almost nothing.  A day
+# of 99 registers at 10 Hz (85M samples) of a running plant takes a few MB.
+
+from __future__ import division, print_function
+
+import argparse
+import bisect
+import glob
+import logging
+import os
+import struct
+import sys
+import threading
+import time
+import zlib
+from array import array
+
+from pymodbus.exceptions import ConnectionException
+
+log = logging.getLogger(__name__)
+
+MAGIC = b'VPH1'
+VERSION = 1
+HEADER = struct.Struct('<4sBIHHqq')
+COLUMN = struct.Struct('<BI')
+
+CODEC_DELTA = 0
+CODEC_XOR = 1
+
+# Registers 0-98 are addressable in the plants' 100 register blocks
+FIRST_REGISTER = 0
+REGISTER_COUNT = 99
+
+SAMPLE_RATE = 10.0
+CHUNK_SECONDS = 300
+
+BIG_ENDIAN = sys.byteorder == 'big'
+
+
+def _pack(arr):
+    if BIG_ENDIAN:
+        arr = array(arr.typecode, arr)
+        arr.byteswap()
+    data = arr.tobytes() if hasattr(arr, 'tobytes') else arr.tostring()
+    return zlib.compress(data, 6)
+
+
+def _unpack(typecode, blob):
+    arr = array(typecode)
+    data = zlib.decompress(blob)
+    if hasattr(arr, 'frombytes'):
+        arr.frombytes(data)
+    else:
+        arr.fromstring(data)
+    if BIG_ENDIAN:
+        arr.byteswap()
+    return arr
+
+
+def encode_times(times):
+    dod = array('i', [0]) * len(times)
+    prev, prev_delta = times[0], 0
+    for i in range(1, len(times)):
+        delta = times[i] - prev
+        dod[i] = delta - prev_delta
+        prev, prev_delta = times[i], delta
+    return _pack(dod)
+
+
+def decode_times(first, blob):
+    dod = _unpack('i', blob)
+    times = [first] * len(dod)
+    t, delta = first, 0
+    for i in range(1, len(dod)):
+        delta += dod[i]
+        t += delta
+        times[i] = t
+    return times
+
+
+def encode_column(values):
+    """Encode 16 bit register values, returning (codec, blob)."""
+    deltas = array('H', [0]) * len(values)
+    xors = array('H', [0]) * len(values)
+    prev = 0
+    for i, v in enumerate(values):
+        deltas[i] = (v - prev) & 0xFFFF
+        xors[i] = v ^ prev
+        prev = v
+    by_delta, by_xor = _pack(deltas), _pack(xors)
+    if len(by_xor) < len(by_delta):
+        return CODEC_XOR, by_xor
+    return CODEC_DELTA, by_delta
+
+
+def decode_column(codec, blob):
+    raw = _unpack('H', blob)
+    values = [0] * len(raw)
+    prev = 0
+    if codec == CODEC_DELTA:
+        for i, d in enumerate(raw):
+            prev = (prev + d) & 0xFFFF
+            values[i] = prev
+    else:
+        for i, x in enumerate(raw):
+            prev ^= x
+            values[i] = prev
+    return values
+
+
+def encode_chunk(times, columns, first_register):
+    parts = [HEADER.pack(MAGIC, VERSION, len(times), len(columns), first_register,
+                         times[0], times[-1])]
+    blob = encode_times(times)
+    parts.append(COLUMN.pack(CODEC_DELTA, len(blob)))
+    parts.append(blob)
+    for values in columns:
+        codec, blob = encode_column(values)
+        parts.append(COLUMN.pack(codec, len(blob)))
+        parts.append(blob)
+    return b''.join(parts)
+
+
+def read_header(data):
+    magic, version, samples, ncols, first_register, t_first, t_last = HEADER.unpack_from(data)
+    if magic != MAGIC or version != VERSION:
+        raise ValueError("not a historian chunk")
+    return samples, ncols, first_register, t_first, t_last
+
+
+def decode_chunk(data, registers=None):
+    """Return (times, {register: values}) for the wanted registers only."""
+    samples, ncols, first_register, t_first, t_last = read_header(data)
+    offset = HEADER.size
+    codec, length = COLUMN.unpack_from(data, offset)
+    offset += COLUMN.size
+    times = decode_times(t_first, data[offset:offset + length])
+    offset += length
+
+    columns = {}
+    for i in range(ncols):
+        codec, length = COLUMN.unpack_from(data, offset)
+        offset += COLUMN.size
+        register = first_register + i
+        if registers is None or register in registers:
+            columns[register] = decode_column(codec, data[offset:offset + length])
+        offset += length
+    return times, columns
+
+
+class Historian(object):
+    """Chunk files of one plant in a directory."""
+
+    def __init__(self, directory, plant, first_register=FIRST_REGISTER,
+                 count=REGISTER_COUNT, chunk_seconds=CHUNK_SECONDS):
+        self.directory = directory
+        self.plant = plant
+        self.first_register = first_register
+        self.count = count
+        self.chunk_seconds = chunk_seconds
+        self.lock = threading.Lock()
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+        # (first ms, last ms, path), sorted by first ms
+        self.index = []
+        for path in glob.glob(os.path.join(directory, '%s-*.vph' % plant)):
+            with open(path, 'rb') as f:
+                _, _, _, t_first, t_last = read_header(f.read(HEADER.size))
+            self.index.append((t_first, t_last, path))
+        self.index.sort()
+
+        self._times = []
+        self._columns = [array('H') for _ in range(count)]
+
+    def append(self, t, registers):
+        """Add one sample of all registers taken at t (seconds)."""
+        with self.lock:
+            self._times.append(int(round(t * 1000)))
+            for column, value in zip(self._columns, registers):
+                column.append(value & 0xFFFF)
+            if self._times[-1] - self._times[0] >= self.chunk_seconds * 1000:
+                self._flush()
+
+    def flush(self):
+        with self.lock:
+            self._flush()
+
+    def _flush(self):
+        if not self._times:
+            return
+        data = encode_chunk(self._times, self._columns, self.first_register)
+        path = os.path.join(self.directory, '%s-%d.vph' % (self.plant, self._times[0]))
+        # Write then rename so readers never see half a chunk
+        with open(path + '.tmp', 'wb') as f:
+            f.write(data)
+        os.rename(path + '.tmp', path)
+        self.index.append((self._times[0], self._times[-1], path))
+        self.index.sort()
+        log.debug("Wrote %d samples to %s (%d bytes)" % (len(self._times), path, len(data)))
+        self._times = []
+        self._columns = [array('H') for _ in range(self.count)]
+
+    def query(self, start, end, registers=None):
+        """Samples with start <= t < end (seconds).
+
+        Returns (times in seconds, {register: values}), including samples
+        not yet flushed to disk.  Raises ValueError for registers the
+        historian does not record.
+        """
+        lo, hi = int(start * 1000), int(end * 1000)
+        known = set(range(self.first_register, self.first_register + self.count))
+        if registers is not None:
+            registers = set(registers)
+            unknown = registers - known
+            if unknown:
+                raise ValueError("registers %s not recorded; the historian holds 0x%02x-0x%02x"
+                                 % (', '.join('0x%02x' % r for r in sorted(unknown)),
+                                    self.first_register, self.first_register + self.count - 1))
+        wanted = registers if registers is not None else known
+
+        with self.lock:
+            chunks = [path for t_first, t_last, path in self.index if t_last >= lo and t_first < hi]
+            pending_times = list(self._times)
+            pending = dict((self.first_register + i, list(column))
+                           for i, column in enumerate(self._columns)
+                           if self.first_register + i in wanted)
+
+        times = []
+        columns = dict((r, []) for r in wanted)
+        parts = []
+        for path in chunks:
+            with open(path, 'rb') as f:
+                parts.append(decode_chunk(f.read(), wanted))
+        parts.append((pending_times, pending))
+
+        for chunk_times, chunk_columns in parts:
+            a = bisect.bisect_left(chunk_times, lo)
+            b = bisect.bisect_left(chunk_times, hi)
+            if a == b:
+                continue
+            times.extend(t / 1000 for t in chunk_times[a:b])
+            for r in wanted:
+                columns[r].extend(chunk_columns[r][a:b])
+        return times, columns
+
+    def downsample(self, start, end, step, registers=None, how='mean'):
+        """One row per step seconds, aggregated with mean, min, max or last.
+
+        Returns (bucket start times, {register: values}); empty buckets are
+        left out.
+        """
+        aggregate = {
+            'mean': lambda v: sum(v) / len(v),
+            'min': min,
+            'max': max,
+            'last': lambda v: v[-1],
+        }[how]
+
+        times, columns = self.query(start, end, registers)
+        out_times = []
+        out = dict((r, []) for r in columns)
+        i = 0
+        while i < len(times):
+            bucket = start + int((times[i] - start) // step) * step
+            j = bisect.bisect_left(times, bucket + step, i)
+            out_times.append(bucket)
+            for r, values in columns.items():
+                out[r].append(aggregate(values[i:j]))
+            i = j
+        return out_times, out
+
+    def size(self):
+        return sum(os.path.getsize(path) for _, _, path in self.index)
+
+
+class HistorianRecorder(object):
+    """Polls all holding registers of a plant into a Historian."""
+
+    def __init__(self, client, historian, rate=SAMPLE_RATE):
+        self.client = client
+        self.historian = historian
+        self.rate = rate
+        self.samples = 0
+        self._running = False
+
+    def start(self):
+        self._running = True
+        thread = threading.Thread(target=self.run, name='historian')
+        thread.daemon = True
+        thread.start()
+
+    def stop(self):
+        self._running = False
+        self.historian.flush()
+
+    def run(self):
+        period = 1.0 / self.rate
+        deadline = time.time()
+        first, count = self.historian.first_register, self.historian.count
+        while self._running:
+            deadline += period
+            delay = deadline - time.time()
+            if delay > 0:
+                time.sleep(delay)
+            else:
+                deadline = time.time()
+
+            if not self.client.online:
+                continue
+            try:
+                rr = self.client.read_holding_registers(first, count)
+                regs = rr.registers
+            except (ConnectionException, AttributeError):
+                continue
+            self.historian.append(time.time(), regs)
+            self.samples += 1
+
+
+def parse_time(value, now):
+    # Absolute epoch seconds, or negative seconds relative to now
+    value = float(value)
+    return now + value if value <= 0 else value
+
+
+def main():
+    logging.basicConfig()
+    log.setLevel(logging.INFO)
+
+    parser = argparse.ArgumentParser(description='VirtuaPlant register historian')
+    parser.add_argument("-d", dest="directory", default="history",
+                        help="Directory holding the chunk files")
+    parser.add_argument("-n", dest="plant", required=True,
+                        help="Plant name, used to name the chunk files")
+    sub = parser.add_subparsers(dest="command")
+    sub.required = True
+
+    record = sub.add_parser("record", help="Sample a plant until interrupted")
+    record.add_argument("-t", dest="server_addr", required=True, help="Modbus server IP address")
+    record.add_argument("-m", dest="server_port", type=int, default=5020, help="Modbus server port")
+    record.add_argument("-r", dest="rate", type=float, default=SAMPLE_RATE, help="Samples per second")
+    record.add_argument("-c", dest="chunk_seconds", type=int, default=CHUNK_SECONDS,
+                        help="Seconds of samples per chunk file")
+
+    query = sub.add_parser("query", help="Print samples as CSV")
+    query.add_argument("--start", default="-3600",
+                       help="Epoch seconds, or seconds before now when negative")
+    query.add_argument("--end", default="0",
+                       help="Epoch seconds, or seconds before now when negative or 0")
+    query.add_argument("--registers", help="Comma separated register addresses (default: all)")
+    query.add_argument("--step", type=float, help="Downsample to one row per STEP seconds")
+    query.add_argument("--how", default="mean", choices=["mean", "min", "max", "last"])
+
+    args = parser.parse_args()
+
+    if args.command == "record":
+        from modbus_connection import ConnectionManager
+
+        historian = Historian(args.directory, args.plant, chunk_seconds=args.chunk_seconds)
+        client = ConnectionManager(args.server_addr, args.server_port)
+        client.start()
+        recorder = HistorianRecorder(client, historian, args.rate)
+        recorder.start()
+        try:
+            while True:
+                time.sleep(60)
+                log.info("%d samples, %d bytes on disk" % (recorder.samples, historian.size()))
+        except KeyboardInterrupt:
+            recorder.stop()
+            client.stop()
+        return 0
+
+    historian = Historian(args.directory, args.plant)
+    now = time.time()
+    registers = None
+    try:
+        if args.registers:
+            registers = [int(r, 0) for r in args.registers.split(',')]
+        start, end = parse_time(args.start, now), parse_time(args.end, now)
+        if args.step:
+            times, columns = historian.downsample(start, end, args.step, registers, args.how)
+        else:
+            times, columns = historian.query(start, end, registers)
+    except ValueError as ex:
+        parser.error(str(ex))
+
+    order = sorted(columns)
+    print(",".join(["time"] + ["0x%02x" % r for r in order]))
+    for i, t in enumerate(times):
+        print(",".join(["%.3f" % t] + [str(columns[r][i]) for r in order]))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,220 @@
+#!/usr/bin/env python
+# Attack-to-impact latency analytics.
+#
+# How long does an attack take to show up in the process?  Run a world
+# with both its traffic capture and its event log on, attack it, then
+# line the two up:
+#
+#   ./oil_world.py -t 127.0.0.1 --capture modbus.cap --events events.csv
+#   ./impact.py modbus.cap events.csv -n oil-refinery -e oil_spilled
+#
+# Every client connection in the capture that wrote all the registers an
+# attack in the plant's attacks/ directory writes (the unconditional
+# writes of a scenario, the values of a script) is a run of that attack,
+# starting at the first of those writes.  For every run and kind of event
+# the latency is the time to the first such event after the start, if
+# one came within the horizon (-w).  The report gives per attack and
+# event the runs hit, the latency distribution and how often the event
+# came per minute over the horizon before and after the starts; -o
+# writes every run's latencies to a CSV file.
+#
+# Capture and events are stamped by the same clock in the world process,
+# so no clock sync is involved.
+
+from __future__ import division
+
+import argparse
+import bisect
+import csv
+import logging
+import sys
+
+import dataset
+from capture import REQUEST, read_capture
+from events import read_events
+from scenario import TAG_MODULES
+
+log = logging.getLogger(__name__)
+
+# Seconds after an attack's start an event still counts as its impact
+HORIZON = 600
+
+# Register writes: write single register, write multiple registers
+WRITE_FUNCTIONS = (0x06, 0x10)
+
+
+def attack_signatures(plant):
+    """[(attack name, set of (address, register))] of the attacks of a
+    plant, the ones writing the most registers first."""
+    signatures = []
+    for scenario in dataset.load_attacks(plant):
+        pairs = set()
+        for step in scenario.steps:
+            # A conditional write may never go out
+            if step.when:
+                continue
+            for address, registers in step.runs:
+                pairs.update((address + i, register) for i, register in enumerate(registers))
+        if pairs:
+            signatures.append((scenario.name, pairs))
+    signatures.sort(key=lambda signature: -len(signature[1]))
+    return signatures
+
+
+def written(path, hosts=None):
+    """{(client, server port): {(address, register): first written}} of
+    the register writes in a capture, from hosts if given."""
+    clients = {}
+    for r in read_capture(path):
+        if (r.direction != REQUEST or r.function_code not in WRITE_FUNCTIONS
+                or r.values is None or (hosts and r.client[0] not in hosts)):
+            continue
+        pairs = clients.setdefault((r.client, r.server_port), {})
+        for i, value in enumerate(r.values):
+            pairs.setdefault((r.address + i, value), r.time)
+    return clients
+
+
+def attack_runs(clients, signatures):
+    """[(attack, client, start)] of the client connections that wrote an
+    attack's registers, by start."""
+    runs = []
+    for (client, server_port), pairs in clients.items():
+        for name, signature in signatures:
+            if signature <= set(pairs):
+                runs.append((name, client, min(pairs[pair] for pair in signature)))
+                break
+    runs.sort(key=lambda run: run[2])
+    return runs
+
+
+def _percentile(ordered, p):
+    return ordered[min(len(ordered) - 1, int(p / 100.0 * len(ordered)))]
+
+
+class Impact(object):
+    """Latencies from attack runs to the events of a world."""
+
+    def __init__(self, runs, events, kinds=None, horizon=HORIZON):
+        self.runs = runs
+        self.horizon = horizon
+        self.times = {}
+        for time, event, value in events:
+            self.times.setdefault(event, []).append(time)
+        self.kinds = kinds or sorted(self.times)
+        # (attack, client, start, {event: latency or None})
+        self.results = [(name, client, start,
+                         dict((kind, self.latency(kind, start)) for kind in self.kinds))
+                        for name, client, start in runs]
+
+    def latency(self, kind, start):
+        """Seconds from start to the first kind event, None if none came
+        within the horizon."""
+        times = self.times.get(kind, [])
+        i = bisect.bisect_left(times, start)
+        if i < len(times) and times[i] - start <= self.horizon:
+            return times[i] - start
+        return None
+
+    def _count(self, kind, low, high):
+        times = self.times.get(kind, [])
+        return bisect.bisect_left(times, high) - bisect.bisect_left(times, low)
+
+    def rates(self, kind, starts):
+        """Events a minute over the horizon before and after starts."""
+        minutes = len(starts) * self.horizon / 60
+        before = sum(self._count(kind, start - self.horizon, start) for start in starts)
+        after = sum(self._count(kind, start, start + self.horizon) for start in starts)
+        return before / minutes, after / minutes
+
+    def report(self):
+        lines = ["impact: %d runs of %d attacks, %d events of %d kinds, horizon %d s"
+                 % (len(self.runs), len(set(name for name, client, start in self.runs)),
+                    sum(len(times) for times in self.times.values()), len(self.times),
+                    self.horizon)]
+        lines.append("  %-20s %-18s %5s %5s %8s %8s %8s %8s %9s %9s"
+                     % ('attack', 'event', 'runs', 'hits', 'mean s', 'p50 s', 'p90 s', 'max s',
+                        '/min pre', '/min post'))
+        for name in sorted(set(name for name, client, start in self.runs)):
+            results = [(start, latencies) for attack, client, start, latencies in self.results
+                       if attack == name]
+            starts = [start for start, latencies in results]
+            for kind in self.kinds:
+                hits = sorted(latencies[kind] for start, latencies in results
+                              if latencies[kind] is not None)
+                before, after = self.rates(kind, starts)
+                if hits:
+                    stats = "%8.2f %8.2f %8.2f %8.2f" % (sum(hits) / len(hits), _percentile(hits, 50),
+                                                         _percentile(hits, 90), hits[-1])
+                else:
+                    stats = "%8s %8s %8s %8s" % ('-', '-', '-', '-')
+                lines.append("  %-20s %-18s %5d %5d %s %9.2f %9.2f"
+                             % (name, kind, len(results), len(hits), stats, before, after))
+        return '\n'.join(lines)
+
+    def write_csv(self, path):
+        with open(path, 'w') as f:
+            writer = csv.writer(f)
+            writer.writerow(['attack', 'client', 'start', 'event', 'latency'])
+            for name, client, start, latencies in self.results:
+                for kind in self.kinds:
+                    latency = latencies[kind]
+                    writer.writerow([name, '%s:%d' % client, '%.6f' % start, kind,
+                                     '' if latency is None else '%.6f' % latency])
+
+
+# Override Argument parser to throw error and generate help message
+# if undefined args are passed
+class MyParser(argparse.ArgumentParser):
+    def error(self, message):
+        sys.stderr.write('error: %s\n' % message)
+        self.print_help()
+        sys.exit(2)
+
+
+def main():
+    parser = MyParser(
+        description = 'This Python script measures how long attacks take to show up in the process',
+        epilog = '',
+        add_help = True)
+    parser.add_argument("capture",
+                        help = "Capture log written by the world's plant server")
+    parser.add_argument("events",
+                        help = "Event log written by the world")
+    parser.add_argument("-n", action = "store", dest="plant", required=True,
+                        choices=sorted(TAG_MODULES),
+                        help = "Plant whose attacks/ to look for")
+    parser.add_argument("-e", action = "append", dest="kinds",
+                        help = "Event to measure (repeatable; default all in the log)")
+    parser.add_argument("-w", action = "store", dest="horizon", type=float, default=HORIZON,
+                        help = "Seconds after an attack starts its impact may come (default %d)" % HORIZON)
+    parser.add_argument("-a", action = "append", dest="hosts",
+                        help = "Only count clients from this host as attackers (repeatable)")
+    parser.add_argument("-o", action = "store", dest="output",
+                        help = "Write every run's latencies to this CSV file")
+    args = parser.parse_args()
+
+    if args.horizon <= 0:
+        parser.error("the horizon must be positive")
+
+    logging.basicConfig()
+    log.setLevel(logging.INFO)
+
+    try:
+        signatures = attack_signatures(args.plant)
+        runs = attack_runs(written(args.capture, args.hosts), signatures)
+        events = read_events(args.events)
+    except (IOError, ValueError) as ex:
+        parser.error(str(ex))
+    if not runs:
+        log.warning("No client in %s wrote all the registers of any of %s"
+                    % (args.capture, ', '.join(name for name, signature in signatures)))
+        return 1
+    impact = Impact(runs, events, args.kinds, args.horizon)
+    print(impact.report())
+    if args.output:
+        impact.write_csv(args.output)
+        log.info("Wrote %d runs to %s" % (len(runs), args.output))
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,151 @@
+#!/usr/bin/env python
+# Prometheus metrics for the worlds.
+#
+# A world with --metrics PORT answers http://127.0.0.1:PORT/metrics in the
+# Prometheus text format with:
+#
+#   virtuaplant_frame_seconds              histogram of whole frames
+#   virtuaplant_frame_phase_seconds        histogram per frame phase
+#   virtuaplant_frames_total               frames drawn
+#   virtuaplant_fps, virtuaplant_target_fps
+#   virtuaplant_particles{type}            particles alive, per kind
+#   virtuaplant_collisions_total{handler}  collision callbacks run
+#   virtuaplant_modbus_requests_total{function}
+#   virtuaplant_modbus_connections         open Modbus connections
+#
+# Frame times come from the world's frame_timer.FrameTimer, Modbus counts
+# from its plant server.  Everything is read when scraped, so keeping the
+# metrics costs the world a counter increment per collision callback.
+
+from __future__ import division
+
+import collections
+import logging
+
+from twisted.internet import reactor
+from twisted.web.resource import Resource
+from twisted.web.server import Site
+
+log = logging.getLogger(__name__)
+
+# Interface the endpoint listens on; the metrics are for the local scraper
+INTERFACE = '127.0.0.1'
+
+CONTENT_TYPE = b'text/plain; version=0.0.4; charset=utf-8'
+
+
+def _labels(labels):
+    if not labels:
+        return ''
+    return '{%s}' % ','.join('%s="%s"' % (name, str(value).replace('\\', '\\\\').replace('"', '\\"'))
+                             for name, value in labels)
+
+
+def _number(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class WorldMetrics(object):
+    """What a world exposes at /metrics.
+
+    particles maps a particle kind to the list holding them; the world
+    fills it in once its lists exist.  server is the plant server factory,
+    set by StartPlantServer.
+    """
+
+    def __init__(self, frame_timer=None):
+        self.frame_timer = frame_timer
+        self.particles = {}
+        self.collisions = collections.Counter()
+        self.server = None
+
+    def counted(self, handler):
+        """handler, counting its calls by name; use as a decorator on
+        collision callbacks."""
+        name = handler.__name__
+        collisions = self.collisions
+
+        def counted_handler(*args, **kwargs):
+            collisions[name] += 1
+            return handler(*args, **kwargs)
+        counted_handler.__name__ = name
+        counted_handler.__doc__ = handler.__doc__
+        return counted_handler
+
+    def _histogram(self, lines, name, histogram, labels=()):
+        # Copied first, as the world thread keeps adding
+        counts = list(histogram.counts)
+        total = histogram.total
+        cumulative = 0
+        for bound, count in zip(list(histogram.bounds) + [float('inf')], counts):
+            cumulative += count
+            lines.append('%s_bucket%s %d' % (name, _labels(list(labels) + [('le', _number(bound))]),
+                                            cumulative))
+        lines.append('%s_sum%s %s' % (name, _labels(labels), _number(total)))
+        lines.append('%s_count%s %d' % (name, _labels(labels), cumulative))
+
+    def _family(self, lines, name, kind, help, samples=None):
+        lines.append('# HELP %s %s' % (name, help))
+        lines.append('# TYPE %s %s' % (name, kind))
+        for labels, value in samples or []:
+            lines.append('%s%s %s' % (name, _labels(labels), _number(value)))
+
+    def render(self):
+        lines = []
+        timer = self.frame_timer
+        if timer is not None:
+            histograms = dict(timer.histograms)
+            if 'frame' in histograms:
+                self._family(lines, 'virtuaplant_frame_seconds', 'histogram',
+                             'Time a frame took')
+                self._histogram(lines, 'virtuaplant_frame_seconds', histograms['frame'])
+            self._family(lines, 'virtuaplant_frame_phase_seconds', 'histogram',
+                         'Time a frame spent in each phase')
+            for phase in list(timer.phases):
+                # A phase first seen while copying has no histogram yet
+                if phase != 'frame' and phase in histograms:
+                    self._histogram(lines, 'virtuaplant_frame_phase_seconds', histograms[phase],
+                                    [('phase', phase)])
+            self._family(lines, 'virtuaplant_frames_total', 'counter', 'Frames drawn',
+                         [((), timer.frames)])
+            self._family(lines, 'virtuaplant_fps', 'gauge',
+                         'Frames a second drawn over the last second', [((), timer.fps)])
+            if timer.budget:
+                self._family(lines, 'virtuaplant_target_fps', 'gauge', 'Frames a second aimed for',
+                             [((), 1 / timer.budget)])
+        self._family(lines, 'virtuaplant_particles', 'gauge', 'Particles in the world by kind',
+                     [((('type', kind),), len(items)) for kind, items in sorted(self.particles.items())])
+        self._family(lines, 'virtuaplant_collisions_total', 'counter',
+                     'Collision callbacks run by handler',
+                     [((('handler', name),), count) for name, count in sorted(self.collisions.items())])
+        server = self.server
+        if server is not None:
+            self._family(lines, 'virtuaplant_modbus_requests_total', 'counter',
+                         'Modbus requests received by function code',
+                         [((('function', code),), count)
+                          for code, count in sorted(server.requests.items())])
+            self._family(lines, 'virtuaplant_modbus_connections', 'gauge', 'Open Modbus connections',
+                         [((), server.connections)])
+        return ('\n'.join(lines) + '\n').encode('utf-8')
+
+
+class MetricsResource(Resource):
+    isLeaf = True
+
+    def __init__(self, metrics):
+        Resource.__init__(self)
+        self.metrics = metrics
+
+    def render_GET(self, request):
+        request.setHeader(b'Content-Type', CONTENT_TYPE)
+        return self.metrics.render()
+
+
+def StartMetricsServer(metrics, port, interface=INTERFACE):
+    """Serve metrics at /metrics on port once the reactor runs."""
+    root = Resource()
+    root.putChild(b'metrics', MetricsResource(metrics))
+    log.info("Serving metrics on http://%s:%s/metrics" % (interface, port))
+    return reactor.listenTCP(port, Site(root), interface=interface)
@@ -0,0 +1,169 @@
+#!/usr/bin/env python
+# Shared Modbus TCP connection handling for the HMIs.
+#
+# The HMIs poll from GTK timeouts, so a blocking connect() to a dead PLC
+# freezes the whole window.  ConnectionManager keeps the socket alive from a
+# worker thread instead and exposes the same request methods as the pymodbus
+# sync client, failing fast while the PLC is unreachable.
+
+import logging
+import random
+import socket
+import threading
+
+from pymodbus.client.sync import ModbusTcpClient as ModbusClient
+from pymodbus.exceptions import ConnectionException
+
+log = logging.getLogger(__name__)
+
+# Seconds allowed for the TCP handshake and for each response
+CONNECT_TIMEOUT = 2.0
+
+# Reconnect delay bounds in seconds.  The cap doubles after every failed
+# attempt and the actual delay is drawn at random below it (jitter), so a
+# room full of HMIs does not hammer a restarting PLC in lockstep.
+BACKOFF_MIN = 0.5
+BACKOFF_MAX = 30.0
+
+# Connection states passed to the status callback
+OFFLINE = 'OFFLINE'
+CONNECTING = 'CONNECTING'
+ONLINE = 'ONLINE'
+
+
+class ConnectionManager(object):
+    """Modbus TCP client that reconnects in the background.
+
+    on_status(state, retry_in) is called from the worker thread whenever the
+    state changes; GTK callers should hand it over with GLib.idle_add.
+    retry_in is the backoff delay in seconds when state is OFFLINE.
+    """
+
+    def __init__(self, host, port, on_status=None, timeout=CONNECT_TIMEOUT,
+                 backoff_min=BACKOFF_MIN, backoff_max=BACKOFF_MAX):
+        self.host = host
+        self.port = int(port)
+        self.timeout = timeout
+        self.backoff_min = backoff_min
+        self.backoff_max = backoff_max
+        self.on_status = on_status
+        self.state = OFFLINE
+
+        self.client = ModbusClient(self.host, port=self.port)
+
+        self._online = threading.Event()
+        self._wake = threading.Event()
+        self._lock = threading.Lock()
+        self._running = False
+        self._thread = None
+
+    @property
+    def online(self):
+        return self._online.is_set()
+
+    def start(self):
+        if self._running:
+            return
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name='modbus-connection')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        self._running = False
+        self._wake.set()
+        self.close()
+
+    def close(self):
+        self._online.clear()
+        with self._lock:
+            self.client.close()
+
+    def lost(self):
+        # Called by users of the client when a request failed; the worker
+        # takes it from here
+        if self._online.is_set():
+            log.info("Lost connection to %s:%s" % (self.host, self.port))
+            self.close()
+            self._wake.set()
+
+    def retarget(self, host, port):
+        with self._lock:
+            self.client.close()
+            self.host = host
+            self.port = int(port)
+            self.client = ModbusClient(self.host, port=self.port)
+            self._online.clear()
+        self._wake.set()
+
+    # pymodbus sync client interface.  Requests never try to (re)connect
+    # themselves: while offline they raise ConnectionException immediately.
+    def read_holding_registers(self, address, count=1, **kwargs):
+        return self._request('read_holding_registers', address, count, **kwargs)
+
+    def write_register(self, address, value, **kwargs):
+        return self._request('write_register', address, value, **kwargs)
+
+    def write_registers(self, address, values, **kwargs):
+        return self._request('write_registers', address, values, **kwargs)
+
+    def execute(self, request):
+        return self._request('execute', request)
+
+    def _request(self, name, *args, **kwargs):
+        if not self._online.is_set():
+            raise ConnectionException("%s:%s is offline" % (self.host, self.port))
+        try:
+            with self._lock:
+                return getattr(self.client, name)(*args, **kwargs)
+        except (ConnectionException, socket.error) as ex:
+            self.lost()
+            raise ConnectionException(str(ex))
+
+    def _set_state(self, state, retry_in=0):
+        self.state = state
+        if self.on_status is not None:
+            self.on_status(state, retry_in)
+
+    def _connect(self):
+        with self._lock:
+            client = self.client
+            address = (self.host, self.port)
+        try:
+            sock = socket.create_connection(address, self.timeout)
+        except socket.error as ex:
+            log.debug("Connecting to %s:%s failed: %s" % (address[0], address[1], ex))
+            return False
+        sock.settimeout(self.timeout)
+        with self._lock:
+            if client is not self.client:
+                # Retargeted while we were connecting
+                sock.close()
+                return False
+            # The sync client talks over whatever socket is attached to it,
+            # which lets us bound the handshake with our own timeout
+            client.close()
+            client.socket = sock
+        return True
+
+    def _run(self):
+        attempt = 0
+        while self._running:
+            if self._online.is_set():
+                self._wake.wait()
+                self._wake.clear()
+                continue
+
+            self._set_state(CONNECTING)
+            if self._connect():
+                attempt = 0
+                self._online.set()
+                self._set_state(ONLINE)
+                continue
+
+            ceiling = min(self.backoff_max, self.backoff_min * (2 ** attempt))
+            delay = random.uniform(self.backoff_min, ceiling)
+            attempt += 1
+            self._set_state(OFFLINE, delay)
+            self._wake.wait(delay)
+            self._wake.clear()
@@ -0,0 +1,226 @@
+#!/usr/bin/env python
+# Atomic register update messages understood by the plant servers.
+#
+# Controllers that adjust a shared process value with a read followed by a
+# write lose each other's updates.  These requests let the server do the
+# read-modify-write under the datastore lock instead:
+#
+#   0x16 (22) Mask Write Register: value = (value & and_mask) | (or_mask & ~and_mask)
+#   0x41 (65) Accumulate: value = clamp(value + delta, low, high), delta signed
+#   0x42 (66) Compare and Swap: value = new if value == expected
+#
+# 65 and 66 are in the range the Modbus spec reserves for user functions.
+# The server side needs a plant_server.PlantSlaveContext; clients decode the
+# responses after install_client_decoder(client).
+
+import struct
+
+from pymodbus.factory import ClientDecoder, ServerDecoder
+from pymodbus.pdu import ModbusRequest, ModbusResponse
+from pymodbus.pdu import ModbusExceptions as merror
+
+
+class MaskWriteRequest(ModbusRequest):
+
+    function_code = 0x16
+    _rtu_frame_size = 10
+
+    def __init__(self, address=0, and_mask=0xFFFF, or_mask=0x0000, **kwargs):
+        ModbusRequest.__init__(self, **kwargs)
+        self.address = address
+        self.and_mask = and_mask
+        self.or_mask = or_mask
+
+    def encode(self):
+        return struct.pack('>HHH', self.address, self.and_mask, self.or_mask)
+
+    def decode(self, data):
+        self.address, self.and_mask, self.or_mask = struct.unpack('>HHH', data[:6])
+
+    def get_response_pdu_size(self):
+        return 1 + 6
+
+    def execute(self, context):
+        if not hasattr(context, 'mask_write'):
+            return self.doException(merror.IllegalFunction)
+        if not context.validate(3, self.address, 1):
+            return self.doException(merror.IllegalAddress)
+        context.mask_write(self.address, self.and_mask, self.or_mask)
+        return MaskWriteResponse(self.address, self.and_mask, self.or_mask)
+
+    def __str__(self):
+        return "MaskWriteRequest(%d, 0x%04x, 0x%04x)" % (self.address, self.and_mask, self.or_mask)
+
+
+class MaskWriteResponse(ModbusResponse):
+
+    function_code = 0x16
+    _rtu_frame_size = 10
+
+    def __init__(self, address=0, and_mask=0xFFFF, or_mask=0x0000, **kwargs):
+        ModbusResponse.__init__(self, **kwargs)
+        self.address = address
+        self.and_mask = and_mask
+        self.or_mask = or_mask
+
+    def encode(self):
+        return struct.pack('>HHH', self.address, self.and_mask, self.or_mask)
+
+    def decode(self, data):
+        self.address, self.and_mask, self.or_mask = struct.unpack('>HHH', data[:6])
+
+
+class AccumulateRequest(ModbusRequest):
+
+    function_code = 0x41
+    _rtu_frame_size = 12
+
+    def __init__(self, address=0, delta=0, low=0, high=0xFFFF, **kwargs):
+        ModbusRequest.__init__(self, **kwargs)
+        self.address = address
+        self.delta = delta
+        self.low = low
+        self.high = high
+
+    def encode(self):
+        return struct.pack('>HhHH', self.address, self.delta, self.low, self.high)
+
+    def decode(self, data):
+        self.address, self.delta, self.low, self.high = struct.unpack('>HhHH', data[:8])
+
+    def get_response_pdu_size(self):
+        return 1 + 4
+
+    def execute(self, context):
+        if not hasattr(context, 'accumulate'):
+            return self.doException(merror.IllegalFunction)
+        if self.low > self.high:
+            return self.doException(merror.IllegalValue)
+        if not context.validate(3, self.address, 1):
+            return self.doException(merror.IllegalAddress)
+        value = context.accumulate(self.address, self.delta, self.low, self.high)
+        return AccumulateResponse(self.address, value)
+
+    def __str__(self):
+        return "AccumulateRequest(%d, %+d, %d..%d)" % (self.address, self.delta, self.low, self.high)
+
+
+class AccumulateResponse(ModbusResponse):
+    """Carries the register value after the delta was applied."""
+
+    function_code = 0x41
+    _rtu_frame_size = 8
+
+    def __init__(self, address=0, value=0, **kwargs):
+        ModbusResponse.__init__(self, **kwargs)
+        self.address = address
+        self.value = value
+
+    def encode(self):
+        return struct.pack('>HH', self.address, self.value)
+
+    def decode(self, data):
+        self.address, self.value = struct.unpack('>HH', data[:4])
+
+
+class CompareAndSwapRequest(ModbusRequest):
+
+    function_code = 0x42
+    _rtu_frame_size = 10
+
+    def __init__(self, address=0, expected=0, value=0, **kwargs):
+        ModbusRequest.__init__(self, **kwargs)
+        self.address = address
+        self.expected = expected
+        self.value = value
+
+    def encode(self):
+        return struct.pack('>HHH', self.address, self.expected, self.value)
+
+    def decode(self, data):
+        self.address, self.expected, self.value = struct.unpack('>HHH', data[:6])
+
+    def get_response_pdu_size(self):
+        return 1 + 5
+
+    def execute(self, context):
+        if not hasattr(context, 'compare_and_swap'):
+            return self.doException(merror.IllegalFunction)
+        if not context.validate(3, self.address, 1):
+            return self.doException(merror.IllegalAddress)
+        swapped, value = context.compare_and_swap(self.address, self.expected, self.value)
+        return CompareAndSwapResponse(self.address, swapped, value)
+
+    def __str__(self):
+        return "CompareAndSwapRequest(%d, %d, %d)" % (self.address, self.expected, self.value)
+
+
+class CompareAndSwapResponse(ModbusResponse):
+    """Tells whether the swap happened and carries the register value now."""
+
+    function_code = 0x42
+    _rtu_frame_size = 9
+
+    def __init__(self, address=0, swapped=False, value=0, **kwargs):
+        ModbusResponse.__init__(self, **kwargs)
+        self.address = address
+        self.swapped = swapped
+        self.value = value
+
+    def encode(self):
+        return struct.pack('>HBH', self.address, 1 if self.swapped else 0, self.value)
+
+    def decode(self, data):
+        self.address, swapped, self.value = struct.unpack('>HBH', data[:5])
+        self.swapped = bool(swapped)
+
+
+REQUESTS = dict((r.function_code, r) for r in
+                (MaskWriteRequest, AccumulateRequest, CompareAndSwapRequest))
+RESPONSES = dict((r.function_code, r) for r in
+                 (MaskWriteResponse, AccumulateResponse, CompareAndSwapResponse))
+
+
+def _decode(table, message):
+    """Decode a PDU with one of our function codes, or return None."""
+    function_code = bytearray(message[:1])
+    if not function_code or function_code[0] not in table:
+        return None
+    pdu = table[function_code[0]]()
+    try:
+        pdu.decode(message[1:])
+    except struct.error:
+        return False
+    return pdu
+
+
+class PlantDecoder(ServerDecoder):
+    """Server decoder that also knows the atomic update requests."""
+
+    def decode(self, message):
+        request = _decode(REQUESTS, message)
+        if request is False:
+            return None
+        return request or ServerDecoder.decode(self, message)
+
+    def lookupPduClass(self, function_code):
+        return REQUESTS.get(function_code) or ServerDecoder.lookupPduClass(self, function_code)
+
+
+class PlantClientDecoder(ClientDecoder):
+    """Client decoder that also knows the atomic update responses."""
+
+    def decode(self, message):
+        response = _decode(RESPONSES, message)
+        if response is False:
+            return None
+        return response or ClientDecoder.decode(self, message)
+
+    def lookupPduClass(self, function_code):
+        return RESPONSES.get(function_code) or ClientDecoder.lookupPduClass(self, function_code)
+
+
+def install_client_decoder(client):
+    """Let a pymodbus sync client decode the atomic update responses."""
+    client.framer.decoder = PlantClientDecoder()
+    return client
@@ -0,0 +1,192 @@
+#!/usr/bin/env python
+# Modbus TCP server for the plant worlds.
+#
+# Same as pymodbus' StartTcpServer, but over a datastore with a lock so the
+# world, the soft-PLC and Modbus clients never interleave a read-modify-write,
+# and with a decoder that accepts the atomic update requests from
+# plant_messages (mask write, accumulate, compare and swap).  Given a
+# capture.Capture, the server also logs all the traffic it handles, and a
+# detector.WriteRateDetector checks every write request for attack-like
+# write rates.  Requests are executed by a scheduler.FairScheduler, round
+# robin between the connections, so a flooding client cannot starve the
+# others.  The factory counts requests by function code and the open
+# connections, for metrics.WorldMetrics.
+
+import collections
+import logging
+import threading
+
+from pymodbus.datastore import ModbusSequentialDataBlock
+from pymodbus.datastore import ModbusSlaveContext, ModbusServerContext
+from pymodbus.server.async import ModbusServerFactory, ModbusTcpProtocol
+from pymodbus.transaction import ModbusSocketFramer
+
+from capture import Capture, REQUEST, RESPONSE
+from detector import WriteRateDetector
+from scheduler import FairScheduler
+from plant_messages import PlantDecoder
+
+log = logging.getLogger(__name__)
+
+# Registers per block, matching what the worlds always allocated
+BLOCK_SIZE = 100
+
+
+class PlantSlaveContext(ModbusSlaveContext):
+    """Slave context whose reads, writes and updates hold one lock.
+
+    The lock is reentrant, so callers can hold it across several calls to
+    make a longer sequence atomic (the soft-PLC does for a whole scan).
+    The update helpers work on holding registers.
+    """
+
+    def __init__(self, *args, **kwargs):
+        ModbusSlaveContext.__init__(self, *args, **kwargs)
+        self.lock = threading.RLock()
+
+    def getValues(self, fx, address, count=1):
+        with self.lock:
+            return ModbusSlaveContext.getValues(self, fx, address, count)
+
+    def setValues(self, fx, address, values):
+        with self.lock:
+            ModbusSlaveContext.setValues(self, fx, address, values)
+
+    def mask_write(self, address, and_mask, or_mask):
+        with self.lock:
+            current = self.getValues(3, address)[0]
+            value = (current & and_mask) | (or_mask & ~and_mask & 0xFFFF)
+            self.setValues(3, address, [value])
+            return value
+
+    def accumulate(self, address, delta, low=0, high=0xFFFF):
+        with self.lock:
+            value = self.getValues(3, address)[0] + delta
+            value = max(low, min(high, value))
+            self.setValues(3, address, [value])
+            return value
+
+    def compare_and_swap(self, address, expected, value):
+        """Returns (swapped, register value afterwards)."""
+        with self.lock:
+            current = self.getValues(3, address)[0]
+            if current != expected:
+                return False, current
+            self.setValues(3, address, [value])
+            return True, value
+
+
+def create_context(size=BLOCK_SIZE):
+    """Single-slave server context over a PlantSlaveContext."""
+    store = PlantSlaveContext(
+        di = ModbusSequentialDataBlock(0, [0]*size),
+        co = ModbusSequentialDataBlock(0, [0]*size),
+        hr = ModbusSequentialDataBlock(0, [0]*size),
+        ir = ModbusSequentialDataBlock(0, [0]*size))
+    return ModbusServerContext(slaves=store, single=True)
+
+
+class PlantServerProtocol(ModbusTcpProtocol):
+    """Hands the bytes received and sent to the factory's capture, the
+    requests to its detector and their execution to its scheduler, if
+    any."""
+
+    def connectionMade(self):
+        ModbusTcpProtocol.connectionMade(self)
+        peer = self.transport.getPeer()
+        self.client = (getattr(peer, 'host', ''), getattr(peer, 'port', 0))
+        self.server_port = getattr(self.transport.getHost(), 'port', 0)
+        self.factory.connections += 1
+        if self.factory.scheduler is not None:
+            self.factory.scheduler.connect(self, "%s:%s" % self.client)
+
+    def connectionLost(self, reason):
+        self.factory.connections -= 1
+        if self.factory.scheduler is not None:
+            self.factory.scheduler.disconnect(self)
+        ModbusTcpProtocol.connectionLost(self, reason)
+
+    def dataReceived(self, data):
+        if self.factory.capture is not None:
+            self.factory.capture.record(REQUEST, self.client, self.server_port, data)
+        if self.factory.scheduler is not None:
+            self.factory.scheduler.receive(self, data, self._decode)
+        else:
+            ModbusTcpProtocol.dataReceived(self, data)
+
+    def _decode(self, data):
+        ModbusTcpProtocol.dataReceived(self, data)
+
+    def _execute(self, request):
+        self.factory.requests[request.function_code] += 1
+        if self.factory.detector is not None:
+            self.factory.detector.check(self.client[0], request)
+        if self.factory.scheduler is not None:
+            self.factory.scheduler.enqueue(self, request, self._execute_now)
+        else:
+            ModbusTcpProtocol._execute(self, request)
+
+    def _execute_now(self, request):
+        ModbusTcpProtocol._execute(self, request)
+
+    def _send(self, message):
+        if self.factory.capture is None:
+            return ModbusTcpProtocol._send(self, message)
+        # ModbusTcpProtocol._send, keeping hold of the packet it builds
+        if message.should_respond:
+            self.factory.control.Counter.BusMessage += 1
+            packet = self.framer.buildPacket(message)
+            self.factory.capture.record(RESPONSE, self.client, self.server_port, packet)
+            return self.transport.write(packet)
+
+
+class PlantServerFactory(ModbusServerFactory):
+
+    protocol = PlantServerProtocol
+
+    def __init__(self, store, framer=None, identity=None, capture=None, detector=None,
+                 scheduler=None, **kwargs):
+        ModbusServerFactory.__init__(self, store, framer, identity, **kwargs)
+        self.decoder = PlantDecoder()
+        self.capture = capture
+        self.detector = detector
+        self.scheduler = scheduler
+        # Requests received by function code, connections open
+        self.requests = collections.Counter()
+        self.connections = 0
+
+
+def StartPlantServer(context, identity=None, address=None, run=True, capture=None,
+                     detector=True, scheduler=True, client_rate=None, metrics=None):
+    """Listen on address (interface, port) and run the reactor.
+
+    With run=False the reactor is left for the caller to start.  capture
+    is a Capture or the path of a log to capture the traffic into; a path
+    is closed when the reactor shuts down.  detector is a
+    WriteRateDetector, True for one with the default limits reporting into
+    the context's input registers, or False.  scheduler is likewise a
+    FairScheduler, True for one limiting every connection to client_rate
+    requests a second (None for no limit), or False to execute requests
+    as they arrive.  metrics, a metrics.WorldMetrics, is given the
+    factory to report on.  Returns the factory.
+    """
+    from twisted.internet import reactor
+
+    address = address or ("", 502)
+    if capture is not None and not isinstance(capture, Capture):
+        capture = Capture(capture)
+        reactor.addSystemEventTrigger('after', 'shutdown', capture.close)
+        log.info("Capturing Modbus traffic to %s" % capture.path)
+    if detector is True:
+        detector = WriteRateDetector(context[0x00])
+    if scheduler is True:
+        scheduler = FairScheduler(rate=client_rate)
+    factory = PlantServerFactory(context, ModbusSocketFramer, identity, capture=capture,
+                                 detector=detector or None, scheduler=scheduler or None)
+    if metrics is not None:
+        metrics.server = factory
+    log.info("Starting Modbus TCP Server on %s:%s" % address)
+    reactor.listenTCP(address[1], factory, interface=address[0])
+    if run:
+        reactor.run()
+    return factory
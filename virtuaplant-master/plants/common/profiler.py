@@ -0,0 +1,198 @@
+#!/usr/bin/env python
+# On-demand sampling profiler for live plants.
+#
+# A world started with --profile DIR can be profiled without a restart,
+# attack or no attack:
+#
+#   kill -USR1 <world pid>                  # profile for --profile-seconds
+#
+# or, with --profile-register, by writing the seconds to profile into
+# holding register PROFILE_REGISTER (reset to 0 once seen), e.g.
+#
+#   ModbusTcpClient('127.0.0.1', 5020).write_register(98, 30)
+#
+# For that long a sampler thread takes the stack of every thread each
+# INTERVAL (sys._current_frames), so the world and reactor threads, and the
+# soft-PLC if it runs in the world, are profiled at once and run at full
+# speed: cProfile would only see the thread it is enabled in and slow
+# every call down.  Then it writes two files into DIR:
+#
+#   profile-20171017-114502.folded   one line per stack and thread with its
+#                                    sample count, for flamegraph.pl or
+#                                    speedscope
+#   profile-20171017-114502.txt      per thread, the functions holding the
+#                                    most samples, on their own and in total
+#
+# Threads that called name_thread() show under that name ('world',
+# 'reactor'), the others under their threading name.
+
+from __future__ import division
+
+import collections
+import logging
+import os
+import signal
+import sys
+import threading
+import time
+
+log = logging.getLogger(__name__)
+
+# Seconds between samples
+INTERVAL = 0.005
+
+# Seconds profiled on SIGUSR1
+SECONDS = 10
+
+# Longest profile the control register may ask for
+MAX_SECONDS = 600
+
+# Holding register that starts a profile of that many seconds
+PROFILE_REGISTER = 98
+
+# Seconds between looks at the register
+POLL_INTERVAL = 1.0
+
+# Functions listed per thread in the text report
+TOP = 25
+
+# Thread ident: name, for the threads that gave one
+THREAD_NAMES = {}
+
+
+def name_thread(name):
+    """Profile the calling thread under name."""
+    THREAD_NAMES[threading.current_thread().ident] = name
+
+
+def _frame_name(frame):
+    code = frame.f_code
+    return '%s:%s' % (os.path.basename(code.co_filename), code.co_name)
+
+
+def _stack(frame):
+    """Names of the frames of a stack, outermost first."""
+    stack = []
+    while frame is not None:
+        stack.append(_frame_name(frame))
+        frame = frame.f_back
+    stack.reverse()
+    return tuple(stack)
+
+
+class SamplingProfiler(object):
+    """Samples every thread's stack for a while and writes the counts into
+    directory."""
+
+    def __init__(self, directory, interval=INTERVAL):
+        self.directory = directory
+        self.interval = interval
+        self.thread = None
+
+    def running(self):
+        return self.thread is not None and self.thread.is_alive()
+
+    def start(self, seconds=SECONDS):
+        """Profile for seconds in the background; False if a profile is
+        already running."""
+        if self.running():
+            log.warning("Profile already running, not starting another")
+            return False
+        seconds = min(seconds, MAX_SECONDS)
+        log.info("Profiling every thread for %s s" % seconds)
+        self.thread = threading.Thread(target=self._run, args=(seconds,), name='profiler')
+        self.thread.daemon = True
+        self.thread.start()
+        return True
+
+    def _run(self, seconds):
+        me = threading.current_thread().ident
+        names = dict((t.ident, t.name) for t in threading.enumerate())
+        # {thread name: {stack: samples}}
+        samples = collections.defaultdict(collections.Counter)
+        started = time.time()
+        deadline = started + seconds
+        count = 0
+        while time.time() < deadline:
+            for ident, frame in sys._current_frames().items():
+                if ident == me:
+                    continue
+                if ident not in names:
+                    names = dict((t.ident, t.name) for t in threading.enumerate())
+                name = THREAD_NAMES.get(ident) or names.get(ident, str(ident))
+                samples[name][_stack(frame)] += 1
+            count += 1
+            time.sleep(self.interval)
+        try:
+            path = self.write(samples, started, time.time() - started, count)
+        except (IOError, OSError) as ex:
+            log.error("Could not write the profile: %s" % ex)
+        else:
+            log.info("Profile of %d samples written to %s.{folded,txt}" % (count, path))
+
+    def write(self, samples, started, elapsed, count):
+        """Writes the folded stacks and the report; returns their path
+        without extension."""
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+        path = os.path.join(self.directory,
+                            time.strftime('profile-%Y%m%d-%H%M%S', time.localtime(started)))
+        with open(path + '.folded', 'w') as f:
+            for name in sorted(samples):
+                for stack, n in sorted(samples[name].items()):
+                    f.write('%s;%s %d\n' % (name, ';'.join(stack), n))
+        with open(path + '.txt', 'w') as f:
+            f.write(self.report(samples, elapsed, count))
+        return path
+
+    def report(self, samples, elapsed, count):
+        lines = ["profile: %d samples over %.1f s, every %.1f ms"
+                 % (count, elapsed, self.interval * 1000)]
+        for name in sorted(samples):
+            stacks = samples[name]
+            own = collections.Counter()
+            total = collections.Counter()
+            for stack, n in stacks.items():
+                if stack:
+                    own[stack[-1]] += n
+                # Recursion counts a function once per stack
+                for function in set(stack):
+                    total[function] += n
+            taken = sum(stacks.values())
+            for title, counter in (('own', own), ('total', total)):
+                lines.append('')
+                lines.append("%s: %d samples, by %s" % (name, taken, title))
+                for function, n in counter.most_common(TOP):
+                    lines.append("  %6d %5.1f%%  %s" % (n, n / taken * 100, function))
+        return '\n'.join(lines) + '\n'
+
+
+def StartProfiler(profiler, seconds=SECONDS, context=None, register=PROFILE_REGISTER):
+    """Start profiler for seconds on SIGUSR1 and, given a server context,
+    for as many seconds as are written into holding register register.
+
+    Call from the reactor (main) thread before the reactor runs.
+    """
+    from twisted.internet import reactor, task
+
+    name_thread('reactor')
+
+    def on_signal(signum, frame):
+        reactor.callFromThread(profiler.start, seconds)
+    signal.signal(signal.SIGUSR1, on_signal)
+
+    if context is not None:
+        store = context[0x00]
+
+        def poll():
+            with store.lock:
+                asked = store.getValues(3, register)[0]
+                if asked:
+                    store.setValues(3, register, [0])
+            if asked:
+                profiler.start(asked)
+        task.LoopingCall(poll).start(POLL_INTERVAL, now=False)
+        log.info("Profiling on SIGUSR1 or a write to holding register %d, into %s"
+                 % (register, profiler.directory))
+    else:
+        log.info("Profiling on SIGUSR1, into %s" % profiler.directory)
@@ -0,0 +1,222 @@
+#!/usr/bin/env python
+# Replay of captured Modbus traffic.
+#
+# Sends the requests of a capture log (capture.py) to a plant again, each
+# client of the capture over a connection of its own, with the original
+# spacing between requests divided by the speed:
+#
+#   ./replay.py modbus.cap -t 127.0.0.1            # real time, original ports
+#   ./replay.py modbus.cap -t 127.0.0.1 -p 5020 -s 10
+#
+# Requests are sent at their offset from the start of the capture, not
+# from the previous request, so timer latency does not add up into drift;
+# the summary gives how late they went out, how long the plant took to
+# answer and how many answers were exceptions.  Responses in the capture
+# are not replayed; the plant answers afresh.
+
+from __future__ import division
+
+import argparse
+import logging
+import sys
+
+from twisted.internet import defer, protocol, reactor
+from pymodbus.client.async import ModbusClientProtocol
+
+from attack_engine import LatencyStats
+from capture import REQUEST, read_capture
+from plant_messages import install_client_decoder
+
+log = logging.getLogger(__name__)
+
+# Requests sent before letting the reactor read responses, when behind
+BATCH = 500
+
+# Seconds to wait for the last responses
+DRAIN_TIMEOUT = 5
+
+
+def sessions_of(path):
+    """{(client, server port): requests} of a capture, and the time of the
+    first and last request."""
+    sessions = {}
+    first = last = None
+    for r in read_capture(path):
+        if r.direction != REQUEST:
+            continue
+        key = (r.client, r.server_port)
+        sessions[key] = sessions.get(key, 0) + 1
+        if first is None:
+            first = r.time
+        last = r.time
+    return sessions, first, last
+
+
+class Replay(object):
+    """Sends the requests of a capture over the connections of its clients.
+
+    connections maps (client, server port) to a connected
+    ModbusClientProtocol.
+    """
+
+    def __init__(self, path, connections, speed=1.0):
+        self.path = path
+        self.connections = connections
+        self.speed = speed
+        self.finished = defer.Deferred()
+        self.start = None
+        self.first = None
+        self.records = None
+        self.next = None
+        self.in_flight = 0
+        self.sent = 0
+        self.skipped = 0
+        self.responses = 0
+        self.exceptions = 0
+        self.errors = 0
+        self.lateness = LatencyStats()
+        self.latency = LatencyStats()
+
+    def run(self, start):
+        self.start = start
+        self.records = (r for r in read_capture(self.path) if r.direction == REQUEST)
+        self.next = next(self.records, None)
+        if self.next is not None:
+            self.first = self.next.time
+        self._pump()
+        return self.finished
+
+    def _due(self, record):
+        return self.start + (record.time - self.first) / self.speed
+
+    def _pump(self):
+        now = reactor.seconds()
+        for i in range(BATCH):
+            if self.next is None or self._due(self.next) > now:
+                break
+            self._send(self.next, now)
+            self.next = next(self.records, None)
+        if self.next is None:
+            self._check_done()
+            reactor.callLater(DRAIN_TIMEOUT, self._finish)
+            return
+        reactor.callLater(max(0.0, self._due(self.next) - reactor.seconds()), self._pump)
+
+    def _send(self, record, now):
+        client = self.connections.get((record.client, record.server_port))
+        if client is None or record.message is None:
+            self.skipped += 1
+            return
+        self.lateness.add(max(0.0, now - self._due(record)))
+        self.sent += 1
+        self.in_flight += 1
+        d = client.execute(record.message)
+        d.addCallbacks(self._response, self._error, callbackArgs=(now,))
+
+    def _response(self, response, sent):
+        self.in_flight -= 1
+        self.responses += 1
+        if response is None or response.function_code > 0x80:
+            self.exceptions += 1
+        self.latency.add(reactor.seconds() - sent)
+        self._check_done()
+
+    def _error(self, failure):
+        self.in_flight -= 1
+        self.errors += 1
+        self._check_done()
+
+    def _check_done(self):
+        if self.next is None and self.in_flight == 0:
+            self._finish()
+
+    def _finish(self):
+        if not self.finished.called:
+            # Whatever is still in flight after DRAIN_TIMEOUT never came back
+            self.errors += self.in_flight
+            self.in_flight = 0
+            self.finished.callback(self)
+
+    def summary(self):
+        return ("replay: %d requests sent, %d skipped, %d responses, %d exceptions, "
+                "%d errors, late by mean %.2f ms max %.2f ms, %s"
+                % (self.sent, self.skipped, self.responses, self.exceptions, self.errors,
+                   self.lateness.mean() * 1000, self.lateness.max * 1000,
+                   self.latency.summary()))
+
+
+def run(path, host, port=None, speed=1.0):
+    """Replay path against host, on port or else each session's original
+    port; returns the Replay once done."""
+    sessions, first, last = sessions_of(path)
+    keys = sorted(sessions)
+    creator = protocol.ClientCreator(reactor, ModbusClientProtocol)
+    connections = [creator.connectTCP(host, port or server_port, timeout=5)
+                   for client, server_port in keys]
+    replay = Replay(path, {}, speed)
+
+    def connected(results):
+        for (client, server_port), (ok, conn) in zip(keys, results):
+            if not ok:
+                log.error("Unable to connect for %s:%d: %s"
+                          % (client[0], client[1], conn.getErrorMessage()))
+                continue
+            replay.connections[(client, server_port)] = install_client_decoder(conn)
+        log.info("Replaying %d requests of %d clients, %.1f s of traffic at %gx"
+                 % (sum(sessions.values()), len(replay.connections),
+                    (last - first) if first is not None else 0.0, speed))
+        return replay.run(reactor.seconds())
+
+    def finished(result):
+        for conn in replay.connections.values():
+            conn.transport.loseConnection()
+        if reactor.running:
+            reactor.stop()
+        return result
+
+    d = defer.DeferredList(connections, consumeErrors=True)
+    d.addCallback(connected)
+    d.addErrback(lambda failure: log.error(failure.getErrorMessage()))
+    d.addBoth(finished)
+    reactor.run()
+    return replay
+
+
+# Override Argument parser to throw error and generate help message
+# if undefined args are passed
+class MyParser(argparse.ArgumentParser):
+    def error(self, message):
+        sys.stderr.write('error: %s\n' % message)
+        self.print_help()
+        sys.exit(2)
+
+
+def main():
+    parser = MyParser(
+        description = 'This Python script replays captured Modbus traffic against a plant',
+        epilog = '',
+        add_help = True)
+    parser.add_argument("path",
+                        help = "Capture log written by a plant server")
+    parser.add_argument("-t", action = "store", dest="server_addr", default="127.0.0.1",
+                        help = "Plant Modbus server IP address (default 127.0.0.1)")
+    parser.add_argument("-p", action = "store", dest="port", type=int,
+                        help = "Plant Modbus port (default the port each client used)")
+    parser.add_argument("-s", action = "store", dest="speed", type=float, default=1.0,
+                        help = "Speed up the original timing this many times (default 1)")
+    args = parser.parse_args()
+
+    if args.speed <= 0:
+        parser.error("speed must be positive")
+
+    logging.basicConfig()
+    log.setLevel(logging.INFO)
+
+    try:
+        replay = run(args.path, args.server_addr, args.port, args.speed)
+    except (IOError, ValueError) as ex:
+        parser.error(str(ex))
+    log.info(replay.summary())
+
+if __name__ == '__main__':
+    sys.exit(main())
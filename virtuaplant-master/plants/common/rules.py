@@ -0,0 +1,221 @@
+#!/usr/bin/env python
+# Declarative PLC rules for the soft-PLC scan engine.
+#
+# A rule is a condition over tags plus the tag values to write when it holds
+# (then) and when it does not (otherwise):
+#
+#   Rule('relief valve', Above(PLC_TURBINE_PRESSURE, 400, hysteresis=100),
+#        then={PLC_TURBINE_PRESSURE_HIGH: 1},
+#        otherwise={PLC_TURBINE_PRESSURE_HIGH: 0})
+#
+# A RuleSet compiles a table of rules into an index from tag to the rules
+# that read or write it.  On each scan only the rules whose tags changed
+# since the previous scan are evaluated, in table order; a write made during
+# the scan wakes the later rules that depend on it at once and the earlier
+# ones on the next scan.  Rules with every=N
+# are periodic instead: they run every N seconds whatever changed, which is
+# what rate-based process steps need.
+#
+# Action values are constants or callables taking the process image.  A
+# callable may read any tag, so list those tags in reads= for event driven
+# rules.  All values of a rule are computed before any is written.
+
+from softplc import Program
+
+
+class Condition(object):
+
+    inputs = ()
+
+    def evaluate(self, io):
+        raise NotImplementedError
+
+
+def _value(io, operand):
+    # Thresholds are constants or, given as Ref(tag), other tags
+    if isinstance(operand, Ref):
+        return io[operand.address]
+    return operand
+
+
+def _inputs(*operands):
+    return tuple(o.address for o in operands if isinstance(o, Ref))
+
+
+class Ref(object):
+    """Use the value of another tag as a threshold."""
+
+    def __init__(self, address):
+        self.address = address
+
+
+class Above(Condition):
+    """tag > limit; once true it stays true down to limit - hysteresis."""
+
+    def __init__(self, address, limit, hysteresis=0):
+        self.address = address
+        self.limit = limit
+        self.hysteresis = hysteresis
+        self.inputs = (address,) + _inputs(limit)
+        self.state = False
+
+    def evaluate(self, io):
+        limit = _value(io, self.limit)
+        if self.state:
+            self.state = io[self.address] >= limit - self.hysteresis
+        else:
+            self.state = io[self.address] > limit
+        return self.state
+
+
+class Below(Condition):
+    """tag < limit; once true it stays true up to limit + hysteresis."""
+
+    def __init__(self, address, limit, hysteresis=0):
+        self.address = address
+        self.limit = limit
+        self.hysteresis = hysteresis
+        self.inputs = (address,) + _inputs(limit)
+        self.state = False
+
+    def evaluate(self, io):
+        limit = _value(io, self.limit)
+        if self.state:
+            self.state = io[self.address] <= limit + self.hysteresis
+        else:
+            self.state = io[self.address] < limit
+        return self.state
+
+
+class Equals(Condition):
+
+    def __init__(self, address, value):
+        self.address = address
+        self.value = value
+        self.inputs = (address,) + _inputs(value)
+
+    def evaluate(self, io):
+        return io[self.address] == _value(io, self.value)
+
+
+class All(Condition):
+
+    def __init__(self, *conditions):
+        self.conditions = conditions
+        self.inputs = sum((c.inputs for c in conditions), ())
+
+    def evaluate(self, io):
+        # Evaluate every term so hysteresis latches stay current
+        results = [c.evaluate(io) for c in self.conditions]
+        return all(results)
+
+
+class Any(Condition):
+
+    def __init__(self, *conditions):
+        self.conditions = conditions
+        self.inputs = sum((c.inputs for c in conditions), ())
+
+    def evaluate(self, io):
+        results = [c.evaluate(io) for c in self.conditions]
+        return any(results)
+
+
+class Not(Condition):
+
+    def __init__(self, condition):
+        self.condition = condition
+        self.inputs = condition.inputs
+
+    def evaluate(self, io):
+        return not self.condition.evaluate(io)
+
+
+class Rule(object):
+    """when is a Condition, or None for a rule that always holds."""
+
+    def __init__(self, name, when=None, then=None, otherwise=None, every=None, reads=()):
+        self.name = name
+        self.when = when
+        self.then = then or {}
+        self.otherwise = otherwise or {}
+        self.every = every
+        self.next_run = 0.0
+
+        outputs = set(self.then) | set(self.otherwise)
+        # Outputs count as inputs so a rule re-asserts a tag somebody else
+        # overwrote, as a PLC rewriting its outputs every scan would
+        self.inputs = set(when.inputs if when is not None else ()) | set(reads) | outputs
+
+    def fire(self, io):
+        """Evaluate the rule and write its actions; returns the tags changed."""
+        holds = self.when is None or self.when.evaluate(io)
+        actions = self.then if holds else self.otherwise
+        values = [(addr, value(io) if callable(value) else value)
+                  for addr, value in actions.items()]
+        changed = []
+        for addr, value in values:
+            before = io[addr]
+            io[addr] = value
+            if io[addr] != before:
+                changed.append(addr)
+        return changed
+
+
+class RuleSet(Program):
+    """A rule table run as one soft-PLC program."""
+
+    def __init__(self, name, rules):
+        Program.__init__(self)
+        self.name = name
+        self.rules = list(rules)
+        self.evaluations = 0
+        self.last = None
+        self.pending = set()
+        self.next_due = 0.0
+
+        # tag -> indexes of the event driven rules depending on it
+        self.index = {}
+        for i, rule in enumerate(self.rules):
+            if rule.every is None:
+                for addr in rule.inputs:
+                    self.index.setdefault(addr, []).append(i)
+
+    def scan(self, io):
+        now = io.now
+        if self.last is None:
+            dirty = set(i for i, r in enumerate(self.rules) if r.every is None)
+        elif io.values != self.last:
+            dirty = set()
+            for addr, (a, b) in enumerate(zip(io.values, self.last)):
+                if a != b:
+                    dirty.update(self.index.get(io.owner.get(addr, addr), ()))
+        elif not self.pending and now < self.next_due:
+            # Nothing changed and no periodic rule is due
+            return
+        else:
+            dirty = set()
+        dirty.update(self.pending)
+        self.pending = set()
+
+        for i, rule in enumerate(self.rules):
+            if rule.every is not None:
+                if now < rule.next_run:
+                    continue
+                rule.next_run += rule.every
+                if rule.next_run <= now:
+                    rule.next_run = now + rule.every
+            elif i not in dirty:
+                continue
+            self.evaluations += 1
+            for addr in rule.fire(io):
+                # Later rules see the write in this scan, the others in the next
+                for j in self.index.get(addr, ()):
+                    if j > i:
+                        dirty.add(j)
+                    else:
+                        self.pending.add(j)
+
+        periodic = [r.next_run for r in self.rules if r.every is not None]
+        self.next_due = min(periodic) if periodic else float('inf')
+        self.last = list(io.values)
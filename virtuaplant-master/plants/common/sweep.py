@@ -0,0 +1,189 @@
+#!/usr/bin/env python
+# Parameter sweeps over headless plant simulations.
+#
+# A sweep is the cross product of a few parameter axes.  Each point is run
+# by a plant's simulate(**parameters) function in a pool of worker
+# processes, and the outcomes come back as one table row per point:
+#
+#   points = grid([('fuel_rate', [2, 3, 4]), ('pressure_max', [350, 400])])
+#   rows = run(simulate, points, processes=8)
+#   write_table('sweep.csv', rows)
+#
+# simulate has to be a module level function, which the workers unpickle by
+# name, and returns a dict of outcomes.  Points share nothing, so a sweep
+# scales with the number of cores as long as there are several points per
+# worker.
+#
+# On the command line axes are given as name=first:last[:step] or as
+# name=value,value,...  (parse_axis).
+
+from __future__ import division
+
+import csv
+import inspect
+import itertools
+import multiprocessing
+
+
+def _number(text):
+    try:
+        return int(text)
+    except ValueError:
+        return float(text)
+
+
+def parse_axis(text):
+    """'name=2:6', 'name=300:400:25' or 'name=1,5,10' -> (name, values)."""
+    if '=' not in text:
+        raise ValueError("axis %r is not name=values" % text)
+    name, spec = text.split('=', 1)
+    if ':' in spec:
+        parts = [_number(p) for p in spec.split(':')]
+        if len(parts) not in (2, 3):
+            raise ValueError("axis %r is not name=first:last[:step]" % text)
+        first, last = parts[0], parts[1]
+        step = parts[2] if len(parts) == 3 else 1
+        if step <= 0:
+            raise ValueError("axis %r needs a positive step" % text)
+        count = int(round((last - first) / step)) + 1
+        values = [first + i * step for i in range(count)]
+    else:
+        values = [_number(v) for v in spec.split(',')]
+    return name.strip(), values
+
+
+def defaults(simulate):
+    """Keyword arguments of simulate and their defaults, {name: value}."""
+    getspec = getattr(inspect, 'getfullargspec', None) or inspect.getargspec
+    spec = getspec(simulate)
+    args, values = spec[0], spec[3] or ()
+    return dict(zip(args[len(args) - len(values):], values))
+
+
+def grid(axes, fixed=None):
+    """Every combination of the axes [(name, values), ...] as dicts.
+
+    fixed holds parameters common to every point.
+    """
+    names = [name for name, values in axes]
+    points = []
+    for combination in itertools.product(*[values for name, values in axes]):
+        point = dict(fixed or {})
+        point.update(zip(names, combination))
+        points.append(point)
+    return points
+
+
+class _Simulation(object):
+    # Pool.imap pickles what it calls.  A module level function pickles by
+    # name where a lambda or closure would not, so wrap it instead
+
+    def __init__(self, simulate):
+        self.simulate = simulate
+
+    def __call__(self, point):
+        return self.simulate(**point)
+
+
+def results(simulate, points, processes=None, chunksize=None):
+    """Yield simulate(**point) for every point, in point order, as the
+    workers finish them.
+
+    processes defaults to the number of cores; 1 runs in this process,
+    which is easier to debug.
+    """
+    work = _Simulation(simulate)
+    if processes == 1:
+        for point in points:
+            yield work(point)
+        return
+    pool = multiprocessing.Pool(processes)
+    if chunksize is None:
+        # A few chunks per worker keeps them all busy to the end without
+        # paying a round trip per point
+        workers = processes or multiprocessing.cpu_count()
+        chunksize = max(1, len(points) // (workers * 4))
+    try:
+        for result in pool.imap(work, points, chunksize):
+            yield result
+    except BaseException:
+        # KeyboardInterrupt, or the caller stopped early
+        pool.terminate()
+        raise
+    pool.close()
+    pool.join()
+
+
+def run(simulate, points, processes=None, progress=None):
+    """Run simulate for every point; returns rows of point and outcomes,
+    in point order.
+
+    progress(done, total) is called as rows come in.
+    """
+    total = len(points)
+    rows = []
+    for point, outcomes in zip(points, results(simulate, points, processes)):
+        row = dict(point)
+        row.update(outcomes)
+        rows.append(row)
+        if progress is not None:
+            progress(len(rows), total)
+    return rows
+
+
+def fields_of(rows):
+    """Column names of rows, sorted within each row's new ones."""
+    fields = []
+    for row in rows:
+        for name in sorted(row):
+            if name not in fields:
+                fields.append(name)
+    return fields
+
+
+class TableWriter(object):
+    """Appends rows, sequences in fields order, to a CSV file or to a
+    Parquet file for a .parquet path (needs pyarrow), a batch at a time."""
+
+    def __init__(self, path, fields):
+        self.path = path
+        self.fields = fields
+        self.rows = 0
+        if path.endswith('.parquet'):
+            import pyarrow.parquet
+            self.file = None
+            self.parquet = None
+        else:
+            self.file = open(path, 'w')
+            self.csv = csv.writer(self.file)
+            self.csv.writerow(fields)
+
+    def write(self, rows):
+        if not rows:
+            return
+        self.rows += len(rows)
+        if self.file is not None:
+            self.csv.writerows(rows)
+            return
+        import pyarrow
+        import pyarrow.parquet
+        columns = [pyarrow.array(list(column)) for column in zip(*rows)]
+        table = pyarrow.Table.from_arrays(columns, names=self.fields)
+        if self.parquet is None:
+            self.parquet = pyarrow.parquet.ParquetWriter(self.path, table.schema)
+        self.parquet.write_table(table)
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+        elif self.parquet is not None:
+            self.parquet.close()
+
+
+def write_table(path, rows, fields=None):
+    """Write the fields of rows (dicts) as CSV, or as Parquet for a
+    .parquet path (needs pyarrow)."""
+    fields = fields or fields_of(rows)
+    writer = TableWriter(path, fields)
+    writer.write([[row.get(name) for name in fields] for row in rows])
+    writer.close()
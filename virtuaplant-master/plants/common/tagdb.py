@@ -0,0 +1,271 @@
+#!/usr/bin/env python
+# Tag database and Modbus read planner.
+#
+# Every plant declares its PLC tags once (see <plant>_tags.py) and the world,
+# HMIs and attack scripts import the PLC_* constants from there instead of
+# carrying their own copies.
+
+import struct
+
+from pymodbus.exceptions import ConnectionException
+
+# Registers per read request allowed by the Modbus spec
+MAX_READ_COUNT = 125
+
+# Registers spanned by each tag type
+TYPES = {
+    'bool': 1,
+    'uint16': 1,
+    'int16': 1,
+    'uint32': 2,
+    'int32': 2,
+    'float32': 2,
+}
+
+# struct codes; 32-bit values put the high word in the lower address
+FORMATS = {
+    'bool': 'H',
+    'uint16': 'H',
+    'int16': 'h',
+    'uint32': 'I',
+    'int32': 'i',
+    'float32': 'f',
+}
+
+
+def decode_registers(type, registers):
+    """Values of the given type packed in a run of raw registers.
+
+    The whole run is converted with one struct call, however many values
+    it holds.
+    """
+    count = len(registers) // TYPES[type]
+    data = struct.pack('>%dH' % len(registers), *registers)
+    return list(struct.unpack('>%d%s' % (count, FORMATS[type]), data))
+
+
+def encode_registers(type, values):
+    """Raw registers holding values of the given type, the inverse of
+    decode_registers.  Integers wrap to the type's width."""
+    if type != 'float32':
+        mask = (1 << (16 * TYPES[type])) - 1
+        values = [int(value) & mask for value in values]
+        type = 'uint32' if TYPES[type] == 2 else 'uint16'
+    data = struct.pack('>%d%s' % (len(values), FORMATS[type]), *values)
+    return list(struct.unpack('>%dH' % (len(data) // 2), data))
+
+
+class Tag(object):
+    """A named holding register.
+
+    The engineering value is the raw register value times scale.
+    """
+
+    def __init__(self, name, address, type='uint16', scale=1, description=''):
+        if type not in TYPES:
+            raise ValueError("%s: unknown tag type %s" % (name, type))
+        self.name = name
+        self.address = address
+        self.type = type
+        self.scale = scale
+        self.description = description
+
+    @property
+    def size(self):
+        return TYPES[self.type]
+
+    @property
+    def end(self):
+        return self.address + self.size
+
+    def decode(self, regs):
+        """Engineering value from an {address: raw value} mapping."""
+        raw = decode_registers(self.type, [regs[addr] for addr in range(self.address, self.end)])[0]
+        return raw * self.scale
+
+    def encode(self, value):
+        """Raw register values for an engineering value."""
+        raw = value / float(self.scale)
+        if self.type != 'float32':
+            raw = int(round(raw))
+        return encode_registers(self.type, [raw])
+
+    def read(self, slave):
+        """Engineering value from a slave context's holding registers."""
+        values = slave.getValues(3, self.address, count=self.size)
+        return self.decode(dict(zip(range(self.address, self.end), values)))
+
+    def write(self, slave, value):
+        slave.setValues(3, self.address, self.encode(value))
+
+    def __repr__(self):
+        return "Tag(%s, 0x%02x, %s)" % (self.name, self.address, self.type)
+
+
+class TagDatabase(object):
+
+    def __init__(self, tags):
+        self.tags = list(tags)
+        self.by_name = {}
+        self.by_address = {}
+        for tag in self.tags:
+            if tag.name in self.by_name:
+                raise ValueError("duplicate tag %s" % tag.name)
+            for addr in range(tag.address, tag.end):
+                if addr in self.by_address:
+                    raise ValueError("%s overlaps %s at 0x%02x"
+                                     % (tag.name, self.by_address[addr].name, addr))
+                self.by_address[addr] = tag
+            self.by_name[tag.name] = tag
+
+    def __getitem__(self, name):
+        return self.by_name[name]
+
+    def __iter__(self):
+        return iter(self.tags)
+
+    def __len__(self):
+        return len(self.tags)
+
+    def export(self, namespace):
+        """Define a NAME = address constant for every tag in namespace."""
+        for tag in self.tags:
+            namespace[tag.name] = tag.address
+
+    def lookup(self, key):
+        if isinstance(key, Tag):
+            return key
+        if isinstance(key, str):
+            return self.by_name[key]
+        return self.by_address[key]
+
+    def decode(self, regs, keys=None):
+        """Engineering values of many tags, {address: value}.
+
+        regs maps addresses to raw values (ReadPlan.read's result); keys
+        default to every tag.  Tags of one type are converted together.
+        """
+        wanted = self.tags if keys is None else [self.lookup(key) for key in keys]
+        by_type = {}
+        for tag in wanted:
+            by_type.setdefault(tag.type, []).append(tag)
+        values = {}
+        for type, group in by_type.items():
+            raw = [regs[addr] for tag in group for addr in range(tag.address, tag.end)]
+            for tag, value in zip(group, decode_registers(type, raw)):
+                values[tag.address] = value * tag.scale
+        return values
+
+    def encode(self, values):
+        """Raw registers, {address: raw value}, for {key: engineering value}."""
+        by_type = {}
+        for key, value in values.items():
+            tag = self.lookup(key)
+            by_type.setdefault(tag.type, []).append((tag, value / float(tag.scale)))
+        regs = {}
+        for type, group in by_type.items():
+            raw = [value for tag, value in group]
+            if type != 'float32':
+                raw = [int(round(value)) for value in raw]
+            words = encode_registers(type, raw)
+            for i, (tag, value) in enumerate(group):
+                for j in range(tag.size):
+                    regs[tag.address + j] = words[i * tag.size + j]
+        return regs
+
+    def read(self, slave, keys=None):
+        """Engineering values, {address: value}, from a slave context."""
+        wanted = self.tags if keys is None else [self.lookup(key) for key in keys]
+        first = min(tag.address for tag in wanted)
+        end = max(tag.end for tag in wanted)
+        values = slave.getValues(3, first, count=end - first)
+        return self.decode(dict(zip(range(first, end), values)), wanted)
+
+    def write(self, slave, values):
+        """Write {key: engineering value}, one setValues per run of
+        adjacent registers."""
+        regs = self.encode(values)
+        addrs = sorted(regs)
+        start = 0
+        for i in range(1, len(addrs) + 1):
+            if i == len(addrs) or addrs[i] != addrs[i - 1] + 1:
+                run = addrs[start:i]
+                slave.setValues(3, run[0], [regs[addr] for addr in run])
+                start = i
+
+    def plan_reads(self, keys=None, max_gap=MAX_READ_COUNT, max_count=MAX_READ_COUNT):
+        """Plan the fewest block reads covering the given tags.
+
+        keys are tags, tag names or addresses (default: every tag).  Tags
+        further apart than max_gap registers always go into separate
+        requests; otherwise a request keeps growing until it would exceed
+        max_count registers.  Taking each tag in address order and closing
+        the request only when the next one no longer fits is optimal for
+        the number of requests.
+        """
+        if keys is None:
+            wanted = list(self.tags)
+        else:
+            wanted = [self.lookup(key) for key in keys]
+        wanted = sorted(set(wanted), key=lambda t: t.address)
+
+        requests = []
+        current = None
+        for tag in wanted:
+            if tag.size > max_count:
+                raise ValueError("%s does not fit in one read" % tag.name)
+            if current is not None:
+                gap = tag.address - current.end
+                if gap <= max_gap and max(tag.end, current.end) - current.address <= max_count:
+                    current.add(tag)
+                    continue
+            current = ReadRequest(tag)
+            requests.append(current)
+        return ReadPlan(requests)
+
+
+class ReadRequest(object):
+    """One read_holding_registers call covering a run of tags."""
+
+    def __init__(self, tag):
+        self.address = tag.address
+        self.end = tag.end
+        self.tags = [tag]
+
+    @property
+    def count(self):
+        return self.end - self.address
+
+    def add(self, tag):
+        self.end = max(self.end, tag.end)
+        self.tags.append(tag)
+
+    def __repr__(self):
+        return "ReadRequest(0x%02x, %d)" % (self.address, self.count)
+
+
+class ReadPlan(object):
+
+    def __init__(self, requests):
+        self.requests = requests
+
+    def __len__(self):
+        return len(self.requests)
+
+    def __iter__(self):
+        return iter(self.requests)
+
+    def read(self, client):
+        """Execute the plan, returning {address: raw value}.
+
+        Raises ConnectionException when the PLC does not answer a request.
+        """
+        regs = {}
+        for request in self.requests:
+            rr = client.read_holding_registers(request.address, request.count)
+            values = getattr(rr, 'registers', None)
+            if not values or len(values) < request.count:
+                raise ConnectionException("no response reading 0x%02x" % request.address)
+            for i, value in enumerate(values):
+                regs[request.address + i] = value
+        return regs
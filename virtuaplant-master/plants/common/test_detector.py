@@ -0,0 +1,119 @@
+#!/usr/bin/env python
+# Tests for the write-rate detector:
+#
+#   python test_detector.py        (or pytest)
+
+from __future__ import division
+
+import os
+import sys
+import timeit
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import detector
+from detector import MAX_KEYS, WriteRateDetector
+
+
+class _Slave(object):
+
+    def __init__(self):
+        self.written = []
+
+    def setValues(self, fx, address, values):
+        self.written.append((fx, address, values))
+
+
+class _Write(object):
+    # A write single register request
+    function_code = 0x06
+
+    def __init__(self, address, value):
+        self.address = address
+        self.value = value
+
+
+class _Clock(object):
+
+    def __init__(self, now):
+        self.now = now
+
+    def time(self):
+        return self.now
+
+
+class WriteRateDetectorTest(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = _Clock(1000.0)
+        self.real_time = detector.time
+        detector.time = self.clock
+        self.slave = _Slave()
+        self.detector = WriteRateDetector(self.slave)
+
+    def tearDown(self):
+        detector.time = self.real_time
+
+    def _key(self, key, client='10.0.0.1'):
+        # Spread over clients as well, as the registers are 16-bit
+        return ('%s:%d' % (client, key >> 16), 'register', key & 0xFFFF)
+
+    def _write(self, key, value=1, client='10.0.0.1'):
+        host, table, address = self._key(key, client)
+        self.detector.check(host, _Write(address, value))
+
+    def _cost(self, first, count):
+        start = timeit.default_timer()
+        for key in range(first, first + count):
+            self._write(key)
+        return (timeit.default_timer() - start) / count
+
+    def test_rate_alarm(self):
+        for i in range(detector.MAX_RATE + 1):
+            self._write(5, value=i)
+        self.assertEqual(self.detector.alarms, 1)
+        self.assertEqual(self.slave.written[-1][1:], (detector.DIAG_ALARMS,
+                                                      [1, detector.RATE, 5, detector.MAX_RATE + 1,
+                                                       0, 1000]))
+
+    def test_repeat_alarm(self):
+        for i in range(detector.MAX_REPEATS + 2):
+            self._write(5, value=7)
+        self.assertEqual(self.detector.alarms, 1)
+        self.assertEqual(self.slave.written[-1][2][1], detector.REPEAT)
+
+    def test_repeats_count_per_client(self):
+        # Another client writing in between does not break the repeats
+        for i in range(detector.MAX_REPEATS + 2):
+            self._write(5, value=7)
+            self._write(5, value=i, client='10.0.0.2')
+        self.assertEqual(self.detector.alarms, 1)
+
+    def test_keys_bounded_within_a_second(self):
+        for key in range(3 * MAX_KEYS):
+            self._write(key)
+        self.assertEqual(len(self.detector.stats), MAX_KEYS)
+        # The oldest went first
+        self.assertNotIn(self._key(0), self.detector.stats)
+        self.assertIn(self._key(2 * MAX_KEYS), self.detector.stats)
+        self.assertIn(self._key(3 * MAX_KEYS - 1), self.detector.stats)
+
+    def test_new_second_moves_key_back(self):
+        for key in range(MAX_KEYS):
+            self._write(key)
+        self.clock.now += 1
+        # Written again, so no longer the oldest
+        self._write(0)
+        self._write(MAX_KEYS)
+        self.assertIn(self._key(0), self.detector.stats)
+        self.assertNotIn(self._key(1), self.detector.stats)
+
+    def test_cost_flat_when_full(self):
+        below = self._cost(0, MAX_KEYS - 1000)
+        above = self._cost(MAX_KEYS, 5 * MAX_KEYS)
+        # An O(n) eviction makes this hundreds of times slower
+        self.assertLess(above, below * 5)
+
+
+if __name__ == '__main__':
+    unittest.main()
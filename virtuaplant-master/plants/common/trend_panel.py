@@ -0,0 +1,71 @@
+#!/usr/bin/env python
+# GTK trend chart drawn from a trends.RingBuffer.
+
+from __future__ import division
+
+import time
+
+import gi
+gi.require_version('Gtk', '3.0')
+from gi.repository import Gtk
+
+from trends import TREND_SPAN
+
+
+class TrendPanel(Gtk.DrawingArea):
+    """Min/max envelope of the last span seconds of a register."""
+
+    def __init__(self, title, buffer, span=TREND_SPAN, unit='', color=(0.0, 0.4, 0.8)):
+        Gtk.DrawingArea.__init__(self)
+        self.title = title
+        self.buffer = buffer
+        self.span = span
+        self.unit = unit
+        self.color = color
+        self.set_size_request(480, 120)
+        self.connect("draw", self.on_draw)
+
+    def on_draw(self, widget, cr):
+        width = self.get_allocated_width()
+        height = self.get_allocated_height()
+        top, bottom = 18, height - 4
+
+        cr.set_source_rgb(1, 1, 1)
+        cr.paint()
+        cr.set_source_rgb(0.6, 0.6, 0.6)
+        cr.rectangle(0.5, top + 0.5, width - 1, bottom - top)
+        cr.stroke()
+
+        now = time.time()
+        columns = self.buffer.decimate(width, since=now - self.span)
+
+        last = self.buffer.last()
+        caption = self.title
+        if last is not None:
+            caption = "%s: %g %s" % (self.title, last[1], self.unit)
+        cr.set_source_rgb(0, 0, 0)
+        cr.move_to(2, 13)
+        cr.show_text(caption.strip())
+
+        if not columns:
+            return False
+
+        low = min(c[1] for c in columns)
+        high = max(c[2] for c in columns)
+        if high == low:
+            high, low = high + 1, low - 1
+        scale = (bottom - top - 4) / (high - low)
+
+        cr.move_to(width - 60, 13)
+        cr.show_text("%g..%g" % (low, high))
+
+        # One vertical stroke per column covering its min..max; x comes from
+        # the sample time so the chart fills up from the right
+        cr.set_source_rgb(*self.color)
+        cr.set_line_width(1)
+        for t, lo, hi in columns:
+            x = width - (now - t) / self.span * width + 0.5
+            cr.move_to(x, bottom - 2 - (lo - low) * scale + 0.5)
+            cr.line_to(x, bottom - 2 - (hi - low) * scale - 0.5)
+        cr.stroke()
+        return False
@@ -0,0 +1,143 @@
+#!/usr/bin/env python
+# Bounded register history for the HMI trend panels.
+#
+# Every trended register gets a RingBuffer sized for the whole window up
+# front (an hour at 10 Hz is 36000 samples, ~560 KB for time and value), so
+# memory stays flat no matter how long an HMI runs.  Drawing never walks the
+# raw samples: decimate() folds them into one min/max pair per pixel column,
+# which keeps spikes visible and redraw cost proportional to the panel width.
+
+from __future__ import division
+
+import bisect
+import logging
+import threading
+import time
+from array import array
+
+from pymodbus.exceptions import ConnectionException
+
+log = logging.getLogger(__name__)
+
+# Samples per second and seconds of history kept per register
+TREND_RATE = 10.0
+TREND_SPAN = 3600
+
+
+class RingBuffer(object):
+    """Fixed-size series of (time, value) samples, oldest overwritten first."""
+
+    def __init__(self, capacity):
+        self.capacity = int(capacity)
+        self.times = array('d', [0.0]) * self.capacity
+        self.values = array('d', [0.0]) * self.capacity
+        self.head = 0 # next slot to write
+        self.size = 0
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return self.size
+
+    def append(self, t, value):
+        with self.lock:
+            self.times[self.head] = t
+            self.values[self.head] = value
+            self.head = (self.head + 1) % self.capacity
+            if self.size < self.capacity:
+                self.size += 1
+
+    def last(self):
+        if not self.size:
+            return None
+        i = (self.head - 1) % self.capacity
+        return self.times[i], self.values[i]
+
+    def samples(self, since=None):
+        """Chronological copies of the times and values, from since on."""
+        with self.lock:
+            if self.size < self.capacity:
+                times = self.times[:self.size]
+                values = self.values[:self.size]
+            else:
+                times = self.times[self.head:] + self.times[:self.head]
+                values = self.values[self.head:] + self.values[:self.head]
+        if since is not None:
+            start = bisect.bisect_left(times, since)
+            times, values = times[start:], values[start:]
+        return times, values
+
+    def decimate(self, buckets, since=None):
+        """Fold the samples into at most buckets (time, min, max) triples."""
+        times, values = self.samples(since)
+        n = len(values)
+        if n <= buckets:
+            return [(times[i], values[i], values[i]) for i in range(n)]
+
+        step = n / buckets
+        out = []
+        for b in range(int(buckets)):
+            lo, hi = int(b * step), int((b + 1) * step)
+            chunk = values[lo:hi]
+            out.append((times[lo], min(chunk), max(chunk)))
+        return out
+
+
+class TrendRecorder(object):
+    """Samples a set of holding registers into ring buffers.
+
+    Runs on its own thread so sampling at TREND_RATE does not compete with
+    the HMI's 1 Hz status poll.  The registers are fetched with one block
+    read per sample.  Given the plant's tag database, addresses are tags
+    and 32-bit and float tags are decoded; otherwise each address is one
+    raw register.
+    """
+
+    def __init__(self, client, addresses, rate=TREND_RATE, span=TREND_SPAN, tags=None):
+        self.client = client
+        self.addresses = sorted(addresses)
+        self.tags = tags
+        self.rate = rate
+        self.buffers = dict((addr, RingBuffer(rate * span)) for addr in self.addresses)
+        self._running = False
+
+    def start(self):
+        self._running = True
+        thread = threading.Thread(target=self.run, name='trend-recorder')
+        thread.daemon = True
+        thread.start()
+
+    def stop(self):
+        self._running = False
+
+    def run(self):
+        first = self.addresses[0]
+        if self.tags is not None:
+            count = max(self.tags.lookup(addr).end for addr in self.addresses) - first
+        else:
+            count = self.addresses[-1] - first + 1
+        period = 1.0 / self.rate
+        deadline = time.time()
+        while self._running:
+            # Schedule against the original deadline so slow reads do not
+            # make the sample rate drift
+            deadline += period
+            delay = deadline - time.time()
+            if delay > 0:
+                time.sleep(delay)
+            else:
+                deadline = time.time()
+
+            if not self.client.online:
+                continue
+            try:
+                rr = self.client.read_holding_registers(first, count)
+                regs = rr.registers
+            except (ConnectionException, AttributeError):
+                continue
+            now = time.time()
+            if self.tags is not None:
+                values = self.tags.decode(dict(zip(range(first, first + count), regs)), self.addresses)
+            else:
+                values = dict((addr, regs[addr - first]) for addr in self.addresses)
+            for addr in self.addresses:
+                self.buffers[addr].append(now, values[addr])
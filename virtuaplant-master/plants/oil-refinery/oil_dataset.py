@@ -0,0 +1,134 @@
+#!/usr/bin/env python
+# Labeled Modbus transaction dataset from headless oil refinery runs.
+#
+# Every episode runs oil_process.OilProcess for -d simulated seconds with
+# the HMI polling every tag once a second, an operator opening and closing
+# valves now and then and, in a share -a of the episodes, one of the
+# attacks in attacks/ (see common/dataset.py):
+#
+#   ./oil_dataset.py -e 1000 -o oil_dataset.csv
+#   ./oil_dataset.py -e 10000 -a 0.3 -j 8 -o oil_dataset.parquet
+#
+# Ground truth: the storage and separator tank volumes, oil spilled and
+# processed (liters) and whether the separator is overflowing.
+
+from __future__ import division
+
+import logging
+
+# Argument parsing
+import argparse
+
+import os
+import sys
+import time
+
+# Shared VirtuaPlant modules
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'common'))
+import dataset
+
+from oil_tags import *
+from oil_process import OilProcess
+
+# The HMI's update interval, seconds
+MODBUS_SLEEP = 1
+
+log = logging.getLogger()
+
+
+class OilPlant(dataset.Plant):
+
+    name = 'oil-refinery'
+    tags = tags
+    polls = [('hmi', None)]
+    poll_interval = MODBUS_SLEEP
+    operations = [
+        {PLC_FEED_PUMP: 1},
+        {PLC_FEED_PUMP: 0},
+        {PLC_WASTE_VALVE: 1},
+        {PLC_WASTE_VALVE: 0},
+        {PLC_OUTLET_VALVE: 1},
+        {PLC_OUTLET_VALVE: 0},
+    ]
+    truth_fields = ['storage_volume', 'separator_volume', 'oil_spilled', 'oil_processed',
+                    'separator_overflow']
+
+    def __init__(self, **settings):
+        dataset.Plant.__init__(self)
+        self.process = OilProcess(**settings)
+        # The plant running normally, as an operator leaves it
+        tags.write(self.slave, {
+            PLC_FEED_PUMP: 1,
+            PLC_TANK_LEVEL: 1,
+            PLC_OUTLET_VALVE: 1,
+            PLC_SEP_VALVE: 1,
+            PLC_WASTE_VALVE: 0,
+        })
+
+    def _get(self, addr):
+        return tags.lookup(addr).read(self.slave)
+
+    def _set(self, addr, value):
+        tags.lookup(addr).write(self.slave, value)
+
+    def step(self, now):
+        self.process.step(self._get, self._set)
+
+    def truth(self):
+        p = self.process
+        return [p.tank_storage_vol, p.tank_separator_vol, p.oil_spilt, p.oil_processed,
+                int(p.tank_separator_vol > p.tank_separator_vol_overflow)]
+
+
+# Override Argument parser to throw error and generate help message
+# if undefined args are passed
+class MyParser(argparse.ArgumentParser):
+    def error(self, message):
+        sys.stderr.write('error: %s\n' % message)
+        self.print_help()
+        sys.exit(2)
+
+
+def main():
+    parser = MyParser(
+        description = 'This Python script generates a labeled Modbus dataset from headless oil refinery runs',
+        epilog = '',
+        add_help = True)
+    parser.add_argument("-e", action = "store", dest="episodes", type=int, default=100,
+                        help = "Episodes to run (default 100)")
+    parser.add_argument("-d", action = "store", dest="duration", type=int, default=3600,
+                        help = "Simulated seconds per episode (default 3600)")
+    parser.add_argument("-a", action = "store", dest="attack_probability", type=float, default=0.5,
+                        help = "Share of the episodes with an attack (default 0.5)")
+    parser.add_argument("-o", action = "store", dest="output", default="oil_dataset.csv",
+                        help = "Output table, .csv or .parquet (default oil_dataset.csv)")
+    parser.add_argument("-j", action = "store", dest="processes", type=int,
+                        help = "Worker processes (default one per core)")
+    parser.add_argument("--seed", action = "store", dest="seed", type=int, default=0,
+                        help = "Random seed; the same seed gives the same dataset (default 0)")
+    args = parser.parse_args()
+
+    if args.output.endswith('.parquet'):
+        try:
+            import pyarrow
+        except ImportError:
+            parser.error("writing Parquet needs pyarrow")
+
+    logging.basicConfig()
+    log.setLevel(logging.INFO)
+
+    started = time.time()
+
+    def progress(done, records):
+        if done % 10 == 0 or done == args.episodes:
+            log.info("%d/%d episodes, %d records" % (done, args.episodes, records))
+
+    records = dataset.generate(args.output, OilPlant, args.episodes, args.processes, progress,
+                               duration=args.duration, attack_probability=args.attack_probability,
+                               seed=args.seed)
+    elapsed = time.time() - started
+    log.info("Wrote %s: %d records in %.1f s (%.0f records/s, %.1fM an hour)"
+             % (args.output, records, elapsed, records / elapsed, records / elapsed * 3600 / 1e6))
+
+if __name__ == '__main__':
+    sys.exit(main())
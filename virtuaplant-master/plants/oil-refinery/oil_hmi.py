@@ -4,14 +4,23 @@
 import gi
 gi.require_version('Gtk', '3.0')
 from gi.repository import GLib, Gtk, Gdk, GObject
-from pymodbus.client.sync import ModbusTcpClient as ModbusClient
 from pymodbus.exceptions import ConnectionException
 
 import argparse
 import os
+import socket
 import sys
 import time
 
+# Shared VirtuaPlant modules
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'common'))
+from modbus_connection import ConnectionManager, CONNECTING, ONLINE
+from trends import TrendRecorder
+from trend_panel import TrendPanel
+from oil_tags import *
+
+READ_PLAN = tags.plan_reads()
+
 # Argument Parsing
 class MyParser(argparse.ArgumentParser):
     def error(self, message):
@@ -45,7 +54,7 @@ class HMIWindow(Gtk.Window):
     
     def initModbus(self):
         # Create modbus connection to specified address and port
-        self.modbusClient = ModbusClient(args.server_addr, port=5020)
+        self.modbusClient = ConnectionManager(args.server_addr, 5020, on_status=self.connectionChanged)
 
     # Default values for the HMI labels
     def resetLabels(self):
@@ -189,6 +198,16 @@ class HMIWindow(Gtk.Window):
         elementIndex += 1
         
         
+        # Trends of the last hour
+        self.trends = TrendRecorder(self.modbusClient, [PLC_OIL_SPILL, PLC_OIL_PROCESSED], tags=tags)
+        self.trend_panels = [
+            TrendPanel("Oil Processed", self.trends.buffers[PLC_OIL_PROCESSED], unit="Liters", color=(0.0, 0.6, 0.0)),
+            TrendPanel("Oil Spilled", self.trends.buffers[PLC_OIL_SPILL], unit="Liters", color=(0.8, 0.0, 0.0)),
+        ]
+        for panel in self.trend_panels:
+            grid.attach(panel, 4, elementIndex, 4, 1)
+            elementIndex += 1
+
         # Oil Refienery branding
         virtual_refinery = Gtk.Label()
         virtual_refinery.set_markup("<span size='small'>Crude Oil Pretreatment Unit - HMI</span>")
@@ -207,79 +226,88 @@ class HMIWindow(Gtk.Window):
 
         # Set default label values
         self.resetLabels()
+        self.modbusClient.start()
+        self.trends.start()
         GObject.timeout_add_seconds(MODBUS_SLEEP, self.update_status)
 
+    # Called from the connection thread
+    def connectionChanged(self, state, retry_in):
+        GLib.idle_add(self.showConnectionStatus, state, retry_in)
+
+    def showConnectionStatus(self, state, retry_in):
+        if state == ONLINE:
+            self.connection_status_value.set_markup("<span weight='bold' foreground='green'>ONLINE </span>")
+        elif state == CONNECTING:
+            self.connection_status_value.set_markup("<span weight='bold' foreground='orange'>CONNECTING </span>")
+        else:
+            self.resetLabels()
+            self.connection_status_value.set_markup("<span weight='bold' foreground='red'>OFFLINE (retry in %.0fs)</span>" % retry_in)
+        return False
+
     # Control the feed pump register values
     def setPump(self, widget, data=None):
         try:
-            self.modbusClient.write_register(0x01, data)
+            self.modbusClient.write_register(PLC_FEED_PUMP, data)
         except:
             pass
         
     # Control the tank level register values
     def setTankLevel(self, widget, data=None):
         try:
-            self.modbusClient.write_register(0x02, data)
+            self.modbusClient.write_register(PLC_TANK_LEVEL, data)
         except:
             pass
         
     # Control the separator vessel level register values
     def setSepValve(self, widget, data=None):
         try:
-            self.modbusClient.write_register(0x04, data)
+            self.modbusClient.write_register(PLC_SEP_VALVE, data)
         except:
             pass
         
     # Control the separator vessel level register values
     def setWasteValve(self, widget, data=None):
         try:
-            self.modbusClient.write_register(0x08, data)
+            self.modbusClient.write_register(PLC_WASTE_VALVE, data)
         except:
             pass
     
     def setOutletValve(self, widget, data=None):
         try:
-            self.modbusClient.write_register(0x03, data)
+            self.modbusClient.write_register(PLC_OUTLET_VALVE, data)
         except:
             pass
         
     def update_status(self):
 
-        try:
-            # Store the registers of the PLC in "rr"
-            rr = self.modbusClient.read_holding_registers(1,16)
-            regs = []
-
-            # If we get back a blank response, something happened connecting to the PLC
-            if not rr or not rr.registers:
-                raise ConnectionException
-            
-            # Regs is an iterable list of register key:values
-            regs = rr.registers
+        if not self.modbusClient.online:
+            return True
 
-            if not regs or len(regs) < 16:
-                raise ConnectionException
+        try:
+            # Read every plant register, keyed by address
+            regs = READ_PLAN.read(self.modbusClient)
+            values = tags.decode(regs, [PLC_OIL_SPILL, PLC_OIL_PROCESSED])
             
             # If the feed pump "0x01" is set to 1, then the pump is running
-            if regs[0] == 1:
+            if regs[PLC_FEED_PUMP] == 1:
                 self.feed_pump_value.set_markup("<span weight='bold' foreground='green'>RUNNING</span>")
             else:
                 self.feed_pump_value.set_markup("<span weight='bold' foreground='red'>STOPPED</span>")
                 
             # If the level sensor is ON
-            if regs[1] == 1:
+            if regs[PLC_TANK_LEVEL] == 1:
                 self.level_switch_value.set_markup("<span weight='bold' foreground='green'>ON</span>")
             else:
                 self.level_switch_value.set_markup("<span weight='bold' foreground='red'>OFF</span>")
             
             # Outlet Valve status
-            if regs[2] == 1:
+            if regs[PLC_OUTLET_VALVE] == 1:
                 self.outlet_valve_value.set_markup("<span weight='bold' foreground='green'>OPEN</span>")
             else:
                 self.outlet_valve_value.set_markup("<span weight='bold' foreground='red'>CLOSED</span>")
                 
             # If the feed pump "0x04" is set to 1, separator valve is open
-            if regs[3] == 1:
+            if regs[PLC_SEP_VALVE] == 1:
                 self.separator_value.set_markup("<span weight='bold' foreground='green'>OPEN</span>")
                 self.process_status_value.set_markup("<span weight='bold' foreground='green'>RUNNING </span>")
             else:
@@ -287,25 +315,28 @@ class HMIWindow(Gtk.Window):
                 self.process_status_value.set_markup("<span weight='bold' foreground='red'>STOPPED </span>")
                 
             # Waste Valve status "0x08"
-            if regs[7] == 1:
+            if regs[PLC_WASTE_VALVE] == 1:
                 self.waste_value.set_markup("<span weight='bold' foreground='green'>OPEN</span>")
             else:
                 self.waste_value.set_markup("<span weight='bold' foreground='red'>CLOSED</span>")
                 
             # If the oil spilled tag gets set, increase the amount of oil we have spilled
-            if regs[5]:
-                self.oil_spilled_value.set_markup("<span weight='bold' foreground='red'>" + str(regs[5]) + " Liters</span>")
+            if values[PLC_OIL_SPILL]:
+                self.oil_spilled_value.set_markup("<span weight='bold' foreground='red'>" + str(values[PLC_OIL_SPILL]) + " Liters</span>")
                             # If the oil spilled tag gets set, increase the amount of oil we have spilled
-            if regs[6]:
-                self.oil_processed_value.set_markup("<span weight='bold' foreground='green'>" + str(regs[6] + regs[8]) + " Liters</span>")
+            if values[PLC_OIL_PROCESSED]:
+                self.oil_processed_value.set_markup("<span weight='bold' foreground='green'>" + str(values[PLC_OIL_PROCESSED]) + " Liters</span>")
+
+            for panel in self.trend_panels:
+                panel.queue_draw()
 
             # If we successfully connect, then show that the HMI has contacted the PLC
             self.connection_status_value.set_markup("<span weight='bold' foreground='green'>ONLINE </span>")
 
 
-        except ConnectionException:
-            if not self.modbusClient.connect():
-                self.resetLabels()
+        except (ConnectionException, socket.error):
+            self.modbusClient.lost()
+            self.resetLabels()
         except:
             raise
         finally:
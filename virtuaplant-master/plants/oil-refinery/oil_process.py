@@ -0,0 +1,100 @@
+#!/usr/bin/env python
+# Tank level model of the oil refinery, without display or GPIO.
+#
+# This is the once a second process that oil_world_noGPIO.py runs for the
+# Raspberry Pi build: crude oil is pumped into the storage tank, flows to
+# the separator through the outlet valve and leaves it as processed oil or
+# waste water; whatever overflows either tank is spilled.  The world and
+# headless runs (oil_sweep.py) share it, and every flow rate is a keyword
+# argument so runs can vary them.
+
+from oil_tags import *
+
+
+class OilProcess(object):
+    """Storage tank and separator volumes, stepped once a second.
+
+    step() reads the valves through get_tag(addr) and writes the sensors
+    and totals through set_tag(addr, value), the world's helpers.
+    """
+
+    def __init__(self,
+                 tank_storage_vol=500,
+                 tank_storage_sensor_vol=5500,
+                 tank_storage_max_vol=6000,
+                 tank_separator_vol=4000,
+                 tank_separator_vol_overflow=4550,
+                 tank_separator_sensor_vol=5000,
+                 oil_flow_rate_in=50,
+                 oil_flow_processed=20,
+                 oil_flow_rate_sto_to_sep=40,
+                 oil_flow_rate_overflow=40,
+                 water_flow_rate_waste=20):
+        self.tank_storage_vol = tank_storage_vol
+        self.tank_storage_sensor_vol = tank_storage_sensor_vol
+        self.tank_storage_max_vol = tank_storage_max_vol
+        self.tank_separator_vol = tank_separator_vol
+        self.tank_separator_vol_overflow = tank_separator_vol_overflow
+        self.tank_separator_sensor_vol = tank_separator_sensor_vol
+        self.oil_flow_rate_in = oil_flow_rate_in
+        self.oil_flow_processed = oil_flow_processed
+        self.oil_flow_rate_sto_to_sep = oil_flow_rate_sto_to_sep
+        self.oil_flow_rate_overflow = oil_flow_rate_overflow
+        self.water_flow_rate_waste = water_flow_rate_waste
+        self.oil_processed = 0
+        self.oil_spilt = 0
+
+    def step(self, get_tag, set_tag):
+        """Advance one second; returns the error messages for the display."""
+        errors = []
+
+        if get_tag(PLC_FEED_PUMP) == 1:
+            self.tank_storage_vol += self.oil_flow_rate_in
+
+        if get_tag(PLC_OUTLET_VALVE) == 1 and self.tank_storage_vol > 0:
+            if self.oil_flow_rate_sto_to_sep > self.tank_storage_vol:
+                self.tank_separator_vol += self.tank_storage_vol
+                self.tank_storage_vol = 0
+            else:
+                self.tank_separator_vol += self.oil_flow_rate_sto_to_sep
+                self.tank_storage_vol -= self.oil_flow_rate_sto_to_sep
+
+        if self.tank_storage_vol > self.tank_storage_sensor_vol and get_tag(PLC_TANK_LEVEL) == 1:
+            set_tag(PLC_FEED_PUMP, 0)
+            errors.append("Storage safety level reached pump off")
+
+        if self.tank_storage_vol > self.tank_storage_max_vol:
+            self.oil_spilt += self.tank_storage_vol - self.tank_storage_max_vol
+            self.tank_storage_vol = self.tank_storage_max_vol
+            errors.append("Storage tank overflow!")
+
+        if self.tank_separator_vol > self.tank_separator_vol_overflow:
+            set_tag(PLC_OIL_UPPER, 1)
+            self.tank_separator_vol -= self.oil_flow_rate_overflow
+            self.oil_spilt += self.oil_flow_rate_overflow
+            errors.append("Seperator tank safety level reached")
+        else:
+            set_tag(PLC_OIL_UPPER, 0)
+
+        if self.tank_separator_vol > 0 and get_tag(PLC_SEP_VALVE) == 1:
+            if self.oil_flow_processed > self.tank_separator_vol:
+                self.oil_processed += self.tank_separator_vol
+                self.tank_separator_vol = 0
+            else:
+                self.tank_separator_vol -= self.oil_flow_processed
+                self.oil_processed += self.oil_flow_processed
+
+        if get_tag(PLC_WASTE_VALVE) == 1 and self.tank_separator_vol > 0:
+            self.oil_spilt += self.water_flow_rate_waste
+            self.tank_separator_vol -= self.water_flow_rate_waste
+
+        # Update Modbus Registars
+        set_tag(PLC_OIL_SPILL, self.oil_spilt)
+        set_tag(PLC_OIL_PROCESSED, self.oil_processed)
+        return errors
+
+    def storage_fraction(self):
+        return self.tank_storage_vol / float(self.tank_storage_max_vol)
+
+    def separator_fraction(self):
+        return self.tank_separator_vol / float(self.tank_separator_sensor_vol)
@@ -0,0 +1,131 @@
+#!/usr/bin/env python
+# Parameter sweep over headless oil refinery runs.
+#
+# Every point steps oil_process.OilProcess, the tank model of
+# oil_world_noGPIO.py, for -d simulated seconds with the operator's valve
+# settings written at the start (or on every step with hold=1, as the
+# constant_running attack does), and records what came of it:
+#
+#   ./oil_sweep.py -a oil_flow_rate_in=30:70:10 -a oil_flow_processed=10,20,40 -o sweep.csv
+#   ./oil_sweep.py -a waste_valve=0,1 -a hold=0,1 -a tank_level=0,1 -j 4
+#
+# Parameters: the flow rates and tank volumes OilProcess takes, plus the
+# set points feed_pump, tank_level, outlet_valve, sep_valve, waste_valve
+# (0/1) and hold.  Outcomes: oil_spilled and oil_processed (liters),
+# pump_trips (times the level switch stopped the feed pump) and
+# separator_overflow_seconds.
+
+from __future__ import division
+
+import logging
+
+# Argument parsing
+import argparse
+
+import os
+import sys
+import time
+
+# Shared VirtuaPlant modules
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'common'))
+import sweep
+
+from oil_tags import *
+from oil_process import OilProcess
+
+SET_POINTS = ['feed_pump', 'tank_level', 'outlet_valve', 'sep_valve', 'waste_valve', 'hold']
+PROCESS = sorted(sweep.defaults(OilProcess.__init__))
+PARAMETERS = SET_POINTS + PROCESS
+OUTCOMES = ['oil_spilled', 'oil_processed', 'pump_trips', 'separator_overflow_seconds']
+
+log = logging.getLogger()
+
+
+def simulate(feed_pump=1, tank_level=1, outlet_valve=1, sep_valve=1, waste_valve=0, hold=0,
+             duration=3600, **settings):
+    """Run the tanks for duration seconds; settings go to OilProcess."""
+    process = OilProcess(**settings)
+    set_points = {
+        PLC_FEED_PUMP: feed_pump,
+        PLC_TANK_LEVEL: tank_level,
+        PLC_OUTLET_VALVE: outlet_valve,
+        PLC_SEP_VALVE: sep_valve,
+        PLC_WASTE_VALVE: waste_valve,
+    }
+    registers = dict((tag.address, 0) for tag in tags)
+    registers.update(set_points)
+
+    trips = 0
+    overflow = 0
+    for second in range(int(duration)):
+        if hold:
+            registers.update(set_points)
+        pumping = registers[PLC_FEED_PUMP]
+        process.step(registers.get, registers.__setitem__)
+        if pumping and not registers[PLC_FEED_PUMP]:
+            trips += 1
+        overflow += registers[PLC_OIL_UPPER]
+
+    return {
+        'oil_spilled': process.oil_spilt,
+        'oil_processed': process.oil_processed,
+        'pump_trips': trips,
+        'separator_overflow_seconds': overflow,
+    }
+
+
+# Override Argument parser to throw error and generate help message
+# if undefined args are passed
+class MyParser(argparse.ArgumentParser):
+    def error(self, message):
+        sys.stderr.write('error: %s\n' % message)
+        self.print_help()
+        sys.exit(2)
+
+
+def main():
+    parser = MyParser(
+        description = 'This Python script sweeps oil refinery parameters over headless runs',
+        epilog = 'Parameters: %s' % ', '.join(PARAMETERS),
+        add_help = True)
+    parser.add_argument("-a", action = "append", dest="axes", default=[],
+                        help = "Axis as name=first:last[:step] or name=v1,v2,... (repeatable, default oil_flow_rate_in=10:100:10)")
+    parser.add_argument("-o", action = "store", dest="output", default="oil_sweep.csv",
+                        help = "Output table, .csv or .parquet (default oil_sweep.csv)")
+    parser.add_argument("-j", action = "store", dest="processes", type=int,
+                        help = "Worker processes (default one per core)")
+    parser.add_argument("-d", action = "store", dest="duration", type=int, default=3600,
+                        help = "Simulated seconds per run (default 3600)")
+    args = parser.parse_args()
+
+    try:
+        axes = [sweep.parse_axis(text) for text in args.axes or ['oil_flow_rate_in=10:100:10']]
+    except ValueError as ex:
+        parser.error(str(ex))
+    for name, values in axes:
+        if name not in PARAMETERS:
+            parser.error("unknown parameter %s" % name)
+    if args.output.endswith('.parquet'):
+        try:
+            import pyarrow
+        except ImportError:
+            parser.error("writing Parquet needs pyarrow")
+
+    logging.basicConfig()
+    log.setLevel(logging.INFO)
+
+    # Parameters not swept keep their defaults, and show them in the table
+    fixed = sweep.defaults(OilProcess.__init__)
+    fixed.update(sweep.defaults(simulate))
+    fixed.update(duration=args.duration)
+    points = sweep.grid(axes, fixed)
+    log.info("Sweeping %d points" % len(points))
+    started = time.time()
+    rows = sweep.run(simulate, points, processes=args.processes)
+    elapsed = time.time() - started
+    sweep.write_table(args.output, rows, PARAMETERS + OUTCOMES)
+    log.info("Wrote %s: %d runs in %.1f s (%.2f runs/s)"
+             % (args.output, len(rows), elapsed, len(rows) / elapsed))
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,22 @@
+#!/usr/bin/env python
+# Oil refinery PLC tags, shared by the worlds, HMIs and attack scripts.
+# `from oil_tags import *` defines the PLC_* register constants.
+
+import os
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'common'))
+from tagdb import Tag, TagDatabase
+
+tags = TagDatabase([
+    Tag('PLC_FEED_PUMP', 0x01, 'bool', description="Crude oil tank feed pump running"),
+    Tag('PLC_TANK_LEVEL', 0x02, 'bool', description="Crude oil tank level switch"),
+    Tag('PLC_OUTLET_VALVE', 0x03, 'bool', description="Tank outlet valve open"),
+    Tag('PLC_SEP_VALVE', 0x04, 'bool', description="Separator vessel valve open"),
+    Tag('PLC_OIL_SPILL', 0x06, 'uint32', description="Oil spilled, liters"),
+    Tag('PLC_WASTE_VALVE', 0x08, 'bool', description="Waste water valve open"),
+    Tag('PLC_OIL_UPPER', 0x09, 'bool', description="Separator above its safety level"),
+    Tag('PLC_OIL_PROCESSED', 0x0a, 'uint32', description="Oil processed, liters"),
+])
+
+tags.export(globals())
@@ -0,0 +1,79 @@
+#!/usr/bin/env python
+
+import argparse
+import logging
+import os
+import sys
+
+# Shared VirtuaPlant modules
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'common'))
+from web_hmi_server import Control, Point, WebHMI, run
+from oil_tags import *
+
+logging.basicConfig()
+log = logging.getLogger()
+log.setLevel(logging.INFO)
+
+MODBUS_SERVER_PORT = 5020
+HTTP_PORT = 8081
+
+OPEN_CLOSED = {1: ('OPEN', 'green'), 0: ('CLOSED', 'red')}
+
+points = [
+    Point('feed_pump', "Crude Oil Tank Feed Pump", PLC_FEED_PUMP,
+          {1: ('RUNNING', 'green'), 0: ('STOPPED', 'red')}),
+    Point('level_switch', "Crude Oil Tank Level Switch", PLC_TANK_LEVEL,
+          {1: ('ON', 'green'), 0: ('OFF', 'red')}),
+    Point('outlet_valve', "Outlet Valve", PLC_OUTLET_VALVE, OPEN_CLOSED),
+    Point('separator', "Separator Vessel Valve", PLC_SEP_VALVE, OPEN_CLOSED),
+    Point('waste', "Waste Water Valve", PLC_WASTE_VALVE, OPEN_CLOSED),
+    Point('process', "Process Status", PLC_SEP_VALVE,
+          {1: ('RUNNING', 'green'), 0: ('STOPPED', 'red')}),
+    Point('oil_processed', "Oil Processed Status", PLC_OIL_PROCESSED, unit="Liters"),
+    Point('oil_spilled', "Oil Spilled Status", PLC_OIL_SPILL, unit="Liters"),
+]
+
+controls = [
+    Control("Crude Oil Tank Feed Pump", PLC_FEED_PUMP, [("START", 1), ("STOP", 0)]),
+    Control("Crude Oil Tank Level Switch", PLC_TANK_LEVEL, [("ON", 1), ("OFF", 0)]),
+    Control("Outlet Valve", PLC_OUTLET_VALVE, [("OPEN", 1), ("CLOSE", 0)]),
+    Control("Separator Vessel Valve", PLC_SEP_VALVE, [("OPEN", 1), ("CLOSED", 0)]),
+    Control("Waste Water Valve", PLC_WASTE_VALVE, [("OPEN", 1), ("CLOSED", 0)]),
+]
+
+
+# Override Argument parser to throw error and generate help message
+# if undefined args are passed
+class MyParser(argparse.ArgumentParser):
+    def error(self, message):
+        sys.stderr.write('error: %s\n' % message)
+        self.print_help()
+        sys.exit(2)
+
+# Create argparser object to add command line args and help option
+parser = MyParser(
+    description = 'This Python script serves the SCADA HMI to web browsers',
+    epilog = '',
+    add_help = True)
+
+parser.add_argument("-t", action = "store", dest="server_addr",
+                    help = "Modbus server IP address to connect the HMI to")
+parser.add_argument("-p", action = "store", dest="http_port", type=int, default=HTTP_PORT,
+                    help = "HTTP port to serve the HMI on")
+parser.add_argument("-l", action = "store", dest="listen_addr", default="127.0.0.1",
+                    help = "Address to serve the HMI on")
+
+
+def main():
+    # Print help if no args are supplied
+    if len(sys.argv) == 1:
+        parser.print_help()
+        sys.exit(1)
+
+    args = parser.parse_args()
+    hmi = WebHMI("Crude Oil Pretreatment Unit", args.server_addr, MODBUS_SERVER_PORT,
+                 points, controls, tags=tags)
+    run(hmi, args.http_port, args.listen_addr)
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -9,10 +9,7 @@ import logging
 from twisted.internet import reactor
 
 # - Modbus
-from pymodbus.server.async import StartTcpServer
 from pymodbus.device import ModbusDeviceIdentification
-from pymodbus.datastore import ModbusSequentialDataBlock
-from pymodbus.datastore import ModbusSlaveContext, ModbusServerContext
 from pymodbus.transaction import ModbusRtuFramer, ModbusAsciiFramer
 
 # - World Simulator
@@ -32,6 +29,14 @@ import os
 import sys
 import time
 
+# Shared VirtuaPlant modules
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'common'))
+from events import EventLog
+from frame_timer import FrameTimer
+from metrics import StartMetricsServer, WorldMetrics
+from profiler import SamplingProfiler, StartProfiler, name_thread
+from plant_server import StartPlantServer, create_context
+
 # Override Argument parser to throw error and generate help message
 # if undefined args are passed
 class MyParser(argparse.ArgumentParser):
@@ -47,6 +52,24 @@ parser = MyParser(
 # Add a "-i" argument to receive a filename
 parser.add_argument("-t", action = "store", dest="server_addr",
 					help = "Modbus server IP address to listen on")
+parser.add_argument("--capture", action = "store", dest="capture",
+					help = "Record the Modbus traffic into this capture log")
+parser.add_argument("--client-rate", action = "store", dest="client_rate", type=float,
+					help = "Limit every Modbus client to this many requests a second")
+parser.add_argument("--events", action = "store", dest="events",
+					help = "Log process events (oil spilled, ...) into this file for impact.py")
+parser.add_argument("--frame-overlay", action = "store_true", dest="frame_overlay",
+					help = "Show where each frame's time goes over the world view")
+parser.add_argument("--frame-stats", action = "store", dest="frame_stats",
+					help = "Write frame phase timings as JSON lines into this file ('-' for stdout)")
+parser.add_argument("--metrics", action = "store", dest="metrics", type=int,
+					help = "Serve Prometheus metrics on this local port")
+parser.add_argument("--profile", action = "store", dest="profile",
+					help = "Profile the world on SIGUSR1, writing the results into this directory")
+parser.add_argument("--profile-seconds", action = "store", dest="profile_seconds", type=float, default=10,
+					help = "Seconds a SIGUSR1 profile runs for (default 10)")
+parser.add_argument("--profile-register", action = "store_true", dest="profile_register",
+					help = "Also profile for as many seconds as are written into holding register 98")
 
 # Print help if no args are supplied
 if len(sys.argv)==1:
@@ -60,11 +83,24 @@ logging.basicConfig()
 log = logging.getLogger()
 log.setLevel(logging.INFO)
 
+# Process events for impact.py, if asked for
+events = EventLog(args.events) if args.events else None
+
+def world_event(name, value=''):
+    if events is not None:
+        events.record(name, value)
+
 # Display settings
 SCREEN_WIDTH = 580
 SCREEN_HEIGHT = 460
 FPS = 50.0
 
+# Time spent in each phase of a frame
+frame_timer = FrameTimer(1/FPS, stream=args.frame_stats)
+
+# Frame times, particles, collisions and Modbus traffic for --metrics
+metrics = WorldMetrics(frame_timer)
+
 # Port the world will listen on
 MODBUS_SERVER_PORT = 5020
 
@@ -73,14 +109,7 @@ oil_spilled_amount = 0
 oil_processed_amount = 0
 
 # PLC Register values for various control functions
-PLC_FEED_PUMP = 0x01
-PLC_TANK_LEVEL = 0x02
-PLC_OUTLET_VALVE = 0x03
-PLC_SEP_VALVE = 0x04
-PLC_OIL_SPILL = 0x06
-PLC_OIL_PROCESSED = 0x07
-PLC_WASTE_VALVE = 0x08
-PLC_OIL_UPPER = 0x09
+from oil_tags import *
 
 # Collision types
 tank_level_collision = 0x4
@@ -91,13 +120,17 @@ waste_valve_collision = 0x8
 oil_spill_collision = 0x9
 oil_processed_collision = 0x3
 
-# Helper function to set PLC values
+# Helper function to set PLC values, encoded per tag type
 def PLCSetTag(addr, value):
-    context[0x0].setValues(3, addr, [value])
+    tags.lookup(addr).write(context[0x0], value)
 
 # Helper function that returns PLC values
 def PLCGetTag(addr):
-    return context[0x0].getValues(3, addr, count=1)[0]
+    return tags.lookup(addr).read(context[0x0])
+
+# Tag I/O counts as its own phase, wherever in the frame it happens
+PLCSetTag = frame_timer.timed('tag_io', PLCSetTag)
+PLCGetTag = frame_timer.timed('tag_io', PLCGetTag)
 
 def to_pygame(p):
     """Small hack to convert pymunk to pygame coordinates"""
@@ -296,62 +329,72 @@ def draw_lines(screen, lines):
 
 # Default collision function for objects
 # Returning true makes the two objects collide normally just like "walls/pipes"
+@metrics.counted
 def no_collision(space, arbiter, *args, **kwargs):
     return True 
 
 # Called when level sensor in tank is hit
+@metrics.counted
 def level_reached(space, arbiter, *args, **kwargs):
     log.debug("Level reached")
     PLCSetTag(PLC_TANK_LEVEL, 1) # Level Sensor Hit, Tank full
     PLCSetTag(PLC_FEED_PUMP, 0) # Turn off the pump
+    world_event('level_reached')
     return False
     
+@metrics.counted
 def oil_spilled(space, arbiter, *args, **kwargs):
     global oil_spilled_amount
     log.debug("Oil Spilled")
     oil_spilled_amount = oil_spilled_amount + 1
     PLCSetTag(PLC_OIL_SPILL, oil_spilled_amount) # We lost a unit of oil
     PLCSetTag(PLC_FEED_PUMP, 0) # Attempt to shut off the pump
+    world_event('oil_spilled', oil_spilled_amount)
     return False   
     
+@metrics.counted
 def oil_processed(space, arbiter, *args, **kwargs):
     global oil_processed_amount
     log.debug("Oil Processed")
     oil_processed_amount = oil_processed_amount + 1
-    if oil_processed_amount >= 65000:
-        PLCSetTag(PLC_OIL_PROCESSED, 65000) # We processed a unit of oil
-        PLCSetTag(PLC_OIL_UPPER, oil_processed_amount-65000) # We processed a unit of oil
-    else:
-        PLCSetTag(PLC_OIL_PROCESSED, oil_processed_amount) # We processed a unit of oil
+    PLCSetTag(PLC_OIL_PROCESSED, oil_processed_amount) # We processed a unit of oil
+    world_event('oil_processed', oil_processed_amount)
     return False  
     
 # This is on when separation is on
+@metrics.counted
 def sep_open(space, arbiter, *args, **kwargs):
     log.debug("Begin separation")
     return False
     
 # This fires when the separator is not processing
+@metrics.counted
 def sep_closed(space, arbiter, *args, **kwargs):
     log.debug("Stop separation")
     return True
 
+@metrics.counted
 def outlet_valve_open(space, arbiter, *args, **kwargs):
     log.debug("Outlet valve open")
     return False
     
+@metrics.counted
 def outlet_valve_closed(space, arbiter, *args, **kwargs):
     log.debug("Outlet valve close")
     return True
     
+@metrics.counted
 def waste_valve_open(space, arbiter, *args, **kwargs):
     log.debug("Waste valve open")
     return False
     
+@metrics.counted
 def waste_valve_closed(space, arbiter, *args, **kwargs):
     log.debug("Waste valve close")
     return True
 
 def run_world():
+    name_thread('world')
     pygame.init()
     screen = pygame.display.set_mode((SCREEN_WIDTH, SCREEN_HEIGHT))
     pygame.display.set_caption("Crude Oil Pretreatment Unit")
@@ -389,6 +432,7 @@ def run_world():
 
     balls = []
     ticks_to_next_ball = 1
+    metrics.particles['oil'] = balls
 
     # Set font settings
     fontBig = pygame.font.SysFont(None, 40)
@@ -396,19 +440,23 @@ def run_world():
     fontSmall = pygame.font.SysFont(None, 18)
 
     while running:
+        frame_timer.frame()
         # Advance the game clock
         clock.tick(FPS)
+        frame_timer.mark('wait')
 
         for event in pygame.event.get():
             if event.type == QUIT:
                 running = False
             elif event.type == KEYDOWN and event.key == K_ESCAPE:
                 running = False
+        frame_timer.mark('input')
 
         # Load the background picture for the pipe images
         bg = pygame.image.load("oil_unit.png")
         # Background color
         screen.fill(THECOLORS["grey"])
+        frame_timer.mark('draw')
 
         # If the feed pump is on
         if PLCGetTag(PLC_FEED_PUMP) == 1:
@@ -434,7 +482,7 @@ def run_world():
             space.add_collision_handler(waste_valve_collision, ball_collision, begin=waste_valve_open)
         else:
             space.add_collision_handler(waste_valve_collision, ball_collision, begin=waste_valve_closed)
-            
+        frame_timer.mark('logic')
             
         ticks_to_next_ball -= 1
 
@@ -442,17 +490,21 @@ def run_world():
             ticks_to_next_ball = 1
             ball_shape = add_ball(space)
             balls.append(ball_shape)
+        frame_timer.mark('spawn')
             
+        for ball in balls:
+            draw_ball(bg, ball)
+        frame_timer.mark('draw')
+
         balls_to_remove = []
         for ball in balls:
             if ball.body.position.y < 0 or ball.body.position.x > SCREEN_WIDTH+150:
                 balls_to_remove.append(ball)
 
-            draw_ball(bg, ball)
-
         for ball in balls_to_remove:
             space.remove(ball, ball.body)
             balls.remove(ball)
+        frame_timer.mark('cull')
 
         draw_polygon(bg, pump)
         draw_lines(bg, lines)
@@ -488,20 +540,19 @@ def run_world():
         bg.blit(separator_release, (350, 375))
         bg.blit(waste_sensor, (90, 375))
         screen.blit(bg, (0, 0))
+        if args.frame_overlay:
+            frame_timer.draw(screen, (5, SCREEN_HEIGHT - 150))
+        frame_timer.mark('draw')
 
         space.step(1/FPS) 
+        frame_timer.mark('physics')
         pygame.display.flip()
+        frame_timer.mark('flip')
 
     if reactor.running:
         reactor.callFromThread(reactor.stop)
 
-store = ModbusSlaveContext(
-    di = ModbusSequentialDataBlock(0, [0]*100),
-    co = ModbusSequentialDataBlock(0, [0]*100),
-    hr = ModbusSequentialDataBlock(0, [0]*100),
-    ir = ModbusSequentialDataBlock(0, [0]*100))
-
-context = ModbusServerContext(slaves=store, single=True)
+context = create_context()
 
 # Modbus PLC server information
 identity = ModbusDeviceIdentification()
@@ -513,10 +564,20 @@ identity.ModelName   = 'Simmons ORP 3850'
 identity.MajorMinorRevision = '2.09.01'
 
 def startModbusServer():
+    if args.metrics:
+        StartMetricsServer(metrics, args.metrics)
+    if args.profile:
+        StartProfiler(SamplingProfiler(args.profile), args.profile_seconds,
+                      context if args.profile_register else None)
     # Run a modbus server on specified address and modbus port (5020)
-    StartTcpServer(context, identity=identity, address=(args.server_addr, MODBUS_SERVER_PORT))
+    StartPlantServer(context, identity=identity, address=(args.server_addr, MODBUS_SERVER_PORT),
+                     capture=args.capture, client_rate=args.client_rate, metrics=metrics)
 
 def main():
+    if events is not None:
+        events.start()
+        reactor.addSystemEventTrigger('after', 'shutdown', events.close)
+    reactor.addSystemEventTrigger('after', 'shutdown', frame_timer.close)
     reactor.callInThread(run_world)
     startModbusServer()
 
@@ -13,12 +13,14 @@ import RPi.GPIO as GPIO
 import Adafruit_PCA9685
 
 # - Modbus
-from pymodbus.server.async import StartTcpServer
 from pymodbus.device import ModbusDeviceIdentification
-from pymodbus.datastore import ModbusSequentialDataBlock
-from pymodbus.datastore import ModbusSlaveContext, ModbusServerContext
 from pymodbus.transaction import ModbusRtuFramer, ModbusAsciiFramer
 
+# Shared VirtuaPlant modules
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'common'))
+from events import EventLog
+from plant_server import StartPlantServer, create_context
+
 
 # GPIO Class
 class RasPi:
@@ -119,6 +121,8 @@ class World:
         water_flow_rate_waste = 20
         oil_processed = 0
         oil_spilt = 0
+        oil_processed_noted = 0
+        oil_spilt_noted = 0
 
         # Setup the PI!
         RasPi().setup_gpio()
@@ -139,6 +143,7 @@ class World:
 
             if tank_storage_vol > tank_storage_sensor_vol and plc_get_tag(PLC_TANK_LEVEL) == 1:
                 plc_set_tag(PLC_FEED_PUMP, 0)
+                world_event('level_reached')
                 error += "\nStorage safety level reached pump off"
 
             if tank_storage_vol > tank_storage_max_vol:
@@ -166,6 +171,14 @@ class World:
                 oil_spilt += water_flow_rate_waste
                 tank_separator_vol -= water_flow_rate_waste
 
+            # The registers can be overwritten; the totals here cannot
+            if oil_spilt > oil_spilt_noted:
+                world_event('oil_spilled', oil_spilt)
+            if oil_processed > oil_processed_noted:
+                world_event('oil_processed', oil_processed)
+            oil_spilt_noted = oil_spilt
+            oil_processed_noted = oil_processed
+
             # Update Modbus Registars
             plc_set_tag(PLC_OIL_SPILL, oil_spilt)
             plc_set_tag(PLC_OIL_PROCESSED, oil_processed)
@@ -202,13 +215,7 @@ class World:
 
 
 # Modbus stuff
-store = ModbusSlaveContext(
-    di=ModbusSequentialDataBlock(0, [0] * 100),
-    co=ModbusSequentialDataBlock(0, [0] * 100),
-    hr=ModbusSequentialDataBlock(0, [0] * 100),
-    ir=ModbusSequentialDataBlock(0, [0] * 100))
-
-context = ModbusServerContext(slaves=store, single=True)
+context = create_context()
 
 # Modbus PLC server information
 identity = ModbusDeviceIdentification()
@@ -224,31 +231,25 @@ MODBUS_SERVER_PORT = 5020
 # MODBUS_SERVER_ADDR = "127.0.0.1"
 
 # PLC Register values for various control functions
-PLC_FEED_PUMP = 0x01
-PLC_TANK_LEVEL = 0x02
-PLC_OUTLET_VALVE = 0x03
-PLC_SEP_VALVE = 0x04
-PLC_OIL_SPILL = 0x06
-PLC_OIL_PROCESSED = 0x07
-PLC_WASTE_VALVE = 0x08
-PLC_OIL_UPPER = 0x09
+from oil_tags import *
 
 #PLC_ALARM = 0x05
 
 
-# Helper function to set PLC values
+# Helper function to set PLC values, encoded per tag type
 def plc_set_tag(addr, value):
-    context[0x0].setValues(3, addr, [value])
+    tags.lookup(addr).write(context[0x0], value)
 
 
 # Helper function that returns PLC values
 def plc_get_tag(addr):
-    return context[0x0].getValues(3, addr, count=1)[0]
+    return tags.lookup(addr).read(context[0x0])
 
 
 def start_modbus_server():
     # Run a modbus server on specified address and modbus port (5020)
-    StartTcpServer(context, identity=identity, address=(args.server_addr , MODBUS_SERVER_PORT))
+    StartPlantServer(context, identity=identity, address=(args.server_addr , MODBUS_SERVER_PORT),
+                     capture=args.capture, client_rate=args.client_rate)
 
 
 def main():
@@ -257,7 +258,11 @@ def main():
     try:
         world_thread.daemon = True
         world_thread.start()
+        if events is not None:
+            events.start()
         start_modbus_server()
+        if events is not None:
+            events.close()
 
     except KeyboardInterrupt:
         world_running = False
@@ -284,6 +289,12 @@ parser = MyParser(
 # Add a "-i" argument to receive a filename
 parser.add_argument("-t", action = "store", dest="server_addr",
 					help = "Modbus server IP address to listen on")
+parser.add_argument("--capture", action = "store", dest="capture",
+					help = "Record the Modbus traffic into this capture log")
+parser.add_argument("--client-rate", action = "store", dest="client_rate", type=float,
+					help = "Limit every Modbus client to this many requests a second")
+parser.add_argument("--events", action = "store", dest="events",
+					help = "Log process events (oil spilled, ...) into this file for impact.py")
 
 # Print help if no args are supplied
 if len(sys.argv)==1:
@@ -293,5 +304,12 @@ if len(sys.argv)==1:
 # Split and process arguments into "args"
 args = parser.parse_args()
 
+# Process events for impact.py, if asked for
+events = EventLog(args.events) if args.events else None
+
+def world_event(name, value=''):
+    if events is not None:
+        events.record(name, value)
+
 if __name__ == '__main__':
     sys.exit(main())
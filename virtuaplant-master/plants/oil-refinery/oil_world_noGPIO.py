@@ -8,13 +8,15 @@ import sys
 import threading
 import time
 
-from pymodbus.datastore import (ModbusSequentialDataBlock, ModbusServerContext,
-                                ModbusSlaveContext)
 from pymodbus.device import ModbusDeviceIdentification
-from pymodbus.server.async import StartTcpServer
 from pymodbus.transaction import ModbusAsciiFramer, ModbusRtuFramer
 from termcolor import colored
 
+# Shared VirtuaPlant modules
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'common'))
+from plant_server import StartPlantServer, create_context
+from oil_process import OilProcess
+
 # PWM Module
 import Adafruit_PCA9685
 import RPi.GPIO as GPIO
@@ -108,73 +110,24 @@ class World:
     @staticmethod
     def run_world():
         # Remove Game with Hacky values
-        tank_storage_vol = 500
-        tank_storage_sensor_vol = 5500
-        tank_storage_max_vol = 6000
-        tank_separator_vol = 4000
-        tank_separator_vol_overflow = 4550
-        tank_separator_sensor_vol = 5000
-        oil_flow_rate_in = 50
-        oil_flow_processed = 20
-        oil_flow_rate_sto_to_sep = 40
-        oil_flow_rate_overflow = 40
-        water_flow_rate_waste = 20
-        oil_processed = 0
-        oil_spilt = 0
+        process = OilProcess()
 
         # Setup the PI!
         RasPi().setup_gpio()
 
         while True:
             error = "\nCurrent Errors \n"
+            for message in process.step(plc_get_tag, plc_set_tag):
+                error += "\n" + message
 
-            if plc_get_tag(PLC_FEED_PUMP) == 1:
-                tank_storage_vol += oil_flow_rate_in
-
-            if plc_get_tag(PLC_OUTLET_VALVE) == 1 and tank_storage_vol > 0:
-                if oil_flow_rate_sto_to_sep > tank_storage_vol:
-                    tank_separator_vol += tank_storage_vol
-                    tank_storage_vol = 0
-                else:
-                    tank_separator_vol += oil_flow_rate_sto_to_sep
-                    tank_storage_vol -= oil_flow_rate_sto_to_sep
-
-            if tank_storage_vol > tank_storage_sensor_vol and plc_get_tag(PLC_TANK_LEVEL) == 1:
-                plc_set_tag(PLC_FEED_PUMP, 0)
-                error += "\nStorage safety level reached pump off"
-
-            if tank_storage_vol > tank_storage_max_vol:
-                oil_spilt = tank_storage_vol - tank_storage_max_vol + oil_spilt
-                tank_storage_vol = tank_storage_max_vol
-                error += "\nStorage tank overflow!"
-
-            if tank_separator_vol > tank_separator_vol_overflow:
-                plc_set_tag(PLC_OIL_UPPER, 1)
-                tank_separator_vol -= oil_flow_rate_overflow
-                oil_spilt += oil_flow_rate_overflow
-                error += "\nSeperator tank safety level reached"
-            else:
-                plc_set_tag(PLC_OIL_UPPER, 0)
-
-            if tank_separator_vol > 0 and plc_get_tag(PLC_SEP_VALVE) == 1:
-                if oil_flow_processed > tank_separator_vol:
-                    oil_processed += tank_separator_vol
-                    tank_separator_vol = 0
-                else:
-                    tank_separator_vol -= oil_flow_processed
-                    oil_processed += oil_flow_processed
-
-            if plc_get_tag(PLC_WASTE_VALVE) == 1 and tank_separator_vol > 0:
-                oil_spilt += water_flow_rate_waste
-                tank_separator_vol -= water_flow_rate_waste
-
-            # Update Modbus Registars
-            plc_set_tag(PLC_OIL_SPILL, oil_spilt)
-            plc_set_tag(PLC_OIL_PROCESSED, oil_processed)
+            tank_storage_vol = process.tank_storage_vol
+            tank_separator_vol = process.tank_separator_vol
+            oil_processed = process.oil_processed
+            oil_spilt = process.oil_spilt
 
             # Update decimals
-            tank_storage_decimal = tank_storage_vol / tank_storage_max_vol
-            tank_separator_decimal = tank_separator_vol / tank_separator_sensor_vol
+            tank_storage_decimal = process.storage_fraction()
+            tank_separator_decimal = process.separator_fraction()
 
             # Display on Raspberry Pi
             RasPi().shift_out_values(tank_storage_decimal, tank_separator_decimal)
@@ -207,13 +160,7 @@ class World:
 
 
 # Modbus stuff
-store = ModbusSlaveContext(
-    di=ModbusSequentialDataBlock(0, [0] * 100),
-    co=ModbusSequentialDataBlock(0, [0] * 100),
-    hr=ModbusSequentialDataBlock(0, [0] * 100),
-    ir=ModbusSequentialDataBlock(0, [0] * 100))
-
-context = ModbusServerContext(slaves=store, single=True)
+context = create_context()
 
 # Modbus PLC server information
 identity = ModbusDeviceIdentification()
@@ -229,32 +176,26 @@ MODBUS_SERVER_PORT = 5020
 # MODBUS_SERVER_ADDR = "127.0.0.1"
 
 # PLC Register values for various control functions
-PLC_FEED_PUMP = 0x01
-PLC_TANK_LEVEL = 0x02
-PLC_OUTLET_VALVE = 0x03
-PLC_SEP_VALVE = 0x04
-PLC_OIL_SPILL = 0x06
-PLC_OIL_PROCESSED = 0x07
-PLC_WASTE_VALVE = 0x08
-PLC_OIL_UPPER = 0x09
+from oil_tags import *
 
 #PLC_ALARM = 0x05
 
 
-# Helper function to set PLC values
+# Helper function to set PLC values, encoded per tag type
 def plc_set_tag(addr, value):
-    context[0x0].setValues(3, addr, [value])
+    tags.lookup(addr).write(context[0x0], value)
 
 
 # Helper function that returns PLC values
 def plc_get_tag(addr):
-    return context[0x0].getValues(3, addr, count=1)[0]
+    return tags.lookup(addr).read(context[0x0])
 
 
 def start_modbus_server():
     # Run a modbus server on specified address and modbus port (5020)
-    StartTcpServer(context, identity=identity, address=(
-        args.server_addr, MODBUS_SERVER_PORT))
+    StartPlantServer(context, identity=identity, address=(
+        args.server_addr, MODBUS_SERVER_PORT), capture=args.capture,
+        client_rate=args.client_rate)
 
 
 def main():
@@ -293,6 +234,10 @@ parser = MyParser(
 # Add a "-i" argument to receive a filename
 parser.add_argument("-t", action="store", dest="server_addr",
                     help="Modbus server IP address to listen on")
+parser.add_argument("--capture", action="store", dest="capture",
+                    help="Record the Modbus traffic into this capture log")
+parser.add_argument("--client-rate", action="store", dest="client_rate", type=float,
+                    help="Limit every Modbus client to this many requests a second")
 
 # Print help if no args are supplied
 if len(sys.argv) == 1:
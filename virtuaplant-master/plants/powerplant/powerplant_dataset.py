@@ -0,0 +1,148 @@
+#!/usr/bin/env python
+# Labeled Modbus transaction dataset from headless power plant runs.
+#
+# Every episode runs the seven PLCs' rule tables for -d simulated seconds
+# with each PLC window polling its tags once a second, an operator
+# adjusting the fuel and pump rates now and then and, in a share -a of the
+# episodes, one of the attacks in attacks/ (see common/dataset.py):
+#
+#   ./powerplant_dataset.py -e 1000 -o powerplant_dataset.csv
+#   ./powerplant_dataset.py -e 10000 -a 0.3 -j 8 -o powerplant_dataset.parquet
+#
+# Ground truth: boiler water volume and temperature, turbine pressure,
+# whether it is above pressure_max, the times the relief valve opened and
+# the generator output.
+
+from __future__ import division
+
+import logging
+
+# Argument parsing
+import argparse
+
+import os
+import sys
+import time
+
+# Shared VirtuaPlant modules
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'common'))
+import dataset
+from softplc import ScanEngine
+
+from powerplant_tags import *
+from powerplant_logic import PRESSUREMIN, PRESSUREMAX, CONDENSE_TICKS, programs, write_defaults
+
+# The PLC windows' update interval, seconds
+MODBUS_SLEEP = 1
+
+log = logging.getLogger()
+
+
+class PowerPlant(dataset.Plant):
+
+    name = 'powerplant'
+    tags = tags
+    tick = 0.1
+    # What each PLC window reads (their READ_PLANs)
+    polls = [
+        ('waterpump', [PLC_WATERPUMP_RATE, PLC_WATERPUMP_VALVE]),
+        ('boiler', [PLC_BOILER_TEMP, PLC_BOILER_WATER_VOLUME, PLC_BOILER_WATER_VOLUME_HIGH,
+                    PLC_BOILER_WATER_VOLUME_LOW]),
+        ('condenser', [PLC_CONDENSER_VALVE, PLC_CONDENSER_WATER_VOLUME]),
+        ('fuel', [PLC_FUEL_RATE, PLC_FUEL_VALVE]),
+        ('turbine', [PLC_TURBINE_PRESSURE, PLC_TURBINE_PRESSURE_HIGH, PLC_TURBINE_RPMs]),
+        ('generator', [PLC_GENERATOR_STATUS, PLC_TURBINE_RPMs]),
+        ('pylon', [PLC_GENERATOR_STATUS, PLC_PYLON_STATUS, PLC_TURBINE_RPMs]),
+    ]
+    poll_interval = MODBUS_SLEEP
+    operations = [
+        {PLC_FUEL_RATE: 4},
+        {PLC_FUEL_RATE: 5},
+        {PLC_WATERPUMP_RATE: 4},
+        {PLC_WATERPUMP_RATE: 5},
+    ]
+    truth_fields = ['boiler_water_volume', 'boiler_temp', 'turbine_pressure', 'overpressure',
+                    'pressure_trips', 'generator_output']
+
+    def __init__(self, fuel_rate=5, pump_rate=5, pressure_min=PRESSUREMIN,
+                 pressure_max=PRESSUREMAX, condense_ticks=CONDENSE_TICKS):
+        dataset.Plant.__init__(self)
+        write_defaults(self.slave)
+        tags.write(self.slave, {PLC_FUEL_VALVE: 1, PLC_FUEL_RATE: fuel_rate,
+                                PLC_WATERPUMP_RATE: pump_rate})
+        self.pressure_max = pressure_max
+        self.engine = ScanEngine(self.slave, scan_time=self.tick, report_interval=0, tags=tags)
+        for program in programs(pressure_min=pressure_min, pressure_max=pressure_max,
+                                condense_ticks=condense_ticks):
+            self.engine.add(program)
+        # truth() reads the image, which the first scan would fill
+        self.engine.image.read()
+        self.relieving = 0
+        self.trips = 0
+
+    def step(self, now):
+        self.engine.scan(now)
+        high = self.engine.image[PLC_TURBINE_PRESSURE_HIGH]
+        if high and not self.relieving:
+            self.trips += 1
+        self.relieving = high
+
+    def truth(self):
+        io = self.engine.image
+        pressure = io[PLC_TURBINE_PRESSURE]
+        return [round(io[PLC_BOILER_WATER_VOLUME], 2), io[PLC_BOILER_TEMP], pressure,
+                int(pressure > self.pressure_max), self.trips, io[PLC_GENERATOR_OUTPUT]]
+
+
+# Override Argument parser to throw error and generate help message
+# if undefined args are passed
+class MyParser(argparse.ArgumentParser):
+    def error(self, message):
+        sys.stderr.write('error: %s\n' % message)
+        self.print_help()
+        sys.exit(2)
+
+
+def main():
+    parser = MyParser(
+        description = 'This Python script generates a labeled Modbus dataset from headless power plant runs',
+        epilog = '',
+        add_help = True)
+    parser.add_argument("-e", action = "store", dest="episodes", type=int, default=100,
+                        help = "Episodes to run (default 100)")
+    parser.add_argument("-d", action = "store", dest="duration", type=int, default=3600,
+                        help = "Simulated seconds per episode (default 3600)")
+    parser.add_argument("-a", action = "store", dest="attack_probability", type=float, default=0.5,
+                        help = "Share of the episodes with an attack (default 0.5)")
+    parser.add_argument("-o", action = "store", dest="output", default="powerplant_dataset.csv",
+                        help = "Output table, .csv or .parquet (default powerplant_dataset.csv)")
+    parser.add_argument("-j", action = "store", dest="processes", type=int,
+                        help = "Worker processes (default one per core)")
+    parser.add_argument("--seed", action = "store", dest="seed", type=int, default=0,
+                        help = "Random seed; the same seed gives the same dataset (default 0)")
+    args = parser.parse_args()
+
+    if args.output.endswith('.parquet'):
+        try:
+            import pyarrow
+        except ImportError:
+            parser.error("writing Parquet needs pyarrow")
+
+    logging.basicConfig()
+    log.setLevel(logging.INFO)
+
+    started = time.time()
+
+    def progress(done, records):
+        if done % 10 == 0 or done == args.episodes:
+            log.info("%d/%d episodes, %d records" % (done, args.episodes, records))
+
+    records = dataset.generate(args.output, PowerPlant, args.episodes, args.processes, progress,
+                               duration=args.duration, attack_probability=args.attack_probability,
+                               seed=args.seed)
+    elapsed = time.time() - started
+    log.info("Wrote %s: %d records in %.1f s (%.0f records/s, %.1fM an hour)"
+             % (args.output, records, elapsed, records / elapsed, records / elapsed * 3600 / 1e6))
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,198 @@
+#!/usr/bin/env python
+# Power plant control logic for the soft-PLC scan engine.
+#
+# This is the logic that used to run in the PLC windows' update_status
+# callbacks, written as one rule table per PLC (common/rules.py).  Rate
+# based steps (heating, pumping, steam, condensing) are periodic rules that
+# keep their once a second timing; interlocks are event driven and only
+# evaluated when one of their tags changes.  The process steps can be left
+# out in favour of the continuous model in powerplant_model.py.
+#
+# Rate registers hold 2-6 and are turned into table indexes with "- 3",
+# as the PLC windows did, clamped to the tables: anyone on the network can
+# write a rate, and 7 used to take the scan thread down with an IndexError
+# (2 and below wrapped round to the coolest entries).
+
+from __future__ import division
+
+from powerplant_tags import *
+from rules import Rule, RuleSet, Ref, Above, Below, Equals, All, Not
+
+# BOILER
+WATERPUMPMAXGPM = 22712.47  # in liters. 6000 GPM pump
+GPMRATE = [ 1, 0.75, 0.50, 0.25 ]  # percentage of pump rate
+TEMPRATE = [ 25, 10, 5, 1 ] # how fast temp goes up
+WATERTOSTEAM = [15, 5, 1, 0]
+WATERFROMVALVETEMP = 80 # Degrees C
+
+# TURBINE
+STEAMRATE = [ 3, 2, 1, 0 ]
+WATERTOSTEAMRATE = [15, 5, 1, 0]
+PRESSUREMIN = 300
+PRESSUREMAX = 400
+PRESSURERELEASE = 15 # per second while the relief valve is open
+
+# CONDENSER
+CONDENSER_FLOWRATE = 10 # liters per second back to the boiler
+CONDENSE_RATE_BOILING = 1
+CONDENSE_RATE_NOT_BOILING = 2
+CONDENSE_TICKS = 2
+
+# Register values written when the world starts
+DEFAULTS = {
+    PLC_BOILER_WATER_VOLUME_LOW: 250,
+    PLC_BOILER_WATER_VOLUME_HIGH: 1000,
+    PLC_CONDENSER_VALVE: 1,
+    PLC_CONDENSER_WATER_VOLUME: 0,
+}
+
+
+# Rate register value of the first table entry, and the entries
+RATE_OFFSET = 3
+RATE_STEPS = len(GPMRATE)
+
+
+def rate_index(value):
+    """Table index of a rate register value, clamped to the tables."""
+    return max(0, min(RATE_STEPS - 1, int(value) - RATE_OFFSET))
+
+
+def _rate(io, addr):
+    return rate_index(io[addr])
+
+
+def boiler_rules(process=True, **settings):
+    """Pump water in, heat it with the burners, boil it off and ask the
+    water pump for water between the low and high marks."""
+    rules = [
+        Rule('need water', Below(PLC_BOILER_WATER_VOLUME, Ref(PLC_BOILER_WATER_VOLUME_LOW)),
+             then={PLC_BOILER_NEED_WATER: 1, PLC_BOILER_STOP_WATER: 0},
+             otherwise={PLC_BOILER_NEED_WATER: 0}),
+        Rule('stop water', Above(PLC_BOILER_WATER_VOLUME, Ref(PLC_BOILER_WATER_VOLUME_HIGH)),
+             then={PLC_BOILER_NEED_WATER: 0, PLC_BOILER_STOP_WATER: 1}),
+    ]
+    if not process:
+        return rules
+    return [
+        Rule('empty boiler is cold', Equals(PLC_BOILER_WATER_VOLUME, 0),
+             then={PLC_BOILER_TEMP: 0}),
+        Rule('pumped water temperature',
+             All(Above(PLC_BOILER_WATER_VOLUME, 0), Equals(PLC_BOILER_TEMP, 0)),
+             then={PLC_BOILER_TEMP: WATERFROMVALVETEMP}),
+        Rule('fill', Equals(PLC_WATERPUMP_VALVE, 1), every=1.0,
+             then={PLC_BOILER_WATER_VOLUME: lambda io: io[PLC_BOILER_WATER_VOLUME]
+                   + WATERPUMPMAXGPM * GPMRATE[_rate(io, PLC_WATERPUMP_RATE)] / 60}),
+        Rule('heat', All(Equals(PLC_FUEL_VALVE, 1), Above(PLC_BOILER_WATER_VOLUME, 0)), every=1.0,
+             then={PLC_BOILER_TEMP: lambda io: min(io[PLC_BOILER_TEMP]
+                   + TEMPRATE[_rate(io, PLC_FUEL_RATE)], 100)}),
+        Rule('boil', All(Equals(PLC_FUEL_VALVE, 1), Above(PLC_BOILER_WATER_VOLUME, 0),
+                         Above(PLC_BOILER_TEMP, 99)), every=1.0,
+             then={PLC_BOILER_WATER_VOLUME: lambda io: max(io[PLC_BOILER_WATER_VOLUME]
+                   - WATERTOSTEAM[_rate(io, PLC_FUEL_RATE)], 0)}),
+        Rule('cool', All(Equals(PLC_FUEL_VALVE, 0), Above(PLC_BOILER_TEMP, 0)), every=1.0,
+             then={PLC_BOILER_TEMP: lambda io: max(io[PLC_BOILER_TEMP] - 1, WATERFROMVALVETEMP)}),
+    ] + rules
+
+
+def condenser_rules(process=True, condense_ticks=CONDENSE_TICKS, **settings):
+    """Condense turbine steam every condense_ticks seconds and return the
+    water to the boiler."""
+    if not process:
+        # The valve is an operator set point
+        return []
+
+    def flow(io):
+        return min(io[PLC_CONDENSER_WATER_VOLUME], CONDENSER_FLOWRATE)
+
+    def condense(io):
+        if io[PLC_BOILER_TEMP] < 100 or _rate(io, PLC_FUEL_RATE) == RATE_STEPS - 1:
+            return CONDENSE_RATE_NOT_BOILING
+        return CONDENSE_RATE_BOILING
+
+    return [
+        Rule('return water', Equals(PLC_CONDENSER_VALVE, 1), every=1.0,
+             then={PLC_CONDENSER_WATER_VOLUME: lambda io: io[PLC_CONDENSER_WATER_VOLUME] - flow(io),
+                   PLC_BOILER_WATER_VOLUME: lambda io: io[PLC_BOILER_WATER_VOLUME] + flow(io)}),
+        Rule('condense', Above(PLC_TURBINE_PRESSURE, 0), every=condense_ticks,
+             then={PLC_CONDENSER_WATER_VOLUME: lambda io: io[PLC_CONDENSER_WATER_VOLUME] + condense(io),
+                   PLC_TURBINE_PRESSURE: lambda io: io[PLC_TURBINE_PRESSURE] - condense(io)}),
+    ]
+
+
+def fuel_rules(process=True, **settings):
+    # The fuel valve and rate are operator set points
+    return []
+
+
+def generator_rules(process=True, **settings):
+    return [
+        Rule('output', then={PLC_GENERATOR_OUTPUT: lambda io: io[PLC_TURBINE_RPMs]},
+             reads=[PLC_TURBINE_RPMs]),
+    ]
+
+
+def pylon_rules(process=True, **settings):
+    # The pylon only displays the generator output
+    return []
+
+
+def turbine_rules(process=True, pressure_min=PRESSUREMIN, pressure_max=PRESSUREMAX, **settings):
+    """Build turbine pressure from boiling water and relieve it between
+    pressure_max and pressure_min."""
+    rules = [
+        Rule('relief valve', Above(PLC_TURBINE_PRESSURE, pressure_max,
+                                   hysteresis=pressure_max - pressure_min),
+             then={PLC_TURBINE_PRESSURE_HIGH: 1},
+             otherwise={PLC_TURBINE_PRESSURE_HIGH: 0}),
+    ]
+    if not process:
+        return rules
+    boiling = All(Above(PLC_BOILER_WATER_VOLUME, 0), Equals(PLC_FUEL_VALVE, 1),
+                  Above(PLC_BOILER_TEMP, 99))
+    return [
+        Rule('steam', boiling, every=1.0,
+             then={PLC_TURBINE_RPMs: lambda io: STEAMRATE[_rate(io, PLC_FUEL_RATE)],
+                   PLC_TURBINE_PRESSURE: lambda io: io[PLC_TURBINE_PRESSURE]
+                   + WATERTOSTEAMRATE[_rate(io, PLC_FUEL_RATE)]}),
+        Rule('bleed', Equals(PLC_TURBINE_PRESSURE_HIGH, 1), every=1.0,
+             then={PLC_TURBINE_PRESSURE: lambda io: io[PLC_TURBINE_PRESSURE] - PRESSURERELEASE}),
+    ] + rules
+
+
+def waterpump_rules(process=True, **settings):
+    return [
+        Rule('start pump', Equals(PLC_BOILER_NEED_WATER, 1),
+             then={PLC_WATERPUMP_VALVE: 1}),
+        Rule('stop pump', All(Not(Equals(PLC_BOILER_NEED_WATER, 1)),
+                              Equals(PLC_BOILER_STOP_WATER, 1)),
+             then={PLC_WATERPUMP_VALVE: 0}),
+    ]
+
+
+# The seven PLCs in scan order
+PLCS = [
+    ('waterpump', waterpump_rules),
+    ('boiler', boiler_rules),
+    ('condenser', condenser_rules),
+    ('fuel', fuel_rules),
+    ('turbine', turbine_rules),
+    ('generator', generator_rules),
+    ('pylon', pylon_rules),
+]
+
+
+def programs(names=None, process=True, **settings):
+    """One RuleSet per PLC in scan order, optionally only the named ones.
+
+    With process=False the rate-based process steps are left out and only
+    the control rules remain, for when powerplant_model integrates the
+    process instead.  Keyword settings override the constants above for
+    the tables that use them (pressure_min, pressure_max, condense_ticks).
+    """
+    return [RuleSet(name, rules(process, **settings)) for name, rules in PLCS
+            if names is None or name in names]
+
+
+def write_defaults(slave):
+    for addr, value in DEFAULTS.items():
+        slave.setValues(3, addr, [value])
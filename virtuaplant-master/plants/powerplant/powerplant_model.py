@@ -0,0 +1,210 @@
+#!/usr/bin/env python
+# Continuous boiler, turbine and condenser model for the power plant.
+#
+# The rule tables in powerplant_logic.py move the process in once a second
+# jumps.  This model writes the same process as differential equations and
+# integrates them with a fixed step fourth order Runge-Kutta.  Every array
+# has one column per unit, so a whole fleet of plants steps in one call.
+#
+# State (one row each):
+#   VOLUME     boiler water, liters
+#   TEMP       boiler water temperature, C
+#   PRESSURE   turbine steam pressure, PSI
+#   CONDENSED  condenser water, liters
+#   SPEED      turbine speed, RPM
+#
+# Equations, with f the fuel valve, r and p the fuel and pump rate indexes:
+#   boiling    b = clip((TEMP - BOIL_TEMP + BOIL_BAND) / BOIL_BAND, 0, 1)
+#   steam      s = f * b * WATERTOSTEAM[r]                       liters/s
+#   inflow     q = pump * PUMP_FLOW[p] + valve * CONDENSER_FLOWRATE * (1 - exp(-CONDENSED / CONDENSER_FLOWRATE))
+#   dVOLUME    = q - s
+#   dTEMP      = f * (1 - b) * TEMPRATE[r] * REF_VOLUME / V + q * (INFLOW_TEMP - TEMP) / V
+#                - COOLING * (TEMP - AMBIENT_TEMP)
+#   dPRESSURE  = s * STEAM_PRESSURE - CONDENSING * PRESSURE - relief * PRESSURERELEASE * PRESSURE / (PRESSURE + 1)
+#   dCONDENSED = CONDENSING * PRESSURE - returned water
+#   dSPEED     = (MAX_SPEED * s / MAX_STEAM - SPEED) / SPEED_LAG
+# where V is VOLUME but at least MIN_VOLUME.  The inflow term mixes pumped
+# and returned water in at INFLOW_TEMP, as temperature_adjustment in the
+# ver2.0 world did.
+
+from __future__ import division
+
+import numpy as np
+
+from powerplant_tags import *
+from powerplant_logic import (WATERPUMPMAXGPM, GPMRATE, TEMPRATE, WATERTOSTEAM,
+                              WATERFROMVALVETEMP, PRESSURERELEASE, CONDENSER_FLOWRATE,
+                              RATE_OFFSET, RATE_STEPS)
+from softplc import Program
+
+# Integration step in seconds
+STEP = 0.05
+
+VOLUME, TEMP, PRESSURE, CONDENSED, SPEED = range(5)
+
+AMBIENT_TEMP = 20.0
+BOIL_TEMP = 100.0
+BOIL_BAND = 1.0         # C below boiling where heat starts turning into steam
+INFLOW_TEMP = float(WATERFROMVALVETEMP)
+REF_VOLUME = 1000.0     # liters heated at TEMPRATE
+MIN_VOLUME = 10.0
+COOLING = 0.01          # 1/s towards ambient
+STEAM_PRESSURE = 1.0    # PSI per liter/s of steam
+CONDENSING = 0.003      # 1/s of the pressure condensed back into water
+SPEED_LAG = 5.0         # s
+MAX_SPEED = 50000.0     # RPM at full steam
+MAX_STEAM = float(max(WATERTOSTEAM))
+
+PUMP_FLOW = np.array([WATERPUMPMAXGPM * rate / 60 for rate in GPMRATE])
+HEAT_RATE = np.array(TEMPRATE, dtype=float)
+STEAM_RATE = np.array(WATERTOSTEAM, dtype=float)
+
+# PLC_TURBINE_RPMs holds a level the windows look up in RPMS; level n is
+# shown as RPMS[3 - n]
+RPM_LEVELS = np.array([0.0, 10000.0, 30000.0, 50000.0])
+
+# Registers read as model inputs, one row each of the input matrix
+INPUTS = [
+    PLC_FUEL_VALVE,
+    PLC_FUEL_RATE,
+    PLC_WATERPUMP_VALVE,
+    PLC_WATERPUMP_RATE,
+    PLC_TURBINE_PRESSURE_HIGH,
+    PLC_CONDENSER_VALVE,
+]
+FUEL_VALVE, FUEL_RATE, PUMP_VALVE, PUMP_RATE, RELIEF, RETURN_VALVE = range(len(INPUTS))
+
+# Registers written from the state
+OUTPUTS = {
+    PLC_BOILER_WATER_VOLUME: VOLUME,
+    PLC_BOILER_TEMP: TEMP,
+    PLC_TURBINE_PRESSURE: PRESSURE,
+    PLC_CONDENSER_WATER_VOLUME: CONDENSED,
+    PLC_TURBINE_SPEED: SPEED,
+}
+
+
+def _rate_index(raw):
+    # powerplant_logic.rate_index for every unit at once, so the model and
+    # the rules read a rate register the same way
+    return np.clip(raw.astype(int) - RATE_OFFSET, 0, RATE_STEPS - 1)
+
+
+class PlantModel(object):
+    """State and RK4 integrator for units plants."""
+
+    def __init__(self, units=1, step=STEP):
+        self.units = units
+        self.step_size = step
+        self.state = np.zeros((5, units))
+        self.state[TEMP] = AMBIENT_TEMP
+
+    def derivatives(self, x, u):
+        f = u[FUEL_VALVE]
+        r = _rate_index(u[FUEL_RATE])
+        p = _rate_index(u[PUMP_RATE])
+
+        volume = np.maximum(x[VOLUME], MIN_VOLUME)
+        boiling = np.clip((x[TEMP] - BOIL_TEMP + BOIL_BAND) / BOIL_BAND, 0.0, 1.0)
+        steam = f * boiling * STEAM_RATE[r] * (x[VOLUME] > 0)
+        returned = u[RETURN_VALVE] * CONDENSER_FLOWRATE * (1.0 - np.exp(-x[CONDENSED] / CONDENSER_FLOWRATE))
+        inflow = u[PUMP_VALVE] * PUMP_FLOW[p] + returned
+        condensing = CONDENSING * x[PRESSURE]
+
+        dx = np.empty_like(x)
+        dx[VOLUME] = inflow - steam
+        dx[TEMP] = (f * (1.0 - boiling) * HEAT_RATE[r] * REF_VOLUME / volume
+                    + inflow * (INFLOW_TEMP - x[TEMP]) / volume
+                    - COOLING * (x[TEMP] - AMBIENT_TEMP))
+        dx[PRESSURE] = (steam * STEAM_PRESSURE - condensing
+                        - u[RELIEF] * PRESSURERELEASE * x[PRESSURE] / (x[PRESSURE] + 1.0))
+        dx[CONDENSED] = condensing - returned
+        dx[SPEED] = (MAX_SPEED * steam / MAX_STEAM - x[SPEED]) / SPEED_LAG
+        return dx
+
+    def step(self, u, dt=None):
+        """Advance every unit by dt (default one step) with inputs u held.
+
+        u is an array of raw input registers, one row per INPUTS entry and
+        one column per unit.
+        """
+        h = self.step_size if dt is None else dt
+        u = np.asarray(u, dtype=float)
+        x = self.state
+        k1 = self.derivatives(x, u)
+        k2 = self.derivatives(x + h / 2 * k1, u)
+        k3 = self.derivatives(x + h / 2 * k2, u)
+        k4 = self.derivatives(x + h * k3, u)
+        x = x + h / 6 * (k1 + 2 * k2 + 2 * k3 + k4)
+        np.maximum(x, 0.0, out=x)
+        np.minimum(x[TEMP], BOIL_TEMP, out=x[TEMP])
+        self.state = x
+        return x
+
+    def advance(self, u, duration):
+        """Advance by duration seconds in whole steps and one remainder."""
+        steps, rest = divmod(duration, self.step_size)
+        for _ in range(int(steps)):
+            self.step(u)
+        if rest > 1e-9:
+            self.step(u, rest)
+        return self.state
+
+    def outputs(self):
+        """Register values per output tag, {address: array over units}."""
+        values = dict((addr, self.state[row]) for addr, row in OUTPUTS.items())
+        values[PLC_BOILER_TEMP] = np.round(self.state[TEMP])
+        values[PLC_TURBINE_PRESSURE] = np.round(self.state[PRESSURE])
+        values[PLC_CONDENSER_WATER_VOLUME] = np.round(self.state[CONDENSED])
+        speed = self.state[SPEED][:, None]
+        values[PLC_TURBINE_RPMs] = np.abs(speed - RPM_LEVELS).argmin(axis=1)
+        return values
+
+
+class ModelDriver(object):
+    """Couples a PlantModel to the register images of its units.
+
+    Each update reads the inputs of every unit, adopts any output register
+    that somebody else overwrote since the last update (an operator, the
+    world or an attack) as the new state, steps the model and returns the
+    registers to write back.
+    """
+
+    def __init__(self, units=1, step=STEP):
+        self.model = PlantModel(units, step)
+        self.written = None
+        self.last = None
+
+    def update(self, now, registers):
+        """registers(address) returns the values of that tag over units."""
+        for addr, row in OUTPUTS.items():
+            current = np.asarray(registers(addr), dtype=float)
+            if self.written is None:
+                # Start from whatever the plant holds
+                self.model.state[row] = current
+            else:
+                changed = np.abs(current - self.written[addr]) > 0.5
+                self.model.state[row][changed] = current[changed]
+
+        u = np.array([registers(addr) for addr in INPUTS], dtype=float)
+        if self.last is not None:
+            self.model.advance(u, min(now - self.last, 1.0))
+        self.last = now
+
+        self.written = self.model.outputs()
+        return self.written
+
+
+class ModelProgram(Program):
+    """Soft-PLC program running the model for the engine's own plant."""
+
+    period = STEP
+
+    def __init__(self, step=STEP):
+        Program.__init__(self)
+        self.driver = ModelDriver(1, step)
+
+    def scan(self, io):
+        outputs = self.driver.update(io.now, lambda addr: [io[addr]])
+        for addr, values in outputs.items():
+            io[addr] = values[0]
@@ -0,0 +1,272 @@
+#!/usr/bin/env python
+# Runs the seven power plant PLCs headless, in one process.
+#
+# Against a world started with --no-plc, all enabled PLCs share one scan
+# loop and one Modbus connection:
+#
+#   ./powerplant_plcs.py -t 127.0.0.1 -p 5020 --no-pylon
+#
+# With -n the runner hosts a fleet of plants itself: every unit gets its own
+# in-process datastore, served on consecutive ports from -l, and one scan
+# loop runs the PLCs of every unit directly against the datastores.  A
+# unit whose scan fails is logged and counted; the others keep scanning.
+#
+#   ./powerplant_plcs.py -n 50 -l 6000
+
+import logging
+
+# Argument parsing
+import argparse
+
+import os
+import sys
+
+# Shared VirtuaPlant modules
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'common'))
+from modbus_connection import ConnectionManager
+from pymodbus.exceptions import ConnectionException
+from softplc import ScanEngine
+
+from powerplant_tags import *
+from powerplant_logic import PLCS, programs, write_defaults
+
+# Override Argument parser to throw error and generate help message
+# if undefined args are passed
+class MyParser(argparse.ArgumentParser):
+    def error(self, message):
+        sys.stderr.write('error: %s\n' % message)
+        self.print_help()
+        sys.exit(2)
+# Create argparser object to add command line args and help option
+parser = MyParser(
+    description = 'This Python script runs the power plant PLCs without their windows',
+    epilog = '',
+    add_help = True)
+parser.add_argument("-t", action = "store", dest="server_addr", default="127.0.0.1",
+                    help = "World Modbus server IP address (default 127.0.0.1)")
+parser.add_argument("-p", action = "store", dest="server_port", type=int, default=5020,
+                    help = "World Modbus server port (default 5020)")
+parser.add_argument("-s", action = "store", dest="scan_ms", type=float, default=10,
+                    help = "Scan time in milliseconds (default 10)")
+parser.add_argument("-n", action = "store", dest="units", type=int, default=0,
+                    help = "Host this many plants in process instead of connecting to a world")
+parser.add_argument("-l", action = "store", dest="listen_port", type=int, default=5020,
+                    help = "First port the hosted plants listen on (default 5020)")
+parser.add_argument("--model", action = "store_true", dest="model",
+                    help = "Integrate the process with the continuous model (needs NumPy)")
+parser.add_argument("--capture", action = "store", dest="capture",
+                    help = "Record the hosted plants' Modbus traffic into this capture log")
+parser.add_argument("--client-rate", action = "store", dest="client_rate", type=float,
+                    help = "Limit every Modbus client to this many requests a second")
+for name, rules in PLCS:
+    parser.add_argument("--no-%s" % name, action = "append_const", const=name, dest="disabled",
+                        help = "Do not run the %s PLC" % name)
+
+args = parser.parse_args()
+
+logging.basicConfig()
+log = logging.getLogger()
+log.setLevel(logging.INFO)
+
+# Values the world sets at start up, which hosted units need as well
+UNIT_DEFAULTS = {
+    PLC_FUEL_RATE: 5,
+    PLC_WATERPUMP_RATE: 5,
+}
+
+
+class RemoteSlave(object):
+    """Slave context interface over a Modbus connection.
+
+    Reads fetch every power plant tag with the read planner and writes go
+    out as write_registers, so a scan costs one request to read and one
+    per run of changed registers.
+    """
+
+    def __init__(self, connection, plan):
+        self.connection = connection
+        self.plan = plan
+
+    def getValues(self, fx, address, count=1):
+        regs = self.plan.read(self.connection)
+        return [regs.get(addr, 0) for addr in range(address, address + count)]
+
+    def setValues(self, fx, address, values):
+        rr = self.connection.write_registers(address, values)
+        if rr is None or rr.function_code > 0x80:
+            raise ConnectionException("writing 0x%02x failed" % address)
+
+
+class RemoteEngine(ScanEngine):
+    """Scan engine that skips scans while the world is unreachable.
+
+    A world running without its own PLC does not write the set points, so
+    they are written on every (re)connect, as the boiler window does.
+    """
+
+    def __init__(self, *args, **kwargs):
+        # The world's input registers are not ours to write
+        kwargs.setdefault('counter', None)
+        ScanEngine.__init__(self, *args, **kwargs)
+        self.skipped = 0
+        self.initialized = False
+
+    def scan(self, now=None):
+        if not self.slave.connection.online:
+            self.initialized = False
+            self.skipped += 1
+            return
+        try:
+            if not self.initialized:
+                write_defaults(self.slave)
+                self.initialized = True
+            ScanEngine.scan(self, now)
+        except ConnectionException as ex:
+            log.debug("Scan failed: %s" % ex)
+            self.skipped += 1
+
+    def summary(self):
+        return "%s, %d skipped" % (ScanEngine.summary(self), self.skipped)
+
+
+class Fleet(ScanEngine):
+    """Scans the engines of every hosted unit from one loop.
+
+    With a powerplant_model.ModelDriver the process of all units is
+    integrated in one vectorized step before their PLCs scan.  Failures
+    are kept to the unit they happen in: its programs' faults are caught
+    by its engine, and anything else its scan raises is caught here.
+    """
+
+    def __init__(self, engines, scan_time, driver=None):
+        # Each unit's engine counts its own scans into its datastore
+        ScanEngine.__init__(self, None, scan_time, name='fleet', counter=None)
+        self.engines = engines
+        self.driver = driver
+        self.next_model = 0.0
+        # Scans that failed per unit, and the units (None for the model)
+        # whose traceback was logged since the last report
+        self.unit_faults = [0] * len(engines)
+        self.fault_logged = set()
+
+    def _scan(self, now):
+        if self.driver is not None and now >= self.next_model:
+            self.next_model = now + self.driver.model.step_size
+            try:
+                self.step_model(now)
+            except Exception:
+                self._unit_fault(None)
+        for unit, engine in enumerate(self.engines):
+            try:
+                engine.scan(now)
+            except Exception:
+                self._unit_fault(unit)
+
+    def _unit_fault(self, unit):
+        # The fleet's own faults are the model's; the units' are listed
+        # by summary()
+        if unit is None:
+            self.faults += 1
+        else:
+            self.unit_faults[unit] += 1
+        if unit not in self.fault_logged:
+            self.fault_logged.add(unit)
+            log.exception("fleet: %s failed" % ("model step" if unit is None else "unit %d scan" % unit))
+
+    def report(self):
+        ScanEngine.report(self)
+        self.fault_logged.clear()
+        for engine in self.engines:
+            for program in engine.programs:
+                program.fault_logged = False
+
+    def summary(self):
+        faulty = ["%d (%d)" % (unit, engine.faults + self.unit_faults[unit])
+                  for unit, engine in enumerate(self.engines)
+                  if engine.faults + self.unit_faults[unit]]
+        if not faulty:
+            return ScanEngine.summary(self)
+        return "%s, faults in units %s" % (ScanEngine.summary(self), ', '.join(faulty))
+
+    def step_model(self, now):
+        blocks = [engine.slave.getValues(3, 0, count=engine.image.size) for engine in self.engines]
+        outputs = self.driver.update(now, lambda addr: [tags.lookup(addr).decode(block) for block in blocks])
+        for i, engine in enumerate(self.engines):
+            tags.write(engine.slave, dict((addr, values[i]) for addr, values in outputs.items()))
+
+
+def enabled():
+    return [name for name, rules in PLCS if name not in (args.disabled or [])]
+
+
+def connectionChanged(state, retry_in):
+    if retry_in:
+        log.info("World %s, retrying in %.1f s" % (state.lower(), retry_in))
+    else:
+        log.info("World %s" % state.lower())
+
+
+def runRemote(names):
+    connection = ConnectionManager(args.server_addr, args.server_port,
+                                   on_status=connectionChanged)
+    connection.start()
+    slave = RemoteSlave(connection, tags.plan_reads())
+    engine = RemoteEngine(slave, scan_time=args.scan_ms / 1000.0, tags=tags)
+    if args.model:
+        from powerplant_model import ModelProgram
+        engine.add(ModelProgram())
+    for program in programs(names, process=not args.model):
+        engine.add(program)
+    log.info("Running %s against %s:%s" % (', '.join(names), args.server_addr, args.server_port))
+    try:
+        engine.start(background=False)
+    except KeyboardInterrupt:
+        pass
+    log.info(engine.summary())
+
+
+def runFleet(names):
+    from twisted.internet import reactor
+    from plant_server import StartPlantServer, create_context
+    from capture import Capture
+
+    # One log for the fleet; records carry the port of the plant
+    capture = Capture(args.capture) if args.capture else None
+    engines = []
+    for unit in range(args.units):
+        context = create_context()
+        slave = context[0x00]
+        write_defaults(slave)
+        for addr, value in UNIT_DEFAULTS.items():
+            slave.setValues(3, addr, [value])
+        engine = ScanEngine(slave, report_interval=0, tags=tags, name="unit %d" % unit)
+        for program in programs(names, process=not args.model):
+            engine.add(program)
+        engines.append(engine)
+        StartPlantServer(context, address=("", args.listen_port + unit), run=False,
+                         capture=capture, client_rate=args.client_rate)
+
+    driver = None
+    if args.model:
+        from powerplant_model import ModelDriver
+        driver = ModelDriver(args.units)
+    fleet = Fleet(engines, scan_time=args.scan_ms / 1000.0, driver=driver)
+    log.info("Running %s for %d units on ports %d-%d"
+             % (', '.join(names), args.units, args.listen_port, args.listen_port + args.units - 1))
+    fleet.start()
+    reactor.addSystemEventTrigger('before', 'shutdown', lambda: log.info(fleet.summary()))
+    reactor.addSystemEventTrigger('before', 'shutdown', fleet.stop)
+    if capture is not None:
+        reactor.addSystemEventTrigger('after', 'shutdown', capture.close)
+    reactor.run()
+
+
+def main():
+    names = enabled()
+    if args.units > 0:
+        runFleet(names)
+    else:
+        runRemote(names)
+
+if __name__ == '__main__':
+    sys.exit(main())
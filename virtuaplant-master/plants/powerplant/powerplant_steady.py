@@ -0,0 +1,231 @@
+#!/usr/bin/env python
+# Steady-state operating point of the power plant for given settings.
+#
+# Solves the equations of powerplant_model.py for the state the plant
+# settles into instead of integrating them:
+#
+#   ./powerplant_steady.py -f 4 -w 5        # one fuel rate / pump rate pair
+#   ./powerplant_steady.py --all            # every pair, marking those that
+#                                           # hold pressure in the band
+#
+# or from Python, for scripted sweeps:
+#
+#   from powerplant_steady import operating_point
+#   point = operating_point(fuel_rate=4, pump_rate=5)
+#   point.pressure, point.relief_duty, point.in_band
+#
+# With the boiler at a steady level, whatever boils off is replaced by the
+# pump and the condenser return.  Temperature then follows from the heat
+# balance at the boiling point, solved for the boiling fraction by
+# bisection.  If the steam alone would push the pressure past PRESSUREMAX,
+# the relief valve cycles between PRESSUREMIN and PRESSUREMAX; the two
+# halves of that cycle are exponentials with closed form durations and
+# means.  Steam vented by the relief valve is lost to the boiler, which the
+# pump makes up between the low and high marks.
+
+from __future__ import division
+
+import argparse
+import math
+import sys
+
+from powerplant_logic import PRESSUREMIN, PRESSUREMAX, PRESSURERELEASE, DEFAULTS
+from powerplant_model import (AMBIENT_TEMP, BOIL_TEMP, BOIL_BAND, INFLOW_TEMP, REF_VOLUME,
+                              COOLING, STEAM_PRESSURE, CONDENSING, MAX_SPEED, MAX_STEAM,
+                              HEAT_RATE, STEAM_RATE, PUMP_FLOW, RPM_LEVELS)
+from powerplant_tags import *
+
+# Bisection iterations for the boiling fraction (2**-40 is plenty)
+ITERATIONS = 40
+
+
+class OperatingPoint(object):
+    """Where the plant settles for one set of settings.
+
+    Pressure and volume are means over the relief valve and pump cycles
+    when those cycle; pressure_low/high give the pressure range.
+    """
+
+    FIELDS = ('fuel_rate', 'pump_rate', 'volume', 'temp', 'pressure', 'pressure_low',
+              'pressure_high', 'steam', 'speed', 'rpm_level', 'relief_duty', 'relief_period',
+              'pump_duty', 'in_band', 'sustainable')
+
+    def __init__(self, **fields):
+        for name in self.FIELDS:
+            setattr(self, name, fields[name])
+
+    def as_dict(self):
+        return dict((name, getattr(self, name)) for name in self.FIELDS)
+
+    def __repr__(self):
+        return "OperatingPoint(%s)" % ', '.join("%s=%r" % (name, getattr(self, name))
+                                                for name in self.FIELDS)
+
+
+def _index(rate):
+    # Rate settings are 2-6 and index the tables with "- 3", clipped as the
+    # model does
+    return max(0, min(3, int(rate) - 3))
+
+
+def _boiling_fraction(heat, steam_rate, volume):
+    """Fraction b of full boiling where the boiler's heat balance closes.
+
+    Heat going into temperature, heat from make-up water mixed in at
+    INFLOW_TEMP and losses to ambient must cancel at T = BOIL_TEMP -
+    BOIL_BAND + b * BOIL_BAND, with make-up flow equal to the steam b
+    produces.  Returns (b, temperature).
+    """
+    def balance(b):
+        temp = BOIL_TEMP - BOIL_BAND + b * BOIL_BAND
+        inflow = b * steam_rate
+        return ((1 - b) * heat * REF_VOLUME / volume
+                + inflow * (INFLOW_TEMP - temp) / volume
+                - COOLING * (temp - AMBIENT_TEMP))
+
+    if balance(0.0) <= 0:
+        # Never reaches the boiling band: losses balance the heater below it
+        temp = AMBIENT_TEMP + heat * REF_VOLUME / (volume * COOLING)
+        return 0.0, min(temp, BOIL_TEMP - BOIL_BAND)
+
+    lo, hi = 0.0, 1.0
+    for _ in range(ITERATIONS):
+        mid = (lo + hi) / 2
+        if balance(mid) > 0:
+            lo = mid
+        else:
+            hi = mid
+    b = (lo + hi) / 2
+    return b, BOIL_TEMP - BOIL_BAND + b * BOIL_BAND
+
+
+def _approach(start, end, target, rate):
+    """Duration and mean of x' = rate * (target - x) going from start to end."""
+    duration = math.log((target - start) / (target - end)) / rate
+    mean = target + (start - target) * (1 - math.exp(-rate * duration)) / (rate * duration)
+    return duration, mean
+
+
+def operating_point(fuel_rate, pump_rate, fuel_valve=1, low=None, high=None,
+                    pressure_min=PRESSUREMIN, pressure_max=PRESSUREMAX):
+    """Steady state for fuel and pump rate settings (2-6).
+
+    low and high are the boiler level marks (the world's defaults unless
+    given).  The result is an OperatingPoint; in_band tells whether the
+    pressure stays within pressure_min..pressure_max without the relief
+    valve venting, sustainable whether the pump keeps up with the losses.
+    """
+    if low is None:
+        low = DEFAULTS[PLC_BOILER_WATER_VOLUME_LOW]
+    if high is None:
+        high = DEFAULTS[PLC_BOILER_WATER_VOLUME_HIGH]
+    r = _index(fuel_rate)
+    pump_flow = PUMP_FLOW[_index(pump_rate)]
+
+    # The level sits between the marks, where the pump control keeps it
+    volume = max((low + high) / 2, 1.0)
+    heat = fuel_valve * HEAT_RATE[r]
+    b, temp = _boiling_fraction(heat, fuel_valve * STEAM_RATE[r], volume)
+    steam = fuel_valve * b * STEAM_RATE[r]
+
+    # Pressure with the relief valve shut settles where condensing takes
+    # up all the steam
+    closed = steam * STEAM_PRESSURE / CONDENSING
+    relief_duty = 0.0
+    relief_period = 0.0
+    if closed <= pressure_max:
+        pressure = pressure_low = pressure_high = closed
+    else:
+        # Venting takes PRESSURERELEASE (for pressures well above 1 PSI)
+        opened = (steam * STEAM_PRESSURE - PRESSURERELEASE) / CONDENSING
+        if opened >= pressure_min:
+            # The valve cannot bring the pressure back down and stays open
+            pressure = pressure_low = pressure_high = max(opened, pressure_min)
+            relief_duty = 1.0
+        else:
+            rise, rise_mean = _approach(pressure_min, pressure_max, closed, CONDENSING)
+            fall, fall_mean = _approach(pressure_max, pressure_min, opened, CONDENSING)
+            relief_period = rise + fall
+            relief_duty = fall / relief_period
+            pressure = (rise * rise_mean + fall * fall_mean) / relief_period
+            pressure_low, pressure_high = pressure_min, pressure_max
+
+    # Vented steam never comes back through the condenser
+    loss = relief_duty * PRESSURERELEASE / STEAM_PRESSURE
+    pump_duty = loss / pump_flow if pump_flow > 0 else float('inf')
+    sustainable = pump_duty <= 1.0
+    if not sustainable:
+        volume = 0.0
+
+    speed = MAX_SPEED * steam / MAX_STEAM
+    rpm_level = min(range(len(RPM_LEVELS)), key=lambda level: abs(RPM_LEVELS[level] - speed))
+
+    return OperatingPoint(
+        fuel_rate=fuel_rate,
+        pump_rate=pump_rate,
+        volume=volume,
+        temp=temp,
+        pressure=pressure,
+        pressure_low=pressure_low,
+        pressure_high=pressure_high,
+        steam=steam,
+        speed=speed,
+        rpm_level=rpm_level,
+        relief_duty=relief_duty,
+        relief_period=relief_period,
+        pump_duty=min(pump_duty, 1.0),
+        in_band=pressure_min <= pressure_high and pressure_low <= pressure_max and relief_duty == 0,
+        sustainable=sustainable)
+
+
+def sweep(fuel_rates=range(2, 7), pump_rates=range(2, 7), **kwargs):
+    """operating_point for every fuel rate / pump rate pair."""
+    return [operating_point(fuel, pump, **kwargs) for fuel in fuel_rates for pump in pump_rates]
+
+
+# Override Argument parser to throw error and generate help message
+# if undefined args are passed
+class MyParser(argparse.ArgumentParser):
+    def error(self, message):
+        sys.stderr.write('error: %s\n' % message)
+        self.print_help()
+        sys.exit(2)
+
+
+def main():
+    parser = MyParser(
+        description = 'This Python script computes where the power plant settles for given settings',
+        epilog = '',
+        add_help = True)
+    parser.add_argument("-f", action = "store", dest="fuel_rate", type=int, default=5,
+                        help = "Fuel rate setting, 2-6 (default 5)")
+    parser.add_argument("-w", action = "store", dest="pump_rate", type=int, default=5,
+                        help = "Water pump rate setting, 2-6 (default 5)")
+    parser.add_argument("--low", action = "store", dest="low", type=float,
+                        help = "Boiler low level mark, liters")
+    parser.add_argument("--high", action = "store", dest="high", type=float,
+                        help = "Boiler high level mark, liters")
+    parser.add_argument("--min", action = "store", dest="pressure_min", type=float, default=PRESSUREMIN,
+                        help = "Relief valve closing pressure, PSI (default %d)" % PRESSUREMIN)
+    parser.add_argument("--max", action = "store", dest="pressure_max", type=float, default=PRESSUREMAX,
+                        help = "Relief valve opening pressure, PSI (default %d)" % PRESSUREMAX)
+    parser.add_argument("--all", action = "store_true", dest="all",
+                        help = "Solve every fuel rate / pump rate pair")
+    args = parser.parse_args()
+
+    kwargs = dict(low=args.low, high=args.high,
+                  pressure_min=args.pressure_min, pressure_max=args.pressure_max)
+    if args.all:
+        points = sweep(**kwargs)
+    else:
+        points = [operating_point(args.fuel_rate, args.pump_rate, **kwargs)]
+
+    print("fuel pump  volume   temp  pressure (range)      rpm  relief  pump  band")
+    for p in points:
+        print("%4d %4d %7.1f %6.1f %9.1f (%3.0f-%3.0f) %8.0f %6.0f%% %4.0f%%  %s"
+              % (p.fuel_rate, p.pump_rate, p.volume, p.temp, p.pressure,
+                 p.pressure_low, p.pressure_high, p.speed, p.relief_duty * 100,
+                 p.pump_duty * 100, 'yes' if p.in_band else '-'))
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,142 @@
+#!/usr/bin/env python
+# Parameter sweep over headless power plant runs.
+#
+# Every point runs the seven PLCs' rule tables (or the continuous model with
+# --model) against an in-memory datastore for -d simulated seconds, on a
+# virtual clock, and records what came of it:
+#
+#   ./powerplant_sweep.py -a fuel_rate=2:6 -a pressure_max=350:450:25 -o sweep.csv
+#   ./powerplant_sweep.py -a condense_ticks=1,2,4 -a pump_rate=2:6 -j 4 -o sweep.parquet
+#
+# Parameters: fuel_rate and pump_rate (settings, 2-6; below 3 acts as 3,
+# above 6 as 6), pressure_min and pressure_max (relief valve, PSI),
+# condense_ticks (seconds per condenser step; not used by --model).
+# Outcomes: pressure_trips (times the relief valve opened), max_pressure,
+# energy_mwh (generator output integrated over the run) and
+# relief_seconds (time the relief valve was open).
+
+from __future__ import division
+
+import logging
+
+# Argument parsing
+import argparse
+
+import os
+import sys
+import time
+
+# Shared VirtuaPlant modules
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'common'))
+import sweep
+from plant_server import create_context
+from softplc import ScanEngine
+
+from powerplant_tags import *
+from powerplant_logic import PRESSUREMIN, PRESSUREMAX, CONDENSE_TICKS, programs, write_defaults
+
+PARAMETERS = ['fuel_rate', 'pump_rate', 'pressure_min', 'pressure_max', 'condense_ticks']
+OUTCOMES = ['pressure_trips', 'max_pressure', 'energy_mwh', 'relief_seconds']
+
+log = logging.getLogger()
+
+
+def simulate(fuel_rate=5, pump_rate=5, pressure_min=PRESSUREMIN, pressure_max=PRESSUREMAX,
+             condense_ticks=CONDENSE_TICKS, duration=3600, scan=0.1, model=False):
+    """Run one plant for duration seconds, scanning every scan seconds."""
+    slave = create_context()[0x00]
+    write_defaults(slave)
+    for addr, value in ((PLC_FUEL_VALVE, 1), (PLC_FUEL_RATE, fuel_rate),
+                        (PLC_WATERPUMP_RATE, pump_rate)):
+        slave.setValues(3, addr, [value])
+
+    engine = ScanEngine(slave, scan_time=scan, report_interval=0, tags=tags)
+    if model:
+        from powerplant_model import ModelProgram
+        engine.add(ModelProgram())
+    for program in programs(process=not model, pressure_min=pressure_min,
+                            pressure_max=pressure_max, condense_ticks=condense_ticks):
+        engine.add(program)
+
+    io = engine.image
+    trips = 0
+    relieving = 0
+    max_pressure = 0
+    energy = 0.0
+    relief = 0.0
+    for i in range(int(round(duration / scan))):
+        engine.scan(i * scan)
+        high = io[PLC_TURBINE_PRESSURE_HIGH]
+        if high and not relieving:
+            trips += 1
+        relieving = high
+        relief += high * scan
+        max_pressure = max(max_pressure, io[PLC_TURBINE_PRESSURE])
+        energy += io[PLC_GENERATOR_OUTPUT] * scan
+
+    return {
+        'pressure_trips': trips,
+        'max_pressure': max_pressure,
+        'energy_mwh': energy / 3600,
+        'relief_seconds': relief,
+    }
+
+
+# Override Argument parser to throw error and generate help message
+# if undefined args are passed
+class MyParser(argparse.ArgumentParser):
+    def error(self, message):
+        sys.stderr.write('error: %s\n' % message)
+        self.print_help()
+        sys.exit(2)
+
+
+def main():
+    parser = MyParser(
+        description = 'This Python script sweeps power plant parameters over headless runs',
+        epilog = 'Parameters: %s' % ', '.join(PARAMETERS),
+        add_help = True)
+    parser.add_argument("-a", action = "append", dest="axes", default=[],
+                        help = "Axis as name=first:last[:step] or name=v1,v2,... (repeatable, default fuel_rate=2:6)")
+    parser.add_argument("-o", action = "store", dest="output", default="powerplant_sweep.csv",
+                        help = "Output table, .csv or .parquet (default powerplant_sweep.csv)")
+    parser.add_argument("-j", action = "store", dest="processes", type=int,
+                        help = "Worker processes (default one per core)")
+    parser.add_argument("-d", action = "store", dest="duration", type=float, default=3600,
+                        help = "Simulated seconds per run (default 3600)")
+    parser.add_argument("-s", action = "store", dest="scan_ms", type=float, default=100,
+                        help = "Simulated scan time in milliseconds (default 100)")
+    parser.add_argument("--model", action = "store_true", dest="model",
+                        help = "Integrate the process with the continuous model (needs NumPy)")
+    args = parser.parse_args()
+
+    try:
+        axes = [sweep.parse_axis(text) for text in args.axes or ['fuel_rate=2:6']]
+    except ValueError as ex:
+        parser.error(str(ex))
+    for name, values in axes:
+        if name not in PARAMETERS:
+            parser.error("unknown parameter %s" % name)
+    if args.output.endswith('.parquet'):
+        try:
+            import pyarrow
+        except ImportError:
+            parser.error("writing Parquet needs pyarrow")
+
+    logging.basicConfig()
+    log.setLevel(logging.INFO)
+
+    # Parameters not swept keep their defaults, and show them in the table
+    fixed = sweep.defaults(simulate)
+    fixed.update(duration=args.duration, scan=args.scan_ms / 1000.0, model=args.model)
+    points = sweep.grid(axes, fixed)
+    log.info("Sweeping %d points" % len(points))
+    started = time.time()
+    rows = sweep.run(simulate, points, processes=args.processes)
+    elapsed = time.time() - started
+    sweep.write_table(args.output, rows, PARAMETERS + OUTCOMES)
+    log.info("Wrote %s: %d runs in %.1f s (%.2f runs/s)"
+             % (args.output, len(rows), elapsed, len(rows) / elapsed))
+
+if __name__ == '__main__':
+    sys.exit(main())
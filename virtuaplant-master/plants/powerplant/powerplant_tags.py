@@ -0,0 +1,53 @@
+#!/usr/bin/env python
+# Power plant PLC tags, shared by the world, the PLC windows and any scripts
+# talking to the plant.  `from powerplant_tags import *` defines the PLC_*
+# register constants.
+
+import os
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'common'))
+from tagdb import Tag, TagDatabase
+
+tags = TagDatabase([
+    # WATER PUMP
+    Tag('PLC_WATERPUMP_VALVE', 0x01, 'bool', description="Water pump running"),
+    Tag('PLC_WATERPUMP_RATE', 0x02, description="Water pump rate setting (2-6)"),
+
+    # FUEL
+    Tag('PLC_FUEL_VALVE', 0x03, 'bool', description="Fuel valve open"),
+    Tag('PLC_FUEL_RATE', 0x04, description="Fuel rate setting (2-6)"),
+
+    # BOILER
+    Tag('PLC_BOILER', 0x05, 'bool', description="Boiler status"),
+    Tag('PLC_BOILER_TEMP', 0x06, description="Boiler water temperature, C"),
+    Tag('PLC_BOILER_WATER_VOLUME_LOW', 0x08, description="Boiler water volume low set point, liters"),
+    Tag('PLC_BOILER_WATER_VOLUME_HIGH', 0x09, description="Boiler water volume high set point, liters"),
+
+    # CONDENSER
+    Tag('PLC_CONDENSER_VALVE', 0x0a, 'bool', description="Condenser return valve open"),
+    Tag('PLC_CONDENSER_WATER_VOLUME', 0x0b, description="Condenser water volume, liters"),
+
+    # TURBINE
+    Tag('PLC_TURBINE_PRESSURE_HIGH', 0x0c, 'bool', description="Turbine over pressure, releasing steam"),
+    Tag('PLC_TURBINE_PRESSURE', 0x0d, description="Turbine steam pressure, PSI"),
+
+    # GENERATOR
+    Tag('PLC_GENERATOR_STATUS', 0x0e, 'bool', description="Generator running"),
+    Tag('PLC_GENERATOR_OUTPUT', 0x0f, description="Generator output, MW"),
+
+    # PYLON
+    Tag('PLC_PYLON_STATUS', 0x10, 'bool', description="Pylon energised"),
+
+    Tag('PLC_TURBINE_RPMs', 0x11, description="Turbine speed, RPM"),
+    Tag('PLC_PYLON_POWER', 0x12, description="Power delivered to the pylon"),
+
+    Tag('PLC_BOILER_NEED_WATER', 0x13, 'bool', description="Boiler asks the pump for water"),
+    Tag('PLC_BOILER_STOP_WATER', 0x14, 'bool', description="Boiler asks the pump to stop"),
+
+    # 0x07 held a 16-bit volume, which truncated the pump's fractional flow
+    Tag('PLC_BOILER_WATER_VOLUME', 0x15, 'float32', description="Boiler water volume, liters"),
+    Tag('PLC_TURBINE_SPEED', 0x17, 'float32', description="Turbine speed from the process model, RPM"),
+])
+
+tags.export(globals())
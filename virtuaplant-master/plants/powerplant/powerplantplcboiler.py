@@ -4,11 +4,11 @@
 import gi
 gi.require_version('Gtk', '3.0')
 from gi.repository import GLib, Gtk, Gdk, GObject
-from pymodbus.client.sync import ModbusTcpClient as ModbusClient
 from pymodbus.exceptions import ConnectionException
 
 import argparse
 import os
+import socket
 import sys
 import time
 
@@ -39,56 +39,25 @@ if len(sys.argv)==1:
 # Split and process arguments into "args"
 args = parser.parse_args()
 
-MODBUS_SLEEP=1
-
-# ******************* PLCs ************************
-# WATER PUMP
-PLC_WATERPUMP_VALVE = 0x01
-PLC_WATERPUMP_RATE = 0x02
-
-# FUEL
-PLC_FUEL_VALVE = 0x03
-PLC_FUEL_RATE = 0x04
-
-# BOILER
-PLC_BOILER = 0x05
-PLC_BOILER_TEMP = 0x06
-PLC_BOILER_WATER_VOLUME = 0x07
-PLC_BOILER_WATER_VOLUME_LOW = 0x08
-PLC_BOILER_WATER_VOLUME_HIGH = 0X09
-
-PLC_BOILER_NEED_WATER = 0x13
-PLC_BOILER_STOP_WATER = 0x14
-
-# CONDENSER
-PLC_CONDENSER_VALVE = 0x0a
-PLC_CONDENSER_WATER_VOLUME = 0x0b
-
-# TURBINE
-PLC_TURBINE_PRESSURE_HIGH = 0x0c
-PLC_TURBINE_PRESSURE_LOW = 0x0d
-PLC_TURBINE_RPMs = 0x11
-
-# GENERATOR
-PLC_GENERATOR_STATUS = 0x0e
-PLC_GENERATOR_OUTPUT = 0x0f
-
-# PYLON
-PLC_PYLON_STATUS = 0x10
-PLC_PYLON_POWER = 0x12
+# Shared VirtuaPlant modules
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'common'))
+from modbus_connection import ConnectionManager, CONNECTING, ONLINE
+from trends import TrendRecorder
+from trend_panel import TrendPanel
 
-# *************************************************
-
-
-WATERPUMPMAXGPM = 22712.47  # in liters. 6000 GPM pump
-
-GPMRATE = [ 1, 0.75, 0.50, 0.25 ]  # percentage of pump rate
+MODBUS_SLEEP=1
 
-TEMPRATE = [ 25, 10, 5, 1 ] # how fast temp goes up
+# PLC register tags
+from powerplant_tags import *
 
-WATERTOSTEAM = [15, 5, 1, 0]
+# Registers shown by this PLC
+READ_PLAN = tags.plan_reads([
+    PLC_BOILER_TEMP,
+    PLC_BOILER_WATER_VOLUME,
+    PLC_BOILER_WATER_VOLUME_HIGH,
+    PLC_BOILER_WATER_VOLUME_LOW,
+])
 
-WATERFROMVALVETEMP = 80 # Degrees C
 
 gallontoliter = 3.78541 # 1 Gallon to Liter
 
@@ -100,7 +69,7 @@ class HMIWindow(Gtk.Window):
     
     def initModbus(self):
         # Create modbus connection to specified address and port
-        self.modbusClient = ModbusClient(args.server_addr, port=5020)
+        self.modbusClient = ConnectionManager(args.server_addr, 5020, on_status=self.connectionChanged)
 
     # Default values for the HMI labels
     def resetLabels(self):
@@ -186,6 +155,16 @@ class HMIWindow(Gtk.Window):
         grid.attach(boiler_plc_water_temp_value, 5, elementIndex, 1, 1)
         elementIndex += 1
 
+        # Trends of the last hour
+        self.trends = TrendRecorder(self.modbusClient, [PLC_BOILER_TEMP, PLC_BOILER_WATER_VOLUME], tags=tags)
+        self.trend_panels = [
+            TrendPanel("Water Temp", self.trends.buffers[PLC_BOILER_TEMP], color=(0.8, 0.0, 0.0)),
+            TrendPanel("Volume", self.trends.buffers[PLC_BOILER_WATER_VOLUME], unit="liters"),
+        ]
+        for panel in self.trend_panels:
+            grid.attach(panel, 4, elementIndex, 12, 1)
+            elementIndex += 1
+
 
         # Attach Value Labels
         self.boiler_plc_online_value = boiler_plc_online_value
@@ -202,9 +181,12 @@ class HMIWindow(Gtk.Window):
 
         # Set default label values
         self.resetLabels()
+        self.modbusClient.start()
+        self.trends.start()
         GObject.timeout_add_seconds(MODBUS_SLEEP, self.update_status)
 
-        # Setting Default Numbers to Registers
+    # Setting Default Numbers to Registers, every time the PLC comes back
+    def writeDefaults(self):
         try:
             self.modbusClient.write_register(PLC_BOILER_WATER_VOLUME_LOW, self.boiler_plc_water_volume_low_scale.get_value())
         except:
@@ -229,18 +211,6 @@ class HMIWindow(Gtk.Window):
         except:
             pass
     
-    def setWaterAmount( self, num ):
-        try:
-            self.modbusClient.write_register(PLC_BOILER_WATER_VOLUME, num)
-        except:
-            pass
-
-    def setTemperature( self, num ):
-        try:
-            self.modbusClient.write_register(PLC_BOILER_TEMP, num)
-        except:
-            pass
-
 
     def temperature_from_cooling(currenttemp):
         # T(t) = Ts + (To - Ts)e(-kt)
@@ -267,102 +237,55 @@ class HMIWindow(Gtk.Window):
         return temp
 
 
-    def update_status(self):
+    # Called from the connection thread
+    def connectionChanged(self, state, retry_in):
+        GLib.idle_add(self.showConnectionStatus, state, retry_in)
 
-        try:
-            # Store the registers of the PLC in "rr"
-            rr = self.modbusClient.read_holding_registers(1,24)
-            regs = []
+    def showConnectionStatus(self, state, retry_in):
+        if state == ONLINE:
+            self.boiler_plc_online_value.set_markup("<span weight='bold' foreground='green'>ON</span>")
+            self.writeDefaults()
+        elif state == CONNECTING:
+            self.boiler_plc_online_value.set_markup("<span weight='bold' foreground='orange'>CONNECTING</span>")
+        else:
+            self.resetLabels()
+            self.boiler_plc_online_value.set_markup("<span weight='bold' foreground='red'>OFF (retry in %.0fs)</span>" % retry_in)
+        return False
 
-            # If we get back a blank response, something happened connecting to the PLC
-            if not rr or not rr.registers:
-                raise ConnectionException
-            
-            # Regs is an iterable list of register key:values
-            regs = rr.registers
+    def update_status(self):
+
+        if not self.modbusClient.online:
+            return True
 
-            if not regs or len(regs) < 16:
-                raise ConnectionException
+        try:
+            # Read the registers this PLC uses, keyed by address
+            regs = READ_PLAN.read(self.modbusClient)
             
             self.boiler_plc_online_value.set_markup("<span weight='bold' foreground='green'>ON</span>")
             
-            self.boiler_plc_water_volume_value.set_markup("<span weight='bold' foreground='black'>" + str( regs[PLC_BOILER_WATER_VOLUME - 1] ) + " liters</span>")
+            self.boiler_plc_water_volume_value.set_markup("<span weight='bold' foreground='black'>" + "%.1f" % tags.lookup(PLC_BOILER_WATER_VOLUME).decode(regs) + " liters</span>")
 
-            #self.boiler_plc_water_temp_value.set_markup("<span weight='bold' foreground='black'>" + str( (regs[PLC_BOILER_TEMP - 1]) ) + degree + "</span>")
-            
-            VOLUME = regs[ PLC_BOILER_WATER_VOLUME - 1 ]
-            
-            if regs[PLC_BOILER_WATER_VOLUME - 1] == 0:
-                self.setTemperature(0)
-            elif regs[PLC_BOILER_WATER_VOLUME - 1] > 0:
-                if regs[ PLC_BOILER_TEMP - 1] == 0:
-                    self.setTemperature(WATERFROMVALVETEMP)
-
-            if regs[PLC_WATERPUMP_VALVE - 1] == 1:
-                rate = regs[PLC_WATERPUMP_RATE - 1] - 3  # should be 0, 1, 2, or 3 to select from GPMRATE
-                gpm = WATERPUMPMAXGPM * GPMRATE[ rate ]
-                gps = gpm / 60
-                VOLUME = VOLUME + gps
-                self.setWaterAmount(VOLUME)
- 
-            # ******* TEMP change from adding water.  go off of rate to call function *********
-
-
-            if regs[PLC_FUEL_VALVE - 1] == 1:
-                if VOLUME > 0 : # regs[PLC_BOILER_WATER_VOLUME - 1] > 0:
-                    rate = regs[ PLC_FUEL_RATE - 1] - 3
-                    temp = regs[PLC_BOILER_TEMP - 1] + TEMPRATE[rate]
-                    if temp >= 100:
-                        temp = 100
-                        #vol = regs[PLC_BOILER_WATER_VOLUME - 1]
-                        VOLUME -= WATERTOSTEAM[rate]
-                        self.setWaterAmount(VOLUME)
-
-                    self.setTemperature(temp)
-
-            if regs[PLC_FUEL_VALVE - 1] == 0:
-                if regs[PLC_BOILER_TEMP - 1] > 0:
-                    temp = regs[PLC_BOILER_TEMP - 1] - 1
-                    if temp <= 80:
-                        temp = 80
-                    self.setTemperature(temp)
-
-            #TICKS_TO_STEAM -= TICKS_TO_STEAM
-            self.boiler_plc_water_temp_value.set_markup("<span weight='bold' foreground='black'>" + str( regs[PLC_BOILER_TEMP - 1])  + "</span>")
+            #self.boiler_plc_water_temp_value.set_markup("<span weight='bold' foreground='black'>" + str( (regs[PLC_BOILER_TEMP]) ) + degree + "</span>")
             
+            self.boiler_plc_water_temp_value.set_markup("<span weight='bold' foreground='black'>" + str( regs[PLC_BOILER_TEMP])  + "</span>")
 
-            if self.boiler_plc_water_volume_low_scale.get_value() > regs[PLC_BOILER_WATER_VOLUME_HIGH - 1]:
-                self.boiler_plc_water_volume_low_scale.set_value( regs[PLC_BOILER_WATER_VOLUME_HIGH - 1])
-            elif self.boiler_plc_water_volume_high_scale.get_value() < regs[PLC_BOILER_WATER_VOLUME_LOW - 1]:
-                self.boiler_plc_water_volume_high_scale.set_value( regs[PLC_BOILER_WATER_VOLUME_LOW - 1])
+            for panel in self.trend_panels:
+                panel.queue_draw()
             
 
-            self.boiler_plc_water_volume_low_value.set_markup("<span weight='bold' foreground='black'>" + str( regs[PLC_BOILER_WATER_VOLUME_LOW - 1] ) + "</span>")
-            self.boiler_plc_water_volume_high_value.set_markup("<span weight='bold' foreground='black'>" + str( regs[PLC_BOILER_WATER_VOLUME_HIGH - 1] ) + "</span>")
+            if self.boiler_plc_water_volume_low_scale.get_value() > regs[PLC_BOILER_WATER_VOLUME_HIGH]:
+                self.boiler_plc_water_volume_low_scale.set_value( regs[PLC_BOILER_WATER_VOLUME_HIGH])
+            elif self.boiler_plc_water_volume_high_scale.get_value() < regs[PLC_BOILER_WATER_VOLUME_LOW]:
+                self.boiler_plc_water_volume_high_scale.set_value( regs[PLC_BOILER_WATER_VOLUME_LOW])
             
+
+            self.boiler_plc_water_volume_low_value.set_markup("<span weight='bold' foreground='black'>" + str( regs[PLC_BOILER_WATER_VOLUME_LOW] ) + "</span>")
+            self.boiler_plc_water_volume_high_value.set_markup("<span weight='bold' foreground='black'>" + str( regs[PLC_BOILER_WATER_VOLUME_HIGH] ) + "</span>")
             
-            if regs[PLC_BOILER_WATER_VOLUME - 1] < regs[PLC_BOILER_WATER_VOLUME_LOW - 1]:
-                # request turn on pump
-                try:
-                    self.modbusClient.write_register(PLC_BOILER_NEED_WATER, 1)
-                    self.modbusClient.write_register(PLC_BOILER_STOP_WATER, 0)
-                except:
-                    pass 
-            else:
-                self.modbusClient.write_register(PLC_BOILER_NEED_WATER, 0)
-
-            if regs[PLC_BOILER_WATER_VOLUME - 1] > regs[PLC_BOILER_WATER_VOLUME_HIGH - 1]:
-                # request turn off pump
-                try:
-                    self.modbusClient.write_register(PLC_BOILER_NEED_WATER, 0)
-                    self.modbusClient.write_register(PLC_BOILER_STOP_WATER, 1)
-                except:
-                    pass
             
-
-        except ConnectionException:
-            if not self.modbusClient.connect():
-                self.resetLabels()
+        except (ConnectionException, socket.error):
+            self.modbusClient.lost()
+            self.resetLabels()
         except:
             raise
         finally:
@@ -4,11 +4,11 @@
 import gi
 gi.require_version('Gtk', '3.0')
 from gi.repository import GLib, Gtk, Gdk, GObject
-from pymodbus.client.sync import ModbusTcpClient as ModbusClient
 from pymodbus.exceptions import ConnectionException
 
 import argparse
 import os
+import socket
 import sys
 import time
 
@@ -37,68 +37,34 @@ if len(sys.argv)==1:
 # Split and process arguments into "args"
 args = parser.parse_args()
 
-MODBUS_SLEEP=1
-
-# ******************* PLCs ************************
-# WATER PUMP
-PLC_WATERPUMP_VALVE = 0x01
-PLC_WATERPUMP_RATE = 0x02
-
-# FUEL
-PLC_FUEL_VALVE = 0x03
-PLC_FUEL_RATE = 0x04
-
-# BOILER
-PLC_BOILER = 0x05
-PLC_BOILER_TEMP = 0x06
-PLC_BOILER_WATER_VOLUME = 0x07
-PLC_BOILER_WATER_VOLUME_LOW = 0x08
-PLC_BOILER_WATER_VOLUME_HIGH = 0X09
-
-PLC_BOILER_NEED_WATER = 0x13
-PLC_BOILER_STOP_WATER = 0x14
-
-# CONDENSER
-PLC_CONDENSER_VALVE = 0x0a
-PLC_CONDENSER_WATER_VOLUME = 0x0b
-
-# TURBINE
-PLC_TURBINE_PRESSURE_HIGH = 0x0c
-PLC_TURBINE_PRESSURE = 0x0d
-PLC_TURBINE_RPMs = 0x11
+# Shared VirtuaPlant modules
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'common'))
+from modbus_connection import ConnectionManager, CONNECTING, ONLINE
+from trends import TrendRecorder
+from trend_panel import TrendPanel
 
-# GENERATOR
-PLC_GENERATOR_STATUS = 0x0e
-PLC_GENERATOR_OUTPUT = 0x0f
+MODBUS_SLEEP=1
 
-# PYLON
-PLC_PYLON_STATUS = 0x10
-PLC_PYLON_POWER = 0x12
+# PLC register tags
+from powerplant_tags import *
 
-# *************************************************
+# Registers shown by this PLC
+READ_PLAN = tags.plan_reads([
+    PLC_TURBINE_PRESSURE,
+    PLC_TURBINE_PRESSURE_HIGH,
+    PLC_TURBINE_RPMs,
+])
 
 
 STEAMRATE = [ 3, 2, 1, 0 ]
 RPMS = [50000, 30000, 10000, 0 ]
-
-WATERTOSTEAMRATE = [15, 5, 1, 0]
-
-FUEL_RATE = [ 'MAX', 'HIGH', 'MED', 'LOW' ] 
-
-CONDENSERATE = 6 # seconds to condense 
-
-
-PRESSUREMIN = 300
-PRESSUREMAX = 400
-
-PRESSURERELEASE = False
 # *************************************************
 
 class HMIWindow(Gtk.Window):
     
     def initModbus(self):
         # Create modbus connection to specified address and port
-        self.modbusClient = ModbusClient(args.server_addr, port=5020)
+        self.modbusClient = ConnectionManager(args.server_addr, 5020, on_status=self.connectionChanged)
 
     # Default values for the HMI labels
     def resetLabels(self):
@@ -155,17 +121,26 @@ class HMIWindow(Gtk.Window):
         grid.attach(turbine_plc_pressure_valve_value, 5, elementIndex, 1, 1)
         elementIndex += 1 
 
+        # Trends of the last hour
+        self.trends = TrendRecorder(self.modbusClient, [PLC_TURBINE_PRESSURE, PLC_TURBINE_RPMs])
+        self.trend_panels = [
+            TrendPanel("Pressure", self.trends.buffers[PLC_TURBINE_PRESSURE], color=(0.8, 0.4, 0.0)),
+            TrendPanel("RPMs", self.trends.buffers[PLC_TURBINE_RPMs]),
+        ]
+        for panel in self.trend_panels:
+            grid.attach(panel, 4, elementIndex, 4, 1)
+            elementIndex += 1
+
         # Attach Value Labels
         self.turbine_plc_online_value = turbine_plc_online_value
         self.turbine_plc_rpm_value = turbine_plc_rpm_value
         self.turbine_plc_pressure_value = turbine_plc_pressure_value
         self.turbine_plc_pressure_valve_value = turbine_plc_pressure_valve_value
 
-        self.CONDENSERATE = CONDENSERATE
-        self.ticks_to_condense = self.CONDENSERATE
-
         # Set default label values
         self.resetLabels()
+        self.modbusClient.start()
+        self.trends.start()
         GObject.timeout_add_seconds(MODBUS_SLEEP, self.update_status)
 
     # Control the feed pump register values
@@ -175,73 +150,49 @@ class HMIWindow(Gtk.Window):
         except:
             pass
 
-    def update_status(self):
+    # Called from the connection thread
+    def connectionChanged(self, state, retry_in):
+        GLib.idle_add(self.showConnectionStatus, state, retry_in)
 
-        try:
-            # Store the registers of the PLC in "rr"
-            rr = self.modbusClient.read_holding_registers(1,24)
-            regs = []
+    def showConnectionStatus(self, state, retry_in):
+        if state == ONLINE:
+            self.turbine_plc_online_value.set_markup("<span weight='bold' foreground='green'>ON</span>")
+        elif state == CONNECTING:
+            self.turbine_plc_online_value.set_markup("<span weight='bold' foreground='orange'>CONNECTING</span>")
+        else:
+            self.resetLabels()
+            self.turbine_plc_online_value.set_markup("<span weight='bold' foreground='red'>OFF (retry in %.0fs)</span>" % retry_in)
+        return False
 
-            # If we get back a blank response, something happened connecting to the PLC
-            if not rr or not rr.registers:
-                raise ConnectionException
-            
-            # Regs is an iterable list of register key:values
-            regs = rr.registers
+    def update_status(self):
+
+        if not self.modbusClient.online:
+            return True
 
-            if not regs or len(regs) < 16:
-                raise ConnectionException
+        try:
+            # Read the registers this PLC uses, keyed by address
+            regs = READ_PLAN.read(self.modbusClient)
             
             self.turbine_plc_online_value.set_markup("<span weight='bold' foreground='green'>ON</span>")
             
-            self.turbine_plc_pressure_value.set_markup("<span weight='bold' foreground='green'>" + str(regs[PLC_TURBINE_PRESSURE - 1]) + "</span>")
+            self.turbine_plc_pressure_value.set_markup("<span weight='bold' foreground='green'>" + str(regs[PLC_TURBINE_PRESSURE]) + "</span>")
+
+            for panel in self.trend_panels:
+                panel.queue_draw()
             
-            '''
-            STEAMRATE = [ 3, 2, 1, 0 ]
-            RPMS = [50000, 30000, 10000, 0 ]
-
-            WATERTOSTEAMRATE = [15, 5, 1, 0]
-
-            FUEL_RATE = [ 'MAX', 'HIGH', 'MED', 'LOW' ] 
-
-            if pressure > 500 open value until < 200
-
-            CONDENSERATE = 10
-            ticks_to_condense = CONDENSERATE
-            '''
-                                #3, 4, 5, 6
-            if regs[ PLC_BOILER_WATER_VOLUME - 1] > 0:
-                if regs[ PLC_FUEL_VALVE - 1] == 1:
-                    if regs[ PLC_BOILER_TEMP - 1 ] > 99: # BOILING                    
-                        rate = regs[PLC_FUEL_RATE - 1] - 3
-                        #index = FUEL_RATE.index( rate )
-                        self.turbine_plc_rpm_value.set_markup("<span weight='bold' foreground='green'>" + str( RPMS[ rate ] )  + "</span>")
-                        self.modbusClient.write_register( PLC_TURBINE_RPMs, STEAMRATE[ rate ] )
-                        currentpressure = regs[PLC_TURBINE_PRESSURE - 1]
-                        change = currentpressure + WATERTOSTEAMRATE[ rate ]
-                        self.modbusClient.write_register( PLC_TURBINE_PRESSURE, change)
-
-            if regs[ PLC_TURBINE_PRESSURE - 1 ] > PRESSUREMAX:
-                #PRESSURERELEASE = True
-                self.modbusClient.write_register( PLC_TURBINE_PRESSURE_HIGH, 1 )
-                
-
-            if regs[ PLC_TURBINE_PRESSURE_HIGH - 1 ] == 1:
+            # The soft-PLC in the world stores the steam rate, 3 (MAX) .. 0
+            steam = regs[PLC_TURBINE_RPMs]
+            if steam in STEAMRATE:
+                self.turbine_plc_rpm_value.set_markup("<span weight='bold' foreground='green'>" + str( RPMS[ STEAMRATE.index(steam) ] )  + "</span>")
+
+            if regs[PLC_TURBINE_PRESSURE_HIGH] == 1:
                 self.turbine_plc_pressure_valve_value.set_markup("<span weight='bold' foreground='green'>OPEN</span>")
-                if regs[ PLC_TURBINE_PRESSURE - 1 ] < PRESSUREMIN:
-                    #PRESSURERELEASE = False
-                    self.modbusClient.write_register( PLC_TURBINE_PRESSURE_HIGH, 0 )
-                else:
-                    currentpressure = regs[PLC_TURBINE_PRESSURE - 1]
-                    change = currentpressure - 15 # WATERTOSTEAMRATE[ rate ]
-                    self.modbusClient.write_register( PLC_TURBINE_PRESSURE, change)
             else:
                 self.turbine_plc_pressure_valve_value.set_markup("<span weight='bold' foreground='red'>CLOSED</span>")
-                             
 
-        except ConnectionException:
-            if not self.modbusClient.connect():
-                self.resetLabels()
+        except (ConnectionException, socket.error):
+            self.modbusClient.lost()
+            self.resetLabels()
         except:
             raise
         finally:
@@ -4,11 +4,11 @@
 import gi
 gi.require_version('Gtk', '3.0')
 from gi.repository import GLib, Gtk, Gdk, GObject
-from pymodbus.client.sync import ModbusTcpClient as ModbusClient
 from pymodbus.exceptions import ConnectionException
 
 import argparse
 import os
+import socket
 import sys
 import time
 
@@ -37,46 +37,21 @@ if len(sys.argv)==1:
 # Split and process arguments into "args"
 args = parser.parse_args()
 
-MODBUS_SLEEP=1
-
-
-# ******************* PLCs ************************
-# WATER PUMP
-PLC_WATERPUMP_VALVE = 0x01
-PLC_WATERPUMP_RATE = 0x02
-
-# FUEL
-PLC_FUEL_VALVE = 0x03
-PLC_FUEL_RATE = 0x04
-
-# BOILER
-PLC_BOILER = 0x05
-PLC_BOILER_TEMP = 0x06
-PLC_BOILER_WATER_VOLUME = 0x07
-PLC_BOILER_WATER_VOLUME_LOW = 0x08
-PLC_BOILER_WATER_VOLUME_HIGH = 0X09
+# Shared VirtuaPlant modules
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'common'))
+from modbus_connection import ConnectionManager, CONNECTING, ONLINE
 
-PLC_BOILER_NEED_WATER = 0x13
-PLC_BOILER_STOP_WATER = 0x14
-
-# CONDENSER
-PLC_CONDENSER_VALVE = 0x0a
-PLC_CONDENSER_WATER_VOLUME = 0x0b
-
-# TURBINE
-PLC_TURBINE_PRESSURE_HIGH = 0x0c
-PLC_TURBINE_PRESSURE_LOW = 0x0d
-PLC_TURBINE_RPMs = 0x11
+MODBUS_SLEEP=1
 
-# GENERATOR
-PLC_GENERATOR_STATUS = 0x0e
-PLC_GENERATOR_OUTPUT = 0x0f
 
-# PYLON
-PLC_PYLON_STATUS = 0x10
-PLC_PYLON_POWER = 0x12
+# PLC register tags
+from powerplant_tags import *
 
-# *************************************************
+# Registers shown by this PLC
+READ_PLAN = tags.plan_reads([
+    PLC_WATERPUMP_RATE,
+    PLC_WATERPUMP_VALVE,
+])
 
 
 # *************************************************
@@ -90,7 +65,7 @@ class HMIWindow(Gtk.Window):
     
     def initModbus(self):
         # Create modbus connection to specified address and port
-        self.modbusClient = ModbusClient(args.server_addr, port=5020)
+        self.modbusClient = ConnectionManager(args.server_addr, 5020, on_status=self.connectionChanged)
 
     # Default values for the HMI labels
     def resetLabels(self):
@@ -173,6 +148,7 @@ class HMIWindow(Gtk.Window):
 
         # Set default label values
         self.resetLabels()
+        self.modbusClient.start()
         GObject.timeout_add_seconds(MODBUS_SLEEP, self.update_status)
 
     # Control the Water Pump Register Values
@@ -189,46 +165,47 @@ class HMIWindow(Gtk.Window):
         except:
             pass
     
-    def update_status(self):
+    # Called from the connection thread
+    def connectionChanged(self, state, retry_in):
+        GLib.idle_add(self.showConnectionStatus, state, retry_in)
 
-        try:
-            # Store the registers of the PLC in "rr"
-            rr = self.modbusClient.read_holding_registers(1,24)
-            regs = []
+    def showConnectionStatus(self, state, retry_in):
+        if state == ONLINE:
+            self.waterpump_plc_online_value.set_markup("<span weight='bold' foreground='green'>ON</span>")
+        elif state == CONNECTING:
+            self.waterpump_plc_online_value.set_markup("<span weight='bold' foreground='orange'>CONNECTING</span>")
+        else:
+            self.resetLabels()
+            self.waterpump_plc_online_value.set_markup("<span weight='bold' foreground='red'>OFF (retry in %.0fs)</span>" % retry_in)
+        return False
 
-            # If we get back a blank response, something happened connecting to the PLC
-            if not rr or not rr.registers:
-                raise ConnectionException
-            
-            # Regs is an iterable list of register key:values
-            regs = rr.registers
+    def update_status(self):
+
+        if not self.modbusClient.online:
+            return True
 
-            if not regs or len(regs) < 16:
-                raise ConnectionException
+        try:
+            # Read the registers this PLC uses, keyed by address
+            regs = READ_PLAN.read(self.modbusClient)
 
             
             self.waterpump_plc_online_value.set_markup("<span weight='bold' foreground='green'>ON</span>")
             
-            if regs[PLC_WATERPUMP_RATE - 1] > 1:
-                rate = int( regs[PLC_WATERPUMP_RATE - 1]) - 3 
+            if regs[PLC_WATERPUMP_RATE] > 1:
+                rate = int( regs[PLC_WATERPUMP_RATE]) - 3 
                 
                 self.waterpump_plc_water_rate_value.set_markup("<span weight='bold' foreground='green'>" + str(WATER_RATE[rate]) + "</span>")
 
 
-            if regs[PLC_WATERPUMP_VALVE - 1] == 0:
+            if regs[PLC_WATERPUMP_VALVE] == 0:
                 self.waterpump_plc_valve_value.set_markup("<span weight='bold' foreground='red'>OFF</span>")
-            if regs[ PLC_WATERPUMP_VALVE - 1 ] == 1:
+            if regs[PLC_WATERPUMP_VALVE] == 1:
                 self.waterpump_plc_valve_value.set_markup("<span weight='bold' foreground='green'>ON</span>")
-           
 
-            if regs[PLC_BOILER_NEED_WATER - 1] == 1:
-                self.modbusClient.write_register(PLC_WATERPUMP_VALVE, 1)
-            elif regs[PLC_BOILER_STOP_WATER - 1] == 1:
-                self.modbusClient.write_register(PLC_WATERPUMP_VALVE, 0)
 
-        except ConnectionException:
-            if not self.modbusClient.connect():
-                self.resetLabels()
+        except (ConnectionException, socket.error):
+            self.modbusClient.lost()
+            self.resetLabels()
         except:
             raise
         finally:
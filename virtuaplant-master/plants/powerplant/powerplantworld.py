@@ -9,10 +9,7 @@ import logging
 from twisted.internet import reactor
 
 # - Modbus
-from pymodbus.server.async import StartTcpServer
 from pymodbus.device import ModbusDeviceIdentification
-from pymodbus.datastore import ModbusSequentialDataBlock
-from pymodbus.datastore import ModbusSlaveContext, ModbusServerContext
 from pymodbus.transaction import ModbusRtuFramer, ModbusAsciiFramer
 
 # - World Simulator
@@ -47,6 +44,28 @@ parser = MyParser(
 # Add a "-i" argument to receive a filename
 parser.add_argument("-t", action = "store", dest="server_addr",
 					help = "Modbus server IP address to listen on")
+parser.add_argument("--capture", action = "store", dest="capture",
+					help = "Record the Modbus traffic into this capture log")
+parser.add_argument("--client-rate", action = "store", dest="client_rate", type=float,
+					help = "Limit every Modbus client to this many requests a second")
+parser.add_argument("-s", action = "store", dest="scan_ms", type=float, default=10,
+					help = "Soft-PLC scan time in milliseconds (default 10)")
+parser.add_argument("--no-plc", action = "store_true", dest="no_plc",
+					help = "Do not run the control logic in the world; the PLCs run elsewhere")
+parser.add_argument("--model", action = "store_true", dest="model",
+					help = "Integrate boiler, turbine and condenser with the continuous model (needs NumPy)")
+parser.add_argument("--frame-overlay", action = "store_true", dest="frame_overlay",
+					help = "Show where each frame's time goes over the world view")
+parser.add_argument("--frame-stats", action = "store", dest="frame_stats",
+					help = "Write frame phase timings as JSON lines into this file ('-' for stdout)")
+parser.add_argument("--metrics", action = "store", dest="metrics", type=int,
+					help = "Serve Prometheus metrics on this local port")
+parser.add_argument("--profile", action = "store", dest="profile",
+					help = "Profile the world on SIGUSR1, writing the results into this directory")
+parser.add_argument("--profile-seconds", action = "store", dest="profile_seconds", type=float, default=10,
+					help = "Seconds a SIGUSR1 profile runs for (default 10)")
+parser.add_argument("--profile-register", action = "store_true", dest="profile_register",
+					help = "Also profile for as many seconds as are written into holding register 98")
 
 # Print help if no args are supplied
 if len(sys.argv)==1:
@@ -70,43 +89,20 @@ FPS = 50.0 # 50.0
 MODBUS_SERVER_PORT = 5020
 
 
-# ******************* PLCs ************************
-# WATER PUMP
-PLC_WATERPUMP_VALVE = 0x01
-PLC_WATERPUMP_RATE = 0x02
+# PLC register tags and control logic
+from powerplant_tags import *
+from powerplant_logic import programs, write_defaults
+from softplc import ScanEngine
+from plant_server import StartPlantServer, create_context
+from frame_timer import FrameTimer
+from metrics import StartMetricsServer, WorldMetrics
+from profiler import SamplingProfiler, StartProfiler, name_thread
 
-# FUEL
-PLC_FUEL_VALVE = 0x03
-PLC_FUEL_RATE = 0x04
+# Time spent in each phase of a frame
+frame_timer = FrameTimer(1/FPS, stream=args.frame_stats)
 
-# BOILER
-PLC_BOILER = 0x05
-PLC_BOILER_TEMP = 0x06
-PLC_BOILER_WATER_VOLUME = 0x07
-PLC_BOILER_WATER_VOLUME_LOW = 0x08
-PLC_BOILER_WATER_VOLUME_HIGH = 0X09
-
-PLC_BOILER_NEED_WATER = 0x13
-PLC_BOILER_STOP_WATER = 0x14
-
-# CONDENSER
-PLC_CONDENSER_VALVE = 0x0a
-PLC_CONDENSER_WATER_VOLUME = 0x0b
-
-# TURBINE
-PLC_TURBINE_PRESSURE_HIGH = 0x0c
-PLC_TURBINE_PRESSURE = 0x0d
-PLC_TURBINE_RPMs = 0x11
-
-# GENERATOR
-PLC_GENERATOR_STATUS = 0x0e
-PLC_GENERATOR_OUTPUT = 0x0f
-
-# PYLON
-PLC_PYLON_STATUS = 0x10
-PLC_PYLON_POWER = 0x12
-
-# *************************************************
+# Frame times, particles, collisions and Modbus traffic for --metrics
+metrics = WorldMetrics(frame_timer)
 
 
 # Collision Types
@@ -115,13 +111,17 @@ ball_collision = 0x5
 condenser_outlet_valve_collision = 0x6
 highpressure_outlet_valve_collision = 0x6
 
-# Functions to set PLC Values
+# Functions to set PLC Values (decoded per tag type, the boiler volume is a float)
 def PLCSetTag(addr, value):
-    context[0x00].setValues(3, addr, [value])
+    tags.lookup(addr).write(context[0x00], value)
 
 # Helper function that returns PLC values
 def PLCGetTag(addr):
-    return context[0x00].getValues(3, addr, count=1)[0]
+    return tags.lookup(addr).read(context[0x00])
+
+# Tag I/O counts as its own phase, wherever in the frame it happens
+PLCSetTag = frame_timer.timed('tag_io', PLCSetTag)
+PLCGetTag = frame_timer.timed('tag_io', PLCGetTag)
 
 0
 def to_pygame(p):
@@ -391,16 +391,20 @@ def draw_lines(screen, lines, color = None):
 
 # Default collision function for objects
 # Returning true makes the two objects collide normally just like "walls/pipes"
+@metrics.counted
 def no_collision(space, arbiter, *args, **kwargs):
     return True 
 
+@metrics.counted
 def valve_open(space, arbiter, *args, **kwargs):
     return False
 
+@metrics.counted
 def valve_closed(space, arbiter, *args, **kwargs):
     return True
 
 def run_world():
+    name_thread('world')
     pygame.init()
     pygame.font.init()
     myfont = pygame.font.SysFont('Comic Sans MS', 30 ) # font for on screen error handling
@@ -495,6 +499,9 @@ def run_world():
     POWERRATE = 5
     ticks_to_power = POWERRATE
 
+    metrics.particles.update({'fire': fires, 'water': waters, 'condenser_water': condenserwater,
+                              'steam': steams, 'steam_release': steamstorelease,
+                              'spark': generatorsparks, 'power': powerguage})
 
     #  NEW VARIABLES OUTSIDE OF ANIMATION
     plcFUELRATE = 5
@@ -504,8 +511,10 @@ def run_world():
     PLCSetTag(PLC_WATERPUMP_RATE, plcWATERRATE)
 
     while running:
+        frame_timer.frame()
         # Advance the game clock
         clock.tick(FPS)
+        frame_timer.mark('wait')
                 
         for event in pygame.event.get():
             if event.type == QUIT:
@@ -518,12 +527,13 @@ def run_world():
                     PLCSetTag( PLC_WATERPUMP_VALVE, 0)
                     PLCSetTag( PLC_FUEL_VALVE, 1)
                     PLCSetTag( PLC_TURBINE_PRESSURE, 250)
-                
+        frame_timer.mark('input')
 
         # Load the background picture for the pipe images
         bg = pygame.image.load("powerplant.jpg") #pygame.image.load("oil_unit.png")
         # Background color
         screen.fill(THECOLORS["white"])
+        frame_timer.mark('draw')
 
         if PLCGetTag(PLC_CONDENSER_VALVE) == 1:
             space.add_collision_handler( condenser_outlet_valve_collision, ball_collision, begin=valve_open )
@@ -566,9 +576,8 @@ def run_world():
                 change = 6
             plcWATERRATE = change
             PLCSetTag(PLC_WATERPUMP_RATE, plcWATERRATE)    
+        frame_timer.mark('logic')
 
-
-        fire_to_remove = []          
         if PLCGetTag(PLC_FUEL_VALVE) == 1:
             ticks_to_next_fire -= 1
 
@@ -578,16 +587,21 @@ def run_world():
                     fire_shape = add_fire(air)
                     fire_shape.body.position = burner.body.position
                     fires.append(fire_shape)
+        frame_timer.mark('spawn')
+
+        for fire in fires:
+            draw_ball(bg, fire, 'red')
+        frame_timer.mark('draw')
 
+        fire_to_remove = []          
         for fire in fires:
             if fire.body.position.y < 0 or fire.body.position.y > 170:
                 fire_to_remove.append(fire)
 
-            draw_ball(bg, fire, 'red')
-
         for fire in fire_to_remove:
             air.remove(fire, fire.body)
             fires.remove(fire)
+        frame_timer.mark('cull')
         # end - Fuel / Fire
 
 
@@ -630,6 +644,7 @@ def run_world():
                 water_shape.body.position.x = 240
                 water_shape.body.position.y = 325
                 condenserwater.append(water_shape)
+        frame_timer.mark('spawn')
 
         for water in waters:
             draw_ball( bg, water, 'blue')
@@ -640,10 +655,12 @@ def run_world():
                 if (water.body.position.y + 10) < condenser_valve.body.position.y:
                     waters.append(water)
                     condenserwater.remove(water)
+        frame_timer.mark('draw')
 
         for water in water_to_remove:
         	space.remove(water, water.body)
         	waters.remove(water)
+        frame_timer.mark('cull')
 
         # end - Boiler
 
@@ -671,13 +688,19 @@ def run_world():
                 steam_shape.body.position = turbinepressurereleasevalve.body.position
                 steam_shape.body.position.y = turbinepressurereleasevalve.body.position.y + 5
                 steamstorelease.append(steam_shape)
+        frame_timer.mark('spawn')
+
+        for steam in steams:
+            draw_ball(bg, steam, 'gray')
+        for steam in steamstorelease:
+            draw_ball(bg, steam, 'gray')
+        frame_timer.mark('draw')
 
         steamtoremove = []
         steamsturbine = []
 
 
         for steam in steams:
-            draw_ball(bg, steam, 'gray')
             if steam.body.position.y > 465:
                 steamsturbine.append(steam)
 
@@ -692,13 +715,13 @@ def run_world():
         steamtoremove = []
 
         for steam in steamstorelease:
-            draw_ball(bg, steam, 'gray')
             if steam.body.position.y > 600:
                 steamtoremove.append(steam)
 
         for steam in steamtoremove:
             air.remove(steam, steam.body)
             steamstorelease.remove(steam)
+        frame_timer.mark('cull')
 
 
         # Generator
@@ -724,9 +747,11 @@ def run_world():
                 for spark in generatorsparks:
                     space.remove(spark)
                     generatorsparks.remove(spark)
+        frame_timer.mark('spawn')
 
         for spark in generatorsparks:
             draw_lines(bg, spark, random.choice(SPARKCOLORS) )
+        frame_timer.mark('draw')
 
 
         if (PLCGetTag(PLC_PYLON_STATUS) == 1) and (PLCGetTag(PLC_GENERATOR_OUTPUT) > 0) and (PLCGetTag(PLC_GENERATOR_STATUS) == 1) :
@@ -737,19 +762,24 @@ def run_world():
                 power_shape.body.position = electricmain.body.position
                 power_shape.body.position.y -= 3
                 powerguage.append(power_shape)
-
-        powerguageremove = []
+        frame_timer.mark('spawn')
 
         for power in powerguage :
             color = ('gold', 'green', 'red')
             select = PLCGetTag(PLC_GENERATOR_OUTPUT) - 1
             draw_ball(bg, power, color[select])
+        frame_timer.mark('draw')
+
+        powerguageremove = []
+
+        for power in powerguage :
             if power.body.position.y <= 200:
                 powerguageremove.append(power)
 
         for power in powerguageremove:
             space.remove(power)
             powerguage.remove(power)        
+        frame_timer.mark('cull')
 
         # Drawing Objects on Screen
         draw_lines(bg, boiler)
@@ -775,23 +805,21 @@ def run_world():
 
         screen.blit(bg, (0, 0))
         screen.blit(textsurface, (0,0))
+        if args.frame_overlay:
+            frame_timer.draw(screen, (5, SCREEN_HEIGHT - 150))
+        frame_timer.mark('draw')
 
         space.step(1/FPS) 
         air.step(1/FPS)
+        frame_timer.mark('physics')
         pygame.display.flip()
+        frame_timer.mark('flip')
 
     if reactor.running:
         reactor.callFromThread(reactor.stop)
 
 
-store = ModbusSlaveContext(
-    di = ModbusSequentialDataBlock(0, [0]*100),
-    co = ModbusSequentialDataBlock(0, [0]*100),
-    hr = ModbusSequentialDataBlock(0, [0]*100),
-    ir = ModbusSequentialDataBlock(0, [0]*100))
-
-
-context = ModbusServerContext(slaves=store, single=True)
+context = create_context()
 
 # Modbus PLC server information
 identity = ModbusDeviceIdentification()
@@ -803,10 +831,33 @@ identity.ModelName   = 'Simmons ORP 3850'
 identity.MajorMinorRevision = '2.09.01'
 
 def startModbusServer():
+    if args.metrics:
+        StartMetricsServer(metrics, args.metrics)
+    if args.profile:
+        StartProfiler(SamplingProfiler(args.profile), args.profile_seconds,
+                      context if args.profile_register else None)
     # Run a modbus server on specified address and modbus port (5020)
-    StartTcpServer(context, identity=identity, address=(args.server_addr, MODBUS_SERVER_PORT))
+    StartPlantServer(context, identity=identity, address=(args.server_addr, MODBUS_SERVER_PORT),
+                     capture=args.capture, client_rate=args.client_rate, metrics=metrics)
+
+def startPLC():
+    # Run the control logic next to the datastore
+    write_defaults(context[0x00])
+    engine = ScanEngine(context[0x00], scan_time=args.scan_ms / 1000.0, tags=tags)
+    if args.model:
+        from powerplant_model import ModelProgram
+        engine.add(ModelProgram())
+    for program in programs(process=not args.model):
+        engine.add(program)
+    engine.start()
+    reactor.addSystemEventTrigger('before', 'shutdown', lambda: log.info(engine.summary()))
+    reactor.addSystemEventTrigger('before', 'shutdown', engine.stop)
+    return engine
 
 def main():
+    if not args.no_plc:
+        startPLC()
+    reactor.addSystemEventTrigger('after', 'shutdown', frame_timer.close)
     reactor.callInThread(run_world)
     startModbusServer()
 